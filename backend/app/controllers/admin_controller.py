@@ -0,0 +1,90 @@
+"""
+管理控制器
+提供性能跟踪的查询和下载，以及任务状态的查询
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse
+import logging
+import os
+import secrets
+from typing import Optional
+
+from services.excel_service import result_cache_dir
+from services.job_store import JobStore
+from services.job_trace import trace_store
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# 未启用结果缓存时没有任务记录
+job_dir = result_cache_dir()
+job_store = JobStore(job_dir) if job_dir else None
+
+# 管理接口的访问令牌，通过请求头 X-Admin-Token 提供；未设置时管理接口不可用
+ADMIN_TOKEN_ENV = "EXCEL_ADMIN_TOKEN"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+def require_admin(request: Request):
+    """
+    校验管理接口的访问权限
+
+    不按客户端地址放行：经同机反向代理转发时，所有请求都来自本机地址。
+
+    Raises:
+        HTTPException: 未配置令牌时返回 404，令牌不正确时返回 403
+    """
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    provided = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    if not secrets.compare_digest(provided.encode("utf-8"), token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="管理令牌无效")
+
+@router.get("/admin/traces", dependencies=[Depends(require_admin)])
+async def list_traces(request_id: Optional[str] = None):
+    """
+    列出已保存的性能跟踪（按时间倒序）
+
+    Args:
+        request_id: 只列出客户端请求 ID 为该值的跟踪
+
+    Returns:
+        dict: 跟踪列表，包含跟踪 ID、请求 ID、文件大小和保存时间
+    """
+    return {"traces": trace_store.list(request_id)}
+
+@router.get("/admin/traces/{trace_id}", dependencies=[Depends(require_admin)])
+async def download_trace(trace_id: str):
+    """
+    下载指定的性能跟踪
+
+    文件为 Chrome Trace Event 格式，可在 chrome://tracing 或 https://ui.perfetto.dev 中打开。
+
+    Args:
+        trace_id: 跟踪 ID（开启跟踪时响应头 X-Trace-ID 中返回）
+
+    Returns:
+        FileResponse: 跟踪文件
+    """
+    path = trace_store.get(trace_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"没有跟踪 {trace_id}")
+
+    return FileResponse(path, media_type="application/json", filename=f"trace-{trace_id}.json")
+
+@router.get("/admin/jobs", dependencies=[Depends(require_admin)])
+async def list_jobs(limit: int = 50):
+    """
+    列出最近的任务（所有工作进程共享）
+
+    Args:
+        limit: 返回的最大数量
+
+    Returns:
+        dict: 是否启用任务存储，以及任务列表（包含状态、处理进程、耗时和结果命中次数）
+    """
+    if job_store is None:
+        return {"enabled": False, "jobs": []}
+    return {"enabled": True, "jobs": job_store.jobs(max(1, min(limit, 1000)))}
@@ -3,26 +3,51 @@ Excel 控制器
 处理 Excel 相关的 HTTP 请求
 """
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import anyio
 import logging
 import io
 import os
-from typing import List
+import zipfile
+from typing import List, Iterator, AsyncIterator, Callable, Optional, Union, BinaryIO
 
-from services.excel_service import ExcelService
+from services.excel_service import ExcelService, result_cache_dir
+from services.job_trace import JobTrace, is_valid_request_id, trace_store
+from services.row_filter import RowFilter
+from utils.cancellation import CancelToken, JobCancelled
 from utils.file_utils import validate_excel_file, generate_filename
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 # 创建 Excel 服务实例
-excel_service = ExcelService()
+excel_service = ExcelService(job_dir=result_cache_dir())
+
+# 上传内容超过此大小时已被写入临时文件（与 starlette 表单解析的内存阈值一致）
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+# 开启跟踪的请求头（或查询参数 trace），以及跟踪结果使用的请求 ID
+TRACE_HEADER = "X-Trace"
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACE_ID_HEADER = "X-Trace-ID"
+
+# 处理期间检查客户端是否断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# 客户端在处理完成前断开时的状态码（沿用 nginx 的 499 Client Closed Request）
+CLIENT_CLOSED_REQUEST = 499
 
 @router.post("/excel/delete-columns")
 async def delete_excel_columns(
+    request: Request,
     file: UploadFile = File(..., description="要处理的 Excel 文件"),
-    columns: str = Form(..., description="要删除的列索引，用逗号分隔，如：3,5")
+    columns: str = Form(..., description="要删除的列索引，用逗号分隔，如：3,5"),
+    stream: bool = Form(False, description="是否以流式方式返回，处理过程中即开始发送数据"),
+    drop_blank_rows: bool = Form(False, description="是否删除空行"),
+    drop_rows_matching: str = Form("", description="删除指定列等于某些值的行，如：3=离职|退休;5="),
+    dedupe_columns: str = Form("", description="按这些列去重（保留首次出现的行），如：1,2")
 ):
     """
     删除 Excel 文件中的指定列
@@ -30,58 +55,354 @@ async def delete_excel_columns(
     Args:
         file: 上传的 Excel 文件
         columns: 要删除的列索引字符串，如 "3,5,7"
+        stream: 为 True 时边处理边发送，避免大文件长时间无响应
+        drop_blank_rows: 是否删除空行
+        drop_rows_matching: 行删除条件，如 "3=离职|退休;5="
+        dedupe_columns: 去重依据的列索引字符串，如 "1,2"
+    
+    行过滤条件中的列号均指原始文件中的列，第一行作为表头始终保留。
+    请求头 X-Trace 或查询参数 trace 为 1 时记录本次处理的性能跟踪，见 start_trace。
+    客户端在处理完成前断开时取消处理，见 run_until_disconnected 和 iterate_chunks。
     
     Returns:
         StreamingResponse: 处理后的 Excel 文件
     """
+    trace = None
     try:
         # 验证文件
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="未选择文件")
-        
-        # 验证文件类型
-        if not validate_excel_file(file.filename):
-            raise HTTPException(
-                status_code=400, 
-                detail="不支持的文件格式，请上传 .xlsx 或 .xls 文件"
-            )
+        validate_upload(file)
         
-        # 解析列索引
+        # 解析列索引和行过滤条件
         try:
             column_indices = parse_column_indices(columns)
+            row_filter = parse_row_filter(drop_blank_rows, drop_rows_matching, dedupe_columns)
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
         
         logger.info(f"处理文件: {file.filename}, 删除列: {column_indices}")
+        if row_filter is not None:
+            logger.info(f"行过滤条件: {row_filter.describe()}")
         
         # 读取文件内容
-        file_content = await file.read()
-        
-        # 处理 Excel 文件
-        processed_content = excel_service.delete_columns(file_content, column_indices)
+        file_content = await read_upload(file)
+        trace = start_trace(request, "delete-columns", file.filename)
         
-        # 生成新文件名
-        new_filename = generate_filename(file.filename, "_processed")
+        if stream:
+            ensure_streamable(file_content)
+            cancel = CancelToken()
+            # 映射输入、检查工作簿结构和计算摘要都在创建迭代器时完成，不能占用事件循环
+            chunks = await run_in_threadpool(
+                excel_service.stream_delete_columns,
+                file_content, column_indices, row_filter, trace=trace, cancel=cancel
+            )
+            body = iterate_chunks(chunks, cancel, trace)
+        else:
+            # 处理 Excel 文件
+            processed_content = await run_until_disconnected(
+                request, excel_service.delete_columns, file_content, column_indices, row_filter, trace=trace
+            )
+            finish_trace(trace)
+            body = io.BytesIO(processed_content)
         
         # 返回处理后的文件
-        # 处理中文文件名编码问题
-        from urllib.parse import quote
-        encoded_filename = quote(new_filename.encode('utf-8'))
-        
-        return StreamingResponse(
-            io.BytesIO(processed_content),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
-            }
-        )
+        return file_response(file.filename, body, trace)
+        
+    except JobCancelled as e:
+        raise await cancelled_error(file, trace, e)
+    except HTTPException as e:
+        finish_trace(trace, e.detail)
+        raise
+    except Exception as e:
+        finish_trace(trace, str(e))
+        logger.error(f"处理 Excel 文件时出错: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"处理文件时出错: {str(e)}")
+
+@router.post("/excel/project-columns")
+async def project_excel_columns(
+    request: Request,
+    file: UploadFile = File(..., description="要处理的 Excel 文件"),
+    columns: str = Form(..., description="要保留的列索引，按输出顺序用逗号分隔，如：3,1,2"),
+    stream: bool = Form(False, description="是否以流式方式返回，处理过程中即开始发送数据"),
+    drop_blank_rows: bool = Form(False, description="是否删除空行"),
+    drop_rows_matching: str = Form("", description="删除指定列等于某些值的行，如：3=离职|退休;5="),
+    dedupe_columns: str = Form("", description="按这些列去重（保留首次出现的行），如：1,2")
+):
+    """
+    按指定顺序保留 Excel 文件中的列，可同时实现删除和重排
+    
+    Args:
+        file: 上传的 Excel 文件
+        columns: 要保留的列索引字符串，按输出顺序排列，如 "3,1,2"
+        stream: 为 True 时边处理边发送
+        drop_blank_rows: 是否删除空行
+        drop_rows_matching: 行删除条件，如 "3=离职|退休;5="
+        dedupe_columns: 去重依据的列索引字符串，如 "1,2"
+    
+    Returns:
+        StreamingResponse: 处理后的 Excel 文件
+    """
+    trace = None
+    try:
+        validate_upload(file)
+        
+        try:
+            column_order = parse_column_order(columns)
+            row_filter = parse_row_filter(drop_blank_rows, drop_rows_matching, dedupe_columns)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        logger.info(f"处理文件: {file.filename}, 保留列: {column_order}")
+        if row_filter is not None:
+            logger.info(f"行过滤条件: {row_filter.describe()}")
+        
+        file_content = await read_upload(file)
+        trace = start_trace(request, "project-columns", file.filename)
+        
+        if stream:
+            ensure_streamable(file_content)
+            cancel = CancelToken()
+            chunks = await run_in_threadpool(
+                excel_service.stream_project_columns,
+                file_content, column_order, row_filter, trace=trace, cancel=cancel
+            )
+            body = iterate_chunks(chunks, cancel, trace)
+        else:
+            processed_content = await run_until_disconnected(
+                request, excel_service.project_columns, file_content, column_order, row_filter, trace=trace
+            )
+            finish_trace(trace)
+            body = io.BytesIO(processed_content)
+        
+        return file_response(file.filename, body, trace)
         
-    except HTTPException:
+    except JobCancelled as e:
+        raise await cancelled_error(file, trace, e)
+    except HTTPException as e:
+        finish_trace(trace, e.detail)
         raise
     except Exception as e:
+        finish_trace(trace, str(e))
         logger.error(f"处理 Excel 文件时出错: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"处理文件时出错: {str(e)}")
 
+def validate_upload(file: UploadFile):
+    """
+    验证上传的文件
+    
+    Args:
+        file: 上传的文件
+    
+    Raises:
+        HTTPException: 未选择文件或文件格式不支持时
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="未选择文件")
+    
+    # 验证文件类型
+    if not validate_excel_file(file.filename):
+        raise HTTPException(
+            status_code=400, 
+            detail="不支持的文件格式，请上传 .xlsx 或 .xls 文件"
+        )
+
+async def read_upload(file: UploadFile) -> Union[bytes, BinaryIO]:
+    """
+    获取上传文件的内容
+    
+    超过内存阈值的上传已被写入临时文件，直接返回文件对象，
+    由服务通过 mmap 读取，避免再复制一份到内存中；小文件读出字节内容。
+    大小未知时同样返回文件对象，映射前取文件描述符会使其写入磁盘。
+    
+    Args:
+        file: 上传的文件
+    
+    Returns:
+        Union[bytes, BinaryIO]: 文件内容或临时文件对象
+    """
+    if file.size is None or file.size > UPLOAD_SPOOL_SIZE:
+        return file.file
+    return await file.read()
+
+def ensure_streamable(file_content: Union[bytes, BinaryIO]):
+    """
+    流式模式下响应头会立即发送，格式错误只能在此之前发现
+    
+    Args:
+        file_content: 文件二进制内容或文件对象
+    
+    Raises:
+        HTTPException: 文件不是 zip 格式（如 .xls）时
+    """
+    if isinstance(file_content, bytes):
+        file_content = io.BytesIO(file_content)
+    if not zipfile.is_zipfile(file_content):
+        raise HTTPException(status_code=400, detail="文件不是有效的 .xlsx 文件，无法流式处理")
+
+def start_trace(request: Request, operation: str, filename: str) -> Optional[JobTrace]:
+    """
+    根据请求头 X-Trace 或查询参数 trace 决定是否跟踪本次处理
+    
+    取值为 1/true 时记录各处理阶段的耗时，为 profile 时同时采样调用栈。
+    跟踪结果以服务端生成的跟踪 ID 为键保存，在响应头 X-Trace-ID 中返回，
+    可通过 /api/admin/traces/{跟踪 ID} 下载；请求头 X-Request-ID 只作为标签随跟踪保存并原样返回。
+    
+    Args:
+        request: 当前请求
+        operation: 操作名称
+        filename: 上传的文件名
+    
+    Returns:
+        Optional[JobTrace]: 未开启跟踪时返回 None
+    """
+    flag = (request.headers.get(TRACE_HEADER) or request.query_params.get("trace") or "").strip().lower()
+    if flag not in ("1", "true", "yes", "on", "profile"):
+        return None
+    
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    trace = JobTrace(request_id if is_valid_request_id(request_id) else None, operation,
+                     profile=(flag == "profile"), args={"filename": filename})
+    logger.info(f"跟踪请求 {trace.trace_id}" + (f"（请求 ID {trace.request_id}）" if trace.request_id else "")
+                + ("（含调用栈采样）" if flag == "profile" else ""))
+    return trace
+
+def trace_headers(trace: Optional[JobTrace]) -> dict:
+    """开启跟踪时在响应中返回的跟踪 ID 和请求 ID"""
+    if trace is None:
+        return {}
+    headers = {TRACE_ID_HEADER: trace.trace_id}
+    if trace.request_id:
+        headers[REQUEST_ID_HEADER] = trace.request_id
+    return headers
+
+def finish_trace(trace: Optional[JobTrace], error: Optional[str] = None):
+    """
+    结束跟踪并保存结果，保存失败不影响请求
+    
+    Args:
+        trace: 本次处理的跟踪，为 None 时不做任何事
+        error: 处理失败时的错误信息
+    """
+    if trace is None:
+        return
+    try:
+        trace_store.save(trace.trace_id, trace.finish(error), trace.request_id)
+    except OSError as e:
+        logger.warning(f"保存跟踪 {trace.trace_id} 失败: {str(e)}")
+
+async def run_until_disconnected(request: Request, func: Callable, *args, **kwargs):
+    """
+    在线程池中执行处理，同时监听客户端连接
+    
+    处理函数通过 cancel 参数接收取消令牌。客户端断开后令牌被取消，处理在下一个
+    检查点（工作表之间、行块之间、openpyxl 读写文件时）抛出 JobCancelled，并释放已占用的内存。
+    
+    Args:
+        request: 当前请求
+        func: 处理函数，需要接受 cancel 参数
+        *args, **kwargs: 处理函数的其他参数
+    
+    Returns:
+        处理函数的返回值
+    
+    Raises:
+        JobCancelled: 客户端断开、处理被取消时
+    """
+    cancel = CancelToken()
+    
+    async def watch_disconnect():
+        while not await request.is_disconnected():
+            await anyio.sleep(DISCONNECT_POLL_INTERVAL)
+        logger.info("客户端已断开连接，取消处理")
+        cancel.cancel()
+    
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(watch_disconnect)
+        try:
+            return await run_in_threadpool(func, *args, cancel=cancel, **kwargs)
+        finally:
+            task_group.cancel_scope.cancel()
+
+async def cancelled_error(file: UploadFile, trace: Optional[JobTrace], error: JobCancelled) -> HTTPException:
+    """
+    处理被取消后记录跟踪、关闭上传的临时文件，并生成给（已断开的）客户端的错误
+    
+    Args:
+        file: 上传的文件
+        trace: 本次处理的跟踪
+        error: 取消处理的异常
+    
+    Returns:
+        HTTPException: 状态码为 499 的错误
+    """
+    finish_trace(trace, f"已取消: {error}")
+    await file.close()
+    return HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=f"处理已取消: {error}")
+
+def file_response(original_filename: str, body, trace: Optional[JobTrace] = None) -> StreamingResponse:
+    """
+    构造处理结果的下载响应
+    
+    Args:
+        original_filename: 上传时的文件名
+        body: 响应内容（文件对象或异步迭代器）
+        trace: 本次处理的跟踪，存在时在响应头中返回请求 ID
+    
+    Returns:
+        StreamingResponse: 下载响应
+    """
+    # 生成新文件名
+    new_filename = generate_filename(original_filename, "_processed")
+    
+    # 处理中文文件名编码问题
+    from urllib.parse import quote
+    encoded_filename = quote(new_filename.encode('utf-8'))
+    
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
+    }
+    headers.update(trace_headers(trace))
+    
+    return StreamingResponse(
+        body,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=headers
+    )
+
+async def iterate_chunks(chunks: Iterator[bytes], cancel: CancelToken,
+                         trace: Optional[JobTrace] = None) -> AsyncIterator[bytes]:
+    """
+    在线程池中逐块拉取同步迭代器的输出，避免阻塞事件循环
+    
+    客户端断开时 StreamingResponse 会取消本协程，此时通过取消令牌通知后台处理停止。
+    
+    Args:
+        chunks: 同步的数据块迭代器
+        cancel: 生成数据块的处理所使用的取消令牌
+        trace: 本次处理的跟踪，输出结束后保存
+    
+    Returns:
+        AsyncIterator[bytes]: 异步数据块迭代器
+    """
+    error = None
+    finished = False
+    try:
+        while True:
+            # 等待可以被取消：处理尚未产生输出（如正在加载工作簿）时客户端断开也能立即响应
+            chunk = await anyio.to_thread.run_sync(next, chunks, None, cancellable=True)
+            if chunk is None:
+                break
+            yield chunk
+        finished = True
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        if not finished:
+            # 本协程已被取消时无法再等待，只能同步通知后台处理在下一个检查点退出
+            cancel.cancel()
+            error = error or f"已取消: {cancel.reason}"
+        finish_trace(trace, error)
+
 def parse_column_indices(columns_str: str) -> List[int]:
     """
     解析列索引字符串
@@ -127,8 +448,84 @@ def parse_column_indices(columns_str: str) -> List[int]:
     except Exception as e:
         raise ValueError(f"解析列索引时出错: {str(e)}")
 
+def parse_column_order(columns_str: str) -> List[int]:
+    """
+    解析要保留的列及其顺序
+    
+    与 parse_column_indices 不同，这里保持输入顺序，不排序也不去重。
+    
+    Args:
+        columns_str: 列索引字符串，如 "3,1,2"
+    
+    Returns:
+        List[int]: 按输出顺序排列的列索引列表
+    
+    Raises:
+        ValueError: 当输入格式不正确或有重复列时
+    """
+    column_parts = [part.strip() for part in columns_str.split(',') if part.strip()]
+    if not column_parts:
+        raise ValueError("列索引不能为空")
+    
+    column_order = []
+    for part in column_parts:
+        if not part.isdigit():
+            raise ValueError(f"列索引必须是正整数: {part}")
+        
+        col_index = int(part)
+        if col_index < 1:
+            raise ValueError(f"列索引必须大于 0: {col_index}")
+        if col_index in column_order:
+            raise ValueError(f"列索引重复: {col_index}")
+        
+        column_order.append(col_index)
+    
+    return column_order
+
+def parse_row_filter(drop_blank_rows: bool, drop_rows_matching: str,
+                     dedupe_columns: str) -> Optional[RowFilter]:
+    """
+    解析行过滤条件
+    
+    Args:
+        drop_blank_rows: 是否删除空行
+        drop_rows_matching: 行删除条件字符串，如 "3=离职|退休;5="，
+            分号分隔多个条件，竖线分隔同一列的多个值，值为空表示删除该列为空的行
+        dedupe_columns: 去重依据的列索引字符串，如 "1,2"
+    
+    Returns:
+        Optional[RowFilter]: 行过滤条件，未设置任何条件时返回 None
+    
+    Raises:
+        ValueError: 当输入格式不正确时
+    """
+    drop_values = {}
+    for condition in drop_rows_matching.split(';'):
+        if not condition.strip():
+            continue
+        if '=' not in condition:
+            raise ValueError(f"行删除条件格式错误，应为 列号=值: {condition}")
+        
+        col_part, values_part = condition.split('=', 1)
+        col_part = col_part.strip()
+        if not col_part.isdigit() or int(col_part) < 1:
+            raise ValueError(f"行删除条件中的列索引必须是正整数: {col_part}")
+        
+        drop_values.setdefault(int(col_part), set()).update(values_part.split('|'))
+    
+    dedupe_indices = parse_column_indices(dedupe_columns) if dedupe_columns.strip() else []
+    
+    row_filter = RowFilter(
+        drop_blank=drop_blank_rows,
+        drop_values=drop_values,
+        dedupe_columns=dedupe_indices
+    )
+    return row_filter if row_filter.active else None
+
 @router.post("/excel/preview")
 async def preview_excel_columns(
+    request: Request,
+    response: Response,
     file: UploadFile = File(..., description="要预览的 Excel 文件")
 ):
     """
@@ -140,34 +537,36 @@ async def preview_excel_columns(
     Returns:
         dict: 包含列信息的字典
     """
+    trace = None
     try:
         # 验证文件
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="未选择文件")
-        
-        # 验证文件类型
-        if not validate_excel_file(file.filename):
-            raise HTTPException(
-                status_code=400, 
-                detail="不支持的文件格式，请上传 .xlsx 或 .xls 文件"
-            )
+        validate_upload(file)
         
         logger.info(f"预览文件: {file.filename}")
         
         # 读取文件内容
-        file_content = await file.read()
+        file_content = await read_upload(file)
+        trace = start_trace(request, "preview", file.filename)
         
         # 获取列信息
-        columns_info = excel_service.get_columns_info(file_content)
+        columns_info = await run_until_disconnected(
+            request, excel_service.get_columns_info, file_content, trace=trace
+        )
+        finish_trace(trace)
+        response.headers.update(trace_headers(trace))
         
         return {
             "filename": file.filename,
             "columns": columns_info
         }
         
-    except HTTPException:
+    except JobCancelled as e:
+        raise await cancelled_error(file, trace, e)
+    except HTTPException as e:
+        finish_trace(trace, e.detail)
         raise
     except Exception as e:
+        finish_trace(trace, str(e))
         logger.error(f"预览 Excel 文件时出错: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"预览文件时出错: {str(e)}")
 
@@ -187,6 +586,11 @@ async def get_api_info():
                 "method": "POST",
                 "path": "/api/excel/delete-columns",
                 "description": "删除 Excel 文件中的指定列"
+            },
+            "project_columns": {
+                "method": "POST",
+                "path": "/api/excel/project-columns",
+                "description": "按指定顺序保留 Excel 文件中的列"
             }
         }
     }
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""
+引擎差异测试入口
+随机生成工作簿，比较各处理引擎的输出与预期结果，并统计耗时
+
+用法:
+    python diffcheck.py --cases 200 --seed 1
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from services.differential_check import DifferentialRunner, default_engines, format_report, has_regressions
+
+# 配置日志
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较各处理引擎在随机工作簿上的输出和耗时")
+    parser.add_argument("--cases", type=int, default=50, help="随机用例数量（默认 50）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（默认 0）")
+    parser.add_argument("--max-rows", type=int, default=60, help="每个工作表的最大行数（默认 60）")
+    parser.add_argument("--max-columns", type=int, default=15, help="每个工作表的最大列数（默认 15）")
+    parser.add_argument("--mode", choices=("delete", "project", "both"), default="both",
+                        help="列操作：删除、投影或随机选择（默认 both）")
+    parser.add_argument("--engines", help="参与比较的引擎，用逗号分隔（默认全部）")
+    parser.add_argument("--json", help="把汇总报告写入指定的 JSON 文件")
+    parser.add_argument("--keep-failures", help="把出现回归的用例工作簿保存到指定目录")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        engines = default_engines(work_dir)
+        if args.engines:
+            names = [name.strip() for name in args.engines.split(",") if name.strip()]
+            unknown = [name for name in names if name not in engines]
+            if unknown:
+                parser.error(f"未知的引擎: {', '.join(unknown)}，可选: {', '.join(engines)}")
+            engines = {name: engines[name] for name in names}
+
+        def save_failure(case, content, results):
+            os.makedirs(args.keep_failures, exist_ok=True)
+            path = os.path.join(args.keep_failures, f"case-{args.seed}-{case}.xlsx")
+            with open(path, "wb") as f:
+                f.write(content)
+            logger.warning(f"用例 {case} 出现回归，工作簿已保存到 {path}")
+
+        try:
+            runner = DifferentialRunner(engines)
+        except ValueError as e:
+            parser.error(str(e))
+        report = runner.run(
+            cases=args.cases,
+            seed=args.seed,
+            max_rows=args.max_rows,
+            max_columns=args.max_columns,
+            mode=args.mode,
+            on_failure=save_failure if args.keep_failures else None,
+        )
+
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if has_regressions(report) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+接口压力测试入口
+按并发数和文件大小组合请求预览和删除列接口，统计延迟、吞吐量、错误率和内存峰值
+
+用法:
+    python loadtest.py --concurrency 8 --requests 200 --sizes 200x10*5,20000x20
+    python loadtest.py --uvicorn --workers 2 --duration 60
+    python loadtest.py --url http://127.0.0.1:8001 --server-pid 12345
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+
+from services.load_test import (
+    ENDPOINTS, HttpTransport, InProcessTransport, LoadTestRunner, UvicornServer, format_report, parse_sizes,
+)
+
+# 配置日志（在导入应用之前，避免每个请求都输出日志）
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对预览和删除列接口进行压力测试")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--uvicorn", action="store_true", help="在子进程中启动 uvicorn 并通过 HTTP 请求（默认在本进程内调用）")
+    target.add_argument("--url", help="请求已运行的服务，如 http://127.0.0.1:8001")
+    parser.add_argument("--workers", type=int, default=1, help="--uvicorn 时的工作进程数（默认 1）")
+    parser.add_argument("--server-pid", type=int, help="--url 时用于采样内存的服务进程号")
+    parser.add_argument("--endpoints", default="preview,delete-columns",
+                        help=f"请求的接口，用逗号分隔（默认 preview,delete-columns，可选: {', '.join(ENDPOINTS)}）")
+    parser.add_argument("--sizes", default="200x10*5,5000x20*2,50000x20",
+                        help="文件大小组合，行数x列数[*权重]，用逗号分隔（默认 200x10*5,5000x20*2,50000x20）")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发请求数（默认 4）")
+    parser.add_argument("--requests", type=int, help="总请求数（默认 100，指定 --duration 时不限）")
+    parser.add_argument("--duration", type=float, help="持续时间（秒）")
+    parser.add_argument("--warmup", type=int, default=0, help="正式计时前的预热请求数（默认 0）")
+    parser.add_argument("--columns", default="2", help="删除列接口要删除的列（默认 2）")
+    parser.add_argument("--stream", action="store_true", help="删除列接口使用流式响应")
+    parser.add_argument("--distinct", action="store_true", help="每个请求使用内容不同的文件，绕过服务端缓存")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（默认 0）")
+    parser.add_argument("--json", help="把汇总报告写入指定的 JSON 文件")
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if not endpoints or unknown:
+        parser.error(f"未知的接口: {', '.join(unknown)}，可选: {', '.join(ENDPOINTS)}")
+    try:
+        sizes = parse_sizes(args.sizes)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.concurrency < 1:
+        parser.error("并发数必须大于0")
+    requests = args.requests if args.requests is not None or args.duration is not None else 100
+
+    server = None
+    if args.uvicorn:
+        server = UvicornServer(os.path.dirname(os.path.abspath(__file__)), get_free_port(), args.workers)
+        server.start()
+        transport = HttpTransport(server.url, args.concurrency)
+        server_pid = server.process.pid
+    elif args.url:
+        transport = HttpTransport(args.url, args.concurrency)
+        server_pid = args.server_pid
+    else:
+        from main import app
+        transport = InProcessTransport(app)
+        # 本进程内运行时，内存包含压测本身（请求体和测试文件）
+        server_pid = os.getpid()
+
+    runner = LoadTestRunner(
+        transport,
+        endpoints=endpoints,
+        sizes=sizes,
+        concurrency=args.concurrency,
+        columns=args.columns,
+        stream=args.stream,
+        distinct=args.distinct,
+        seed=args.seed,
+    )
+    try:
+        report = runner.run(requests=requests, duration=args.duration, warmup=args.warmup, server_pid=server_pid)
+    except KeyboardInterrupt:
+        logger.info("收到中断信号，停止测试")
+        return 130
+    finally:
+        transport.close()
+        if server is not None:
+            server.stop()
+
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["groups"]["全部"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,8 @@ import logging
 from pathlib import Path
 
 from controllers.excel_controller import router as excel_router
+from controllers.admin_controller import router as admin_router
+from services.excel_service import result_cache_dir
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -44,6 +46,7 @@ app.add_middleware(
 
 # 注册路由
 app.include_router(excel_router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
 
 # 静态文件服务
 if os.path.exists(static_dir):
@@ -87,6 +90,10 @@ async def global_exception_handler(request, exc):
 
 if __name__ == "__main__":
     import uvicorn
+    import multiprocessing
+    
+    # 打包为可执行文件时，多进程需要此调用
+    multiprocessing.freeze_support()
     
     # 获取可用端口
     import socket
@@ -106,9 +113,20 @@ if __name__ == "__main__":
         # 端口被占用，使用随机端口
         port = get_free_port()
     
+    # 工作进程数：多个进程通过 uploads 目录共享工作簿索引、列分解缓存和任务存储
+    try:
+        workers = max(1, int(os.environ.get("EXCEL_WORKERS", "1")))
+    except ValueError:
+        logger.warning("EXCEL_WORKERS 不是有效的整数，使用单个工作进程")
+        workers = 1
+    
     print(f"\n🚀 Excel 列删除工具启动成功！")
     print(f"📱 访问地址: http://localhost:{port}")
     print(f"📚 API 文档: http://localhost:{port}/docs")
+    if workers > 1:
+        print(f"⚙️  工作进程: {workers}")
+    if result_cache_dir():
+        print(f"🗄️  结果缓存: {os.path.abspath(result_cache_dir())}")
     print(f"❤️  按 Ctrl+C 停止服务\n")
     
     uvicorn.run(
@@ -116,5 +134,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=port,
         reload=False,
+        workers=workers,
         log_level="info"
     )
@@ -10,6 +10,7 @@ import os
 import logging
 
 from controllers.excel_controller import router as excel_router
+from controllers.admin_controller import router as admin_router
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -33,6 +34,7 @@ app.add_middleware(
 
 # 注册路由
 app.include_router(excel_router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
 
 # 确保上传目录存在
 UPLOAD_DIR = "uploads"
@@ -0,0 +1,349 @@
+"""
+列分解缓存
+首次处理工作簿时把工作表分解为按列组织的单元格片段保存在磁盘上，
+同一文件再次以不同的列处理时直接按新的列映射拼接，不需要重新解压和解析工作表 XML
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import marshal
+import logging
+import zipfile
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from services.xlsx_fast_engine import FastXlsxEngine, SheetDecomposer, assemble_chunk
+from utils.cancellation import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+# 默认最多保留的工作簿数量和总大小
+DEFAULT_MAX_ENTRIES = 8
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# 构建中途失败遗留的临时目录超过该时间后清理
+STALE_BUILD_AGE = 3600
+
+# 读取缓存时在缓存目录中登记租约文件，每读一个行块更新一次修改时间；
+# 超过该时间未更新的租约视为读取进程已退出
+STALE_LEASE_AGE = 3600
+
+_MANIFEST = "manifest.json"
+_BUILD_MARKER = ".build-"
+_LEASE_PREFIX = ".reader-"
+_EVICTING_SUFFIX = ".evicting"
+
+
+def _chunk_path(directory: str, number: int) -> str:
+    return os.path.join(directory, f"chunk-{number:05d}.bin")
+
+
+def _directory_size(directory: str) -> int:
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class CachedWorkbook:
+    """
+    已缓存的工作簿：各工作表按列映射从行块拼接
+
+    读取期间持有租约，淘汰时跳过该缓存；commit 或 abort 时释放。
+    """
+
+    def __init__(self, directory: str, manifest: dict, lease: str):
+        self.directory = directory
+        self.manifest = manifest
+        self.lease = lease
+
+    def sheet_writers(self) -> Dict[str, Callable]:
+        """工作表部件路径 -> 生成工作表的函数，供 FastXlsxEngine.transform 使用"""
+        return {path: partial(self._write_sheet, sheet) for path, sheet in self.manifest["sheets"].items()}
+
+    def _write_sheet(self, sheet: dict, engine: FastXlsxEngine, write: Callable[[bytes], None]) -> int:
+        directory = os.path.join(self.directory, sheet["dir"])
+        with open(os.path.join(directory, "head.xml"), "rb") as f:
+            write(engine.rewrite_head(f.read()))
+        for number in range(sheet["chunks"]):
+            check_cancelled()
+            self._renew()
+            # marshal.load 直接读文件对象时按对象逐次读取，整块读入后再解析要快得多
+            with open(_chunk_path(directory, number), "rb") as f:
+                chunk = marshal.loads(f.read())
+            write(assemble_chunk(engine, chunk))
+        with open(os.path.join(directory, "tail.xml"), "rb") as f:
+            write(engine.rewrite_tail(f.read()))
+        return sheet["rows"]
+
+    def _renew(self):
+        """更新租约的修改时间，输出端较慢时读取可能持续很久"""
+        try:
+            os.utime(self.lease)
+        except OSError:
+            pass
+
+    def commit(self):
+        _remove_file(self.lease)
+
+    def abort(self):
+        _remove_file(self.lease)
+
+
+class _CacheBuilder:
+    """首次处理时边改写边分解工作表，全部成功后才作为缓存生效"""
+
+    def __init__(self, cache: "ColumnStreamCache", digest: str, archive: zipfile.ZipFile, sheet_paths: List[str]):
+        self.cache = cache
+        self.digest = digest
+        self.archive = archive
+        self.sheet_paths = sheet_paths
+        self.directory = os.path.join(cache.directory, f"{digest}{_BUILD_MARKER}{uuid.uuid4().hex}")
+        self.sheets: Dict[str, dict] = {}
+        self.failed = False
+        os.makedirs(self.directory)
+
+    def sheet_writers(self) -> Dict[str, Callable]:
+        return {
+            path: partial(self._write_sheet, path, f"sheet{number}")
+            for number, path in enumerate(self.sheet_paths)
+        }
+
+    def _write_sheet(self, path: str, name: str, engine: FastXlsxEngine, write: Callable[[bytes], None]) -> int:
+        directory = os.path.join(self.directory, name)
+        os.makedirs(directory)
+        chunks = 0
+
+        def store(chunk: tuple):
+            nonlocal chunks
+            if self.failed:
+                return
+            try:
+                with open(_chunk_path(directory, chunks), "wb") as f:
+                    f.write(marshal.dumps(chunk))
+            except OSError as e:
+                # 缓存写入失败不影响本次处理的输出
+                logger.warning(f"写入列分解缓存失败: {str(e)}")
+                self.failed = True
+            chunks += 1
+
+        decomposer = SheetDecomposer(engine, store)
+        with self.archive.open(path) as source:
+            decomposer.run(source, write)
+
+        try:
+            with open(os.path.join(directory, "head.xml"), "wb") as f:
+                f.write(decomposer.head)
+            with open(os.path.join(directory, "tail.xml"), "wb") as f:
+                f.write(decomposer.tail)
+        except OSError as e:
+            logger.warning(f"写入列分解缓存失败: {str(e)}")
+            self.failed = True
+        self.sheets[path] = {"dir": name, "chunks": chunks, "rows": decomposer.row_count}
+        return decomposer.row_count
+
+    def commit(self):
+        """写入清单并把临时目录改名为正式缓存"""
+        if self.failed or set(self.sheets) != set(self.sheet_paths):
+            self.abort()
+            return
+
+        manifest = {
+            "version": CACHE_VERSION,
+            "marshal": marshal.version,
+            "digest": self.digest,
+            "sheets": self.sheets,
+        }
+        try:
+            with open(os.path.join(self.directory, _MANIFEST), "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.rename(self.directory, self.cache.path(self.digest))
+        except OSError:
+            # 写入失败，或其他请求已经生成了同一文件的缓存
+            self.abort()
+            return
+        logger.info(f"已缓存工作簿 {self.digest[:12]} 的列分解结果")
+        self.cache.evict(keep=self.digest)
+
+    def abort(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ColumnStreamCache:
+    """
+    列分解缓存目录
+    每个工作簿一个子目录（以内容摘要命名），按最近使用时间淘汰
+    """
+
+    def __init__(self, directory: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory: 缓存目录
+            max_entries: 最多保留的工作簿数量
+            max_bytes: 缓存总大小上限（字节）
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest)
+
+    def get(self, digest: str) -> Optional[CachedWorkbook]:
+        """
+        读取已缓存的工作簿，不存在、不完整、版本不符或正在被淘汰时返回 None
+
+        返回的缓存持有租约，使用完毕后须调用 commit 或 abort 释放。
+        """
+        directory = self.path(digest)
+        lease = os.path.join(directory, f"{_LEASE_PREFIX}{uuid.uuid4().hex}")
+        try:
+            # 先登记租约再读取清单：淘汰时先改名清单再检查租约，二者总有一方能看到对方
+            with open(lease, "x"):
+                pass
+        except OSError:
+            return None
+
+        manifest = self._load_manifest(directory)
+        if manifest is None:
+            _remove_file(lease)
+            return None
+
+        try:
+            # 更新修改时间，作为最近使用的依据
+            os.utime(directory)
+        except OSError:
+            pass
+        return CachedWorkbook(directory, manifest, lease)
+
+    @staticmethod
+    def _load_manifest(directory: str) -> Optional[dict]:
+        """读取并校验清单"""
+        try:
+            with open(os.path.join(directory, _MANIFEST), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if manifest.get("version") != CACHE_VERSION or manifest.get("marshal") != marshal.version:
+            return None
+        for sheet in manifest["sheets"].values():
+            sheet_dir = os.path.join(directory, sheet["dir"])
+            if not all(os.path.exists(_chunk_path(sheet_dir, number)) for number in range(sheet["chunks"])):
+                return None
+        return manifest
+
+    def open(self, digest: str, archive: zipfile.ZipFile, sheet_paths: List[str]):
+        """
+        获取工作簿的缓存，未缓存时返回在本次处理中同时生成缓存的构建器
+
+        Args:
+            digest: 文件内容摘要
+            archive: 已打开的源工作簿
+            sheet_paths: 需要处理的工作表部件
+
+        Returns:
+            CachedWorkbook 或 _CacheBuilder，二者都提供 sheet_writers / commit / abort
+        """
+        cached = self.get(digest)
+        if cached is not None:
+            logger.info(f"使用工作簿 {digest[:12]} 的列分解缓存")
+            return cached
+        os.makedirs(self.directory, exist_ok=True)
+        return _CacheBuilder(self, digest, archive, sheet_paths)
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        按最近使用时间淘汰超出数量或大小上限的缓存，正在被读取的缓存跳过
+
+        Args:
+            keep: 始终保留的缓存（刚生成的）
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if _BUILD_MARKER in name:
+                if now - mtime > STALE_BUILD_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            entries.append((mtime, name, path))
+
+        entries.sort(reverse=True)
+        kept_count = 0
+        kept_bytes = 0
+        for mtime, name, path in entries:
+            size = _directory_size(path)
+            over_limit = kept_count >= self.max_entries or kept_bytes + size > self.max_bytes
+            if over_limit and name != keep and self._remove_unused(path):
+                logger.info(f"淘汰列分解缓存 {name[:12]}")
+                continue
+            kept_count += 1
+            kept_bytes += size
+
+    def _remove_unused(self, path: str) -> bool:
+        """
+        没有读取中的租约时删除缓存
+
+        先把清单改名，之后开始的读取找不到清单而放弃；改名后再检查一次租约，
+        发现改名前刚登记的读取时恢复清单。
+
+        Returns:
+            bool: 是否已删除
+        """
+        if self._leased(path):
+            return False
+        manifest = os.path.join(path, _MANIFEST)
+        retired = manifest + _EVICTING_SUFFIX
+        try:
+            os.rename(manifest, retired)
+        except OSError:
+            # 清单正被读取（Windows）或其他进程正在淘汰同一缓存
+            return False
+        if self._leased(path):
+            try:
+                os.rename(retired, manifest)
+            except OSError:
+                pass
+            return False
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    @staticmethod
+    def _leased(path: str) -> bool:
+        """缓存目录中是否有未过期的租约"""
+        now = time.time()
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return False
+        for name in names:
+            if not name.startswith(_LEASE_PREFIX):
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(path, name)) < STALE_LEASE_AGE:
+                    return True
+            except OSError:
+                continue
+        return False
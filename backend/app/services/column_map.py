@@ -0,0 +1,89 @@
+"""
+列映射
+描述原始列号到输出列号的对应关系，被删除的列没有对应的输出列
+"""
+
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+
+class ColumnMap:
+    """原始列号 -> 输出列号（均从1开始）"""
+
+    def __init__(self, deleted: Optional[List[int]] = None, order: Optional[List[int]] = None):
+        """
+        Args:
+            deleted: 要删除的列号列表，其余列保持原有顺序
+            order: 要保留的列号，按输出顺序排列，未列出的列被删除
+        """
+        self.deleted = sorted(set(deleted)) if deleted else []
+        self._deleted_set = set(self.deleted)
+        self.order = list(order) if order is not None else None
+        self._positions: Dict[int, int] = (
+            {column: position for position, column in enumerate(self.order, 1)}
+            if self.order is not None else {}
+        )
+
+    @classmethod
+    def for_deletion(cls, column_indices: List[int]) -> "ColumnMap":
+        """根据要删除的列创建映射"""
+        return cls(deleted=column_indices)
+
+    @classmethod
+    def for_projection(cls, column_order: List[int]) -> "ColumnMap":
+        """根据要保留的列及其输出顺序创建映射"""
+        if len(set(column_order)) != len(column_order):
+            raise ValueError("保留的列不能重复")
+        return cls(order=column_order)
+
+    @property
+    def is_projection(self) -> bool:
+        """是否为投影（可能改变列顺序）"""
+        return self.order is not None
+
+    def get(self, column: int) -> Optional[int]:
+        """
+        获取原始列对应的输出列
+
+        Args:
+            column: 原始列号
+
+        Returns:
+            Optional[int]: 输出列号，列被删除时返回 None
+        """
+        if self.order is not None:
+            return self._positions.get(column)
+        if column in self._deleted_set:
+            return None
+        return column - bisect.bisect_left(self.deleted, column)
+
+    def remap_span(self, min_col: int, max_col: int) -> List[Tuple[int, int]]:
+        """
+        把原始列区间映射为输出列区间
+
+        按原始列顺序遍历，输出列号连续递增的部分合并为一个区间；
+        投影改变了列顺序时，一个原始区间可能映射为多个输出区间。
+
+        Args:
+            min_col: 起始列号
+            max_col: 结束列号
+
+        Returns:
+            List[Tuple[int, int]]: 输出列区间列表，全部被删除时为空
+        """
+        if self.order is not None:
+            # 投影时只需检查被保留的列，避免遍历整列区间（如 A:XFD）
+            columns = sorted(col for col in self._positions if min_col <= col <= max_col)
+        else:
+            columns = range(min_col, max_col + 1)
+
+        spans = []
+        for column in columns:
+            new_column = self.get(column)
+            if new_column is None:
+                continue
+            if spans and spans[-1][1] == new_column - 1:
+                spans[-1] = (spans[-1][0], new_column)
+            else:
+                spans.append((new_column, new_column))
+        return spans
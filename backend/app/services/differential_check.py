@@ -0,0 +1,722 @@
+"""
+引擎差异测试
+随机生成工作簿，用各处理引擎执行相同的列操作（部分用例同时带行过滤条件），
+把输出与按列映射和行映射推算出的预期结果逐单元格、逐项元数据比较，并统计各引擎相对参考引擎的耗时
+"""
+
+import io
+import re
+import time
+import random
+import logging
+import zipfile
+import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import MergedCell
+from openpyxl.formatting.rule import CellIsRule, FormulaRule
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import MultiCellRange
+from openpyxl.worksheet.datavalidation import DataValidation
+
+from services.column_map import ColumnMap
+from services.excel_service import ExcelService
+from services.row_filter import RowFilter
+
+logger = logging.getLogger(__name__)
+
+# 比较的项目，顺序即报告中的顺序
+CATEGORIES = (
+    "cells", "styles", "merged", "widths", "heights", "validations",
+    "conditional", "autofilter", "print_area", "freeze", "hyperlinks",
+)
+
+# 展开为单元格集合时的上限，超过后按原文比较
+MAX_EXPANDED_CELLS = 100_000
+
+# 每项差异在报告中保留的示例数
+MAX_EXAMPLES = 3
+
+REFERENCE_ENGINE = "openpyxl"
+
+
+class _Unknown:
+    """无法推算的预期值，与任何实际值（包括不存在）都视为一致"""
+
+    def __eq__(self, other) -> bool:
+        return True
+
+    def __ne__(self, other) -> bool:
+        return False
+
+    def __hash__(self) -> int:
+        return 0
+
+    def __repr__(self) -> str:
+        return "<任意>"
+
+
+UNKNOWN = _Unknown()
+
+_SHARED_FORMULA_CELL_RE = re.compile(rb'<c r="([A-Z]+)(\d+)"([^>]*)><f>([^<]*)</f><v\s*/?>(?:</v>)?</c>')
+
+
+class Engine:
+    """参与比较的处理引擎"""
+
+    def __init__(self, name: str, service: ExcelService, warm_up: bool = False, stream: bool = False):
+        """
+        Args:
+            name: 引擎名称
+            service: 使用的服务实例
+            warm_up: 计时前是否先用另一组列处理同一文件（用于测量缓存命中后的速度）
+            stream: 是否通过流式接口（输出不可定位，对应 stream=true）处理
+        """
+        self.name = name
+        self.service = service
+        self.warm_up = warm_up
+        self.stream = stream
+
+    def prepare(self, content: bytes, mode: str, columns: List[int]):
+        if not self.warm_up:
+            return
+        self.service.delete_columns(content, [max(columns) + 1])
+
+    def run(self, content: bytes, mode: str, columns: List[int], row_filter: Optional[dict] = None) -> bytes:
+        """
+        Args:
+            row_filter: RowFilter 的参数，每次运行使用新的实例（去重状态不在引擎之间共享）
+        """
+        filter_ = RowFilter(**row_filter) if row_filter else None
+        if mode == "project":
+            if self.stream:
+                return b"".join(self.service.stream_project_columns(content, columns, filter_))
+            return self.service.project_columns(content, columns, filter_)
+        columns = sorted(columns, reverse=True)
+        if self.stream:
+            return b"".join(self.service.stream_delete_columns(content, columns, filter_))
+        return self.service.delete_columns(content, columns, filter_)
+
+
+def default_engines(work_dir: str) -> Dict[str, Engine]:
+    """
+    默认比较的引擎：openpyxl（参考）、快速引擎、快速引擎流式输出、快速引擎缓存命中
+
+    Args:
+        work_dir: 索引和缓存使用的临时目录
+    """
+    def service(engine: str, cache_dir: Optional[str] = None) -> ExcelService:
+        # 不缓存处理结果，每次都实际执行引擎
+        return ExcelService(index_dir=f"{work_dir}/index", engine=engine, cache_dir=cache_dir, job_dir=None)
+
+    return {
+        "openpyxl": Engine("openpyxl", service("openpyxl")),
+        "fast": Engine("fast", service("fast")),
+        "fast-stream": Engine("fast-stream", service("fast"), stream=True),
+        "fast-cached": Engine("fast-cached", service("fast", f"{work_dir}/columns"), warm_up=True),
+    }
+
+
+# ---- 随机工作簿 ----
+
+def generate_workbook(rnd: random.Random, max_rows: int = 60, max_columns: int = 15) -> bytes:
+    """
+    生成随机工作簿
+
+    包含多个工作表、稀疏或密集的数据、各类取值、样式、合并单元格、普通公式和共享公式、
+    列宽行高、条件格式、数据验证、自动筛选、打印区域、冻结窗格和超链接。
+    """
+    workbook = Workbook()
+    for number in range(rnd.randint(1, 3)):
+        worksheet = workbook.active if number == 0 else workbook.create_sheet(f"表 {number}")
+        rows = rnd.randint(1, max_rows)
+        columns = rnd.randint(1, max_columns)
+        density = rnd.choice((0.2, 0.6, 1.0))
+        _fill_cells(rnd, worksheet, rows, columns, density)
+        _add_merged_cells(rnd, worksheet, rows, columns)
+        _add_metadata(rnd, worksheet, rows, columns)
+
+    output = io.BytesIO()
+    workbook.save(output)
+    content = output.getvalue()
+    return _use_shared_formulas(content) if rnd.random() < 0.5 else content
+
+
+def _fill_cells(rnd: random.Random, worksheet, rows: int, columns: int, density: float):
+    bold = Font(bold=True, color="FFC00000")
+    fill = PatternFill("solid", fgColor="FFFFF2CC")
+    border = Border(left=Side(style="thin"), bottom=Side(style="medium"))
+    center = Alignment(horizontal="center", wrap_text=True)
+
+    for row in range(1, rows + 1):
+        for col in range(1, columns + 1):
+            if row > 1 and rnd.random() > density:
+                continue
+            kind = rnd.random()
+            if row == 1:
+                value = f"列{col}"
+            elif kind < 0.25:
+                value = rnd.randint(-1000, 100000)
+            elif kind < 0.4:
+                value = round(rnd.uniform(-1e6, 1e6), 4)
+            elif kind < 0.6:
+                value = rnd.choice(("北京", "上海", "广州", "x" * rnd.randint(1, 40), " 前后空格 ", "a&b<c>"))
+            elif kind < 0.7:
+                value = datetime.datetime(2020, 1, 1) + datetime.timedelta(days=rnd.randint(0, 2000))
+            elif kind < 0.75:
+                value = rnd.random() < 0.5
+            elif kind < 0.9:
+                value = f"=A{row}+{get_column_letter(max(1, col - 1))}{row}*2"
+            else:
+                value = None
+            cell = worksheet.cell(row=row, column=col, value=value)
+            if rnd.random() < 0.3:
+                cell.font = bold
+                cell.fill = fill
+            if rnd.random() < 0.2:
+                cell.border = border
+                cell.alignment = center
+            if isinstance(value, float) and rnd.random() < 0.5:
+                cell.number_format = "#,##0.00"
+
+    # 一列共享公式的候选：每行相同的相对公式
+    if rows > 2 and rnd.random() < 0.7:
+        col = columns + 1
+        for row in range(2, rows + 1):
+            worksheet.cell(row=row, column=col, value=f"=A{row}*2")
+
+
+def _add_merged_cells(rnd: random.Random, worksheet, rows: int, columns: int):
+    taken: List[Tuple[int, int, int, int]] = []
+    for _ in range(rnd.randint(0, 4)):
+        min_row, min_col = rnd.randint(1, rows + 2), rnd.randint(1, columns + 2)
+        max_row, max_col = min_row + rnd.randint(0, 2), min_col + rnd.randint(0, 3)
+        if (min_row, min_col) == (max_row, max_col):
+            continue
+        if any(not (max_row < r1 or min_row > r2 or max_col < c1 or min_col > c2) for r1, c1, r2, c2 in taken):
+            continue
+        taken.append((min_row, min_col, max_row, max_col))
+        worksheet.merge_cells(start_row=min_row, start_column=min_col, end_row=max_row, end_column=max_col)
+
+
+def _add_metadata(rnd: random.Random, worksheet, rows: int, columns: int):
+    last = get_column_letter(columns)
+    for col in rnd.sample(range(1, columns + 1), k=min(columns, rnd.randint(0, 3))):
+        worksheet.column_dimensions[get_column_letter(col)].width = rnd.choice((8, 12.5, 30))
+    for row in rnd.sample(range(1, rows + 1), k=min(rows, rnd.randint(0, 3))):
+        worksheet.row_dimensions[row].height = rnd.choice((20, 32.25))
+
+    if rnd.random() < 0.6:
+        fill = PatternFill("solid", fgColor="FFC6EFCE")
+        worksheet.conditional_formatting.add(
+            f"A2:{last}{max(rows, 2)}", CellIsRule(operator="greaterThan", formula=["100"], fill=fill))
+    if rnd.random() < 0.4:
+        col = get_column_letter(rnd.randint(1, columns))
+        worksheet.conditional_formatting.add(
+            f"{col}1:{col}{rows} A1", FormulaRule(formula=[f"LEN({col}1)>3"], font=Font(italic=True)))
+    if rnd.random() < 0.6:
+        validation = DataValidation(type="list", formula1='"是,否"')
+        col = get_column_letter(rnd.randint(1, columns))
+        validation.add(f"{col}2:{col}{rows + 5}")
+        worksheet.add_data_validation(validation)
+    if rnd.random() < 0.5:
+        worksheet.auto_filter.ref = f"A1:{last}{rows}"
+    if rnd.random() < 0.5:
+        worksheet.print_area = f"A1:{get_column_letter(rnd.randint(1, columns))}{rows}"
+    if rnd.random() < 0.5:
+        worksheet.freeze_panes = f"{get_column_letter(rnd.randint(1, min(columns, 4)))}{rnd.randint(1, 2)}"
+    if rnd.random() < 0.5:
+        cell = worksheet.cell(row=1, column=rnd.randint(1, columns))
+        if not isinstance(cell, MergedCell):
+            cell.hyperlink = "https://example.com/doc"
+
+
+def _use_shared_formulas(content: bytes) -> bytes:
+    """把每个工作表中 =A{行}*2 形式的连续公式改写为共享公式"""
+    source = zipfile.ZipFile(io.BytesIO(content))
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            data = source.read(info.filename)
+            if info.filename.startswith("xl/worksheets/sheet"):
+                data = _share_column_formulas(data)
+            target.writestr(info, data)
+    return output.getvalue()
+
+
+def _share_column_formulas(data: bytes) -> bytes:
+    matches = [
+        match for match in _SHARED_FORMULA_CELL_RE.finditer(data)
+        if match.group(4) == b"A" + match.group(2) + b"*2"
+    ]
+    if len(matches) < 2:
+        return data
+    column = matches[0].group(1)
+    matches = [match for match in matches if match.group(1) == column]
+    first, last = matches[0], matches[-1]
+    ref = b"%s%s:%s%s" % (column, first.group(2), column, last.group(2))
+
+    parts = []
+    position = 0
+    for number, match in enumerate(matches):
+        parts.append(data[position:match.start()])
+        if number == 0:
+            formula = b'<f t="shared" ref="%s" si="0">%s</f>' % (ref, match.group(4))
+        else:
+            formula = b'<f t="shared" si="0"/>'
+        parts.append(b'<c r="%s%s"%s>%s<v></v></c>' % (match.group(1), match.group(2), match.group(3), formula))
+        position = match.end()
+    parts.append(data[position:])
+    return b"".join(parts)
+
+
+def random_spec(rnd: random.Random, max_column: int, mode: str = "both") -> Tuple[str, List[int]]:
+    """
+    随机生成列操作
+
+    Returns:
+        Tuple[str, List[int]]: ("delete", 要删除的列) 或 ("project", 按输出顺序保留的列)
+    """
+    if mode == "both":
+        mode = rnd.choice(("delete", "project"))
+    # 偶尔包含超出数据范围的列
+    candidates = list(range(1, max_column + 3))
+    count = rnd.randint(1, max(1, min(len(candidates) - 1, 6)))
+    return mode, rnd.sample(candidates, count)
+
+
+def random_row_filter(rnd: random.Random, max_column: int, values: List[object]) -> Optional[dict]:
+    """
+    随机生成行过滤条件，约一半的用例不过滤
+
+    Args:
+        max_column: 条件中列号的上限
+        values: 工作簿中出现过的值，删除匹配行的条件从中选取
+
+    Returns:
+        Optional[dict]: RowFilter 的参数
+    """
+    if rnd.random() < 0.5:
+        return None
+    options = {"drop_blank": rnd.random() < 0.6}
+    if values and rnd.random() < 0.5:
+        targets = {str(rnd.choice(values))}
+        if rnd.random() < 0.3:
+            # 空字符串表示该列为空
+            targets.add("")
+        options["drop_values"] = {rnd.randint(1, max_column): targets}
+    if rnd.random() < 0.5:
+        options["dedupe_columns"] = rnd.sample(range(1, max_column + 1), rnd.randint(1, min(2, max_column)))
+    return options if RowFilter(**options).active else None
+
+
+# ---- 快照与预期结果 ----
+
+def _expand(ref: str) -> Optional[Set[Tuple[int, int]]]:
+    """把区间列表展开为 (行, 列) 集合，过大时返回 None"""
+    cells: Set[Tuple[int, int]] = set()
+    for cell_range in MultiCellRange(ref).ranges:
+        if cell_range.size["rows"] * cell_range.size["columns"] + len(cells) > MAX_EXPANDED_CELLS:
+            return None
+        cells.update(cell_range.cells)
+    return cells
+
+
+def _print_area_cells(print_area) -> Optional[Set[Tuple[int, int]]]:
+    if not print_area:
+        return None
+    refs = [part.rsplit("!", 1)[-1].replace("$", "") for part in str(print_area).split(",")]
+    return _expand(" ".join(refs))
+
+
+def _color(color) -> Optional[str]:
+    return None if color is None else str(color.value)
+
+
+def _style_key(cell) -> tuple:
+    return (
+        cell.number_format,
+        cell.font.b, cell.font.i, _color(cell.font.color),
+        cell.fill.fill_type, _color(cell.fill.fgColor),
+        cell.border.left.style, cell.border.bottom.style,
+        cell.alignment.horizontal, cell.alignment.wrap_text,
+    )
+
+
+def snapshot(content: bytes) -> Dict[str, dict]:
+    """
+    读取工作簿中参与比较的全部内容
+
+    Returns:
+        Dict[str, dict]: 比较项目 -> {键: 值}，区间类的元数据展开为单元格集合
+    """
+    workbook = load_workbook(io.BytesIO(content))
+    result: Dict[str, dict] = {category: {} for category in CATEGORIES}
+
+    for worksheet in workbook.worksheets:
+        title = worksheet.title
+        for (row, col), cell in worksheet._cells.items():
+            if isinstance(cell, MergedCell):
+                continue
+            if cell.value is not None:
+                result["cells"][(title, row, col)] = cell.value
+            if cell.has_style:
+                result["styles"][(title, row, col)] = _style_key(cell)
+            if cell.hyperlink is not None:
+                result["hyperlinks"][(title, row, col)] = cell.hyperlink.target
+
+        for cell_range in worksheet.merged_cells.ranges:
+            result["merged"][(title,) + tuple(cell_range.bounds)] = True
+
+        for dimension in worksheet.column_dimensions.values():
+            if dimension.customWidth and dimension.min:
+                for col in range(dimension.min, (dimension.max or dimension.min) + 1):
+                    result["widths"][(title, col)] = dimension.width
+        for row, dimension in worksheet.row_dimensions.items():
+            if dimension.ht is not None:
+                result["heights"][(title, row)] = dimension.ht
+
+        for validation in worksheet.data_validations.dataValidation:
+            cells = _expand(str(validation.sqref))
+            result["validations"][(title, validation.type, validation.formula1)] = (
+                frozenset(cells) if cells is not None else str(validation.sqref))
+
+        for formatting in worksheet.conditional_formatting:
+            cells = _expand(str(formatting.sqref))
+            for rule in formatting.rules:
+                key = (title, rule.type, rule.operator, tuple(rule.formula or ()))
+                result["conditional"][key] = frozenset(cells) if cells is not None else str(formatting.sqref)
+
+        if worksheet.auto_filter.ref:
+            cells = _expand(worksheet.auto_filter.ref)
+            result["autofilter"][title] = frozenset(cells) if cells is not None else worksheet.auto_filter.ref
+        cells = _print_area_cells(worksheet.print_area)
+        if cells:
+            result["print_area"][title] = frozenset(cells)
+        if worksheet.freeze_panes:
+            result["freeze"][title] = worksheet.freeze_panes
+
+    return result
+
+
+def _map_cells(cells, column_map: ColumnMap):
+    if not isinstance(cells, frozenset):
+        return cells
+    return frozenset(
+        (row, column_map.get(col)) for row, col in cells if column_map.get(col) is not None
+    )
+
+
+class RowMapping:
+    """单个工作表行过滤后的行号映射"""
+
+    def __init__(self, kept: Dict[int, int], max_row: int, dropped: int):
+        """
+        Args:
+            kept: 参与过滤的行中保留下来的 原始行号 -> 输出行号
+            max_row: 参与过滤的最后一行，之后的行整体上移 dropped 行
+            dropped: 删除的行数
+        """
+        self.kept = kept
+        self.max_row = max_row
+        self.dropped = dropped
+
+    def get(self, row: int) -> Optional[int]:
+        """输出中的行号，行被删除时返回 None"""
+        if row > self.max_row:
+            return row - self.dropped
+        return self.kept.get(row)
+
+    def span(self, first: int, last: int) -> Optional[Tuple[int, int]]:
+        """区间内保留下来的首尾行在输出中的行号"""
+        rows = [new_row for new_row in map(self.get, range(first, last + 1)) if new_row is not None]
+        return (rows[0], rows[-1]) if rows else None
+
+
+def expected_row_maps(content: bytes, row_filter: dict) -> Dict[str, RowMapping]:
+    """
+    按 RowFilter 的规则推算每个工作表的行映射
+
+    第 1 行到 openpyxl 的 max_row（包括只有合并区域的行）逐行判断，
+    值为 openpyxl 加载后非空、不在合并区域内的单元格的值。
+
+    Returns:
+        Dict[str, RowMapping]: 工作表名称 -> 行映射
+    """
+    workbook = load_workbook(io.BytesIO(content))
+    filter_ = RowFilter(**row_filter)
+    result = {}
+    for worksheet in workbook.worksheets:
+        rows: Dict[int, Dict[int, object]] = {}
+        for (row, col), cell in worksheet._cells.items():
+            values = rows.setdefault(row, {})
+            if not isinstance(cell, MergedCell) and cell.value is not None:
+                values[col] = cell.value
+        max_row = max(rows) if rows else 0
+
+        kept: Dict[int, int] = {}
+        dropped = 0
+        filter_.start_sheet()
+        try:
+            for row in range(1, max_row + 1):
+                if filter_.keep(row, rows.get(row, {})):
+                    kept[row] = row - dropped
+                else:
+                    dropped += 1
+        finally:
+            filter_.close()
+        result[worksheet.title] = RowMapping(kept, max_row, dropped)
+    return result
+
+
+def expected_snapshot(source: Dict[str, dict], column_map: ColumnMap,
+                      rows: Optional[Dict[str, RowMapping]] = None) -> Dict[str, dict]:
+    """
+    按列映射和行映射推算正确的输出
+
+    单元格和区间按单元格逐个映射；合并区域和自动筛选在映射后不连续时不再保留，
+    冻结的列数为输出开头连续的、原本就被冻结的列数。
+    行过滤时单元格、合并区域、超链接和行高随行移动，其余区域与两个引擎一致，不调整行号。
+    """
+    expected: Dict[str, dict] = {category: {} for category in CATEGORIES}
+
+    def new_row(title: str, row: int) -> Optional[int]:
+        return rows[title].get(row) if rows is not None else row
+
+    def row_span(title: str, first: int, last: int) -> Optional[Tuple[int, int]]:
+        return rows[title].span(first, last) if rows is not None else (first, last)
+
+    for category in ("cells", "styles", "hyperlinks"):
+        for (title, row, col), value in source[category].items():
+            new_col, mapped_row = column_map.get(col), new_row(title, row)
+            if new_col is not None and mapped_row is not None:
+                expected[category][(title, mapped_row, new_col)] = value
+
+    for (title, min_col, min_row, max_col, max_row) in source["merged"]:
+        spans = column_map.remap_span(min_col, max_col)
+        kept_rows = row_span(title, min_row, max_row)
+        if len(spans) == 1 and kept_rows is not None and (spans[0][0] != spans[0][1] or kept_rows[0] != kept_rows[1]):
+            expected["merged"][(title, spans[0][0], kept_rows[0], spans[0][1], kept_rows[1])] = True
+            if column_map.get(min_col) != spans[0][0] or new_row(title, min_row) is None:
+                # 原左上角被删除或移走，新的左上角原本是被覆盖的单元格，样式无法推算（见下）
+                expected["styles"][(title, kept_rows[0], spans[0][0])] = UNKNOWN
+            continue
+        # 不再合并时，原先被覆盖的单元格恢复为普通单元格；openpyxl 读取时丢弃了它们在文件中的样式，无法推算
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                new_col, mapped_row = column_map.get(col), new_row(title, row)
+                if (row, col) != (min_row, min_col) and new_col is not None and mapped_row is not None:
+                    expected["styles"][(title, mapped_row, new_col)] = UNKNOWN
+
+    for (title, col), width in source["widths"].items():
+        new_col = column_map.get(col)
+        if new_col is not None:
+            expected["widths"][(title, new_col)] = width
+    for (title, row), height in source["heights"].items():
+        mapped_row = new_row(title, row)
+        if mapped_row is not None:
+            expected["heights"][(title, mapped_row)] = height
+
+    for category in ("validations", "conditional", "print_area"):
+        for key, cells in source[category].items():
+            mapped = _map_cells(cells, column_map)
+            if mapped:
+                expected[category][key] = mapped
+
+    for title, cells in source["autofilter"].items():
+        if not isinstance(cells, frozenset):
+            expected["autofilter"][title] = cells
+            continue
+        columns = sorted({col for _, col in cells})
+        if len(column_map.remap_span(columns[0], columns[-1])) == 1:
+            expected["autofilter"][title] = _map_cells(cells, column_map)
+
+    for title, top_left in source["freeze"].items():
+        letters = top_left.rstrip("0123456789")
+        row = top_left[len(letters):]
+        split = _column_index(letters) - 1
+        if column_map.is_projection:
+            kept = 0
+            for col in column_map.order:
+                if col > split:
+                    break
+                kept += 1
+        else:
+            kept = sum(1 for col in range(1, split + 1) if column_map.get(col) is not None)
+        if kept or row != "1":
+            expected["freeze"][title] = f"{get_column_letter(kept + 1)}{row}"
+
+    return expected
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index
+
+
+def compare(actual: Dict[str, dict], expected: Dict[str, dict]) -> Dict[str, List[str]]:
+    """
+    比较两个快照
+
+    Returns:
+        Dict[str, List[str]]: 有差异的项目 -> 差异示例
+    """
+    differences: Dict[str, List[str]] = {}
+    for category in CATEGORIES:
+        got, want = actual[category], expected[category]
+        keys = [key for key in set(got) | set(want) if want.get(key) != got.get(key)]
+        if not keys:
+            continue
+        differences[category] = [
+            f"{_describe_key(key)}: 实际 {_short(got.get(key))}，预期 {_short(want.get(key))}"
+            for key in sorted(keys, key=repr)[:MAX_EXAMPLES]
+        ]
+    return differences
+
+
+def _describe_key(key) -> str:
+    if isinstance(key, tuple) and len(key) == 3 and isinstance(key[1], int) and isinstance(key[2], int):
+        return f"{key[0]}!{get_column_letter(key[2])}{key[1]}"
+    return repr(key)
+
+
+def _short(value) -> str:
+    if isinstance(value, frozenset):
+        if not value:
+            return "{}"
+        rows = [row for row, _ in value]
+        cols = [col for _, col in value]
+        return f"{len(value)} 个单元格 [{get_column_letter(min(cols))}{min(rows)}:{get_column_letter(max(cols))}{max(rows)}]"
+    text = repr(value)
+    return text if len(text) <= 60 else text[:57] + "..."
+
+
+# ---- 运行 ----
+
+class DifferentialRunner:
+    """对一批随机工作簿运行全部引擎并汇总结果"""
+
+    def __init__(self, engines: Dict[str, Engine], reference: str = REFERENCE_ENGINE):
+        if reference not in engines:
+            raise ValueError(f"参考引擎 {reference} 不在比较范围内")
+        self.engines = engines
+        self.reference = reference
+
+    def run_case(self, content: bytes, mode: str, columns: List[int], row_filter: Optional[dict] = None) -> dict:
+        """
+        用每个引擎处理同一个工作簿
+
+        Args:
+            row_filter: 可选的行过滤条件（RowFilter 的参数）
+
+        Returns:
+            dict: 引擎名称 -> {"seconds": 耗时, "differences": {项目: 示例}, "error": 错误信息}
+        """
+        column_map = ColumnMap.for_projection(columns) if mode == "project" else ColumnMap.for_deletion(columns)
+        rows = expected_row_maps(content, row_filter) if row_filter else None
+        expected = expected_snapshot(snapshot(content), column_map, rows)
+
+        results = {}
+        for name, engine in self.engines.items():
+            result = {"seconds": None, "differences": {}, "error": None}
+            try:
+                engine.prepare(content, mode, columns)
+                started = time.perf_counter()
+                output = engine.run(content, mode, columns, row_filter)
+                result["seconds"] = time.perf_counter() - started
+                result["differences"] = compare(snapshot(output), expected)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {str(e)}"
+            results[name] = result
+        return results
+
+    def run(self, cases: int, seed: int = 0, max_rows: int = 60, max_columns: int = 15,
+            mode: str = "both", on_failure: Optional[Callable[[int, bytes, dict], None]] = None) -> dict:
+        """
+        运行一批随机用例
+
+        Args:
+            cases: 用例数量
+            seed: 随机种子，相同种子生成相同的用例
+            max_rows: 每个工作表的最大行数
+            max_columns: 每个工作表的最大列数
+            mode: delete、project 或 both
+            on_failure: 某个引擎出现参考引擎没有的差异时调用 (用例编号, 工作簿, 用例结果)
+
+        Returns:
+            dict: 汇总报告
+        """
+        summary = {
+            name: {"cases": 0, "errors": 0, "seconds": 0.0, "reference_seconds": 0.0,
+                   "mismatches": {}, "regressions": {}, "examples": []}
+            for name in self.engines
+        }
+
+        for case in range(cases):
+            rnd = random.Random(f"{seed}-{case}")
+            content = generate_workbook(rnd, max_rows, max_columns)
+            case_mode, columns = random_spec(rnd, max_columns + 1, mode)
+            row_filter = random_row_filter(rnd, max_columns + 1, list(snapshot(content)["cells"].values()))
+            results = self.run_case(content, case_mode, columns, row_filter)
+            label = f"{case_mode} {columns}" + (f" {row_filter}" if row_filter else "")
+            reference = results[self.reference]
+
+            failed = False
+            for name, result in results.items():
+                stats = summary[name]
+                stats["cases"] += 1
+                if result["error"]:
+                    stats["errors"] += 1
+                    stats["examples"].append(f"用例 {case} ({label}): {result['error']}")
+                    failed = failed or name != self.reference
+                    continue
+                if reference["seconds"] is not None:
+                    stats["seconds"] += result["seconds"]
+                    stats["reference_seconds"] += reference["seconds"]
+                for category, examples in result["differences"].items():
+                    stats["mismatches"][category] = stats["mismatches"].get(category, 0) + 1
+                    # 参考引擎本身正确而该引擎不正确，才算作回归
+                    if name != self.reference and category not in reference["differences"]:
+                        stats["regressions"][category] = stats["regressions"].get(category, 0) + 1
+                        stats["examples"].extend(
+                            f"用例 {case} ({label}) {category}: {example}" for example in examples)
+                        failed = True
+
+            if failed and on_failure is not None:
+                on_failure(case, content, results)
+            logger.debug(f"用例 {case} 完成")
+
+        return {"cases": cases, "seed": seed, "reference": self.reference, "engines": summary}
+
+
+def format_report(report: dict) -> str:
+    """把汇总报告格式化为文本表格"""
+    lines = [f"用例数: {report['cases']}，随机种子: {report['seed']}，参考引擎: {report['reference']}", ""]
+    header = f"{'引擎':<14}{'出错':>6}{'耗时(秒)':>12}{'相对参考':>10}  与预期不一致的用例数（其中回归）"
+    lines.append(header)
+    for name, stats in report["engines"].items():
+        ratio = stats["seconds"] / stats["reference_seconds"] if stats["reference_seconds"] else float("nan")
+        mismatches = "，".join(
+            f"{category} {count}" + (f"({stats['regressions'][category]})" if stats["regressions"].get(category) else "")
+            for category, count in sorted(stats["mismatches"].items(), key=lambda item: CATEGORIES.index(item[0]))
+        ) or "无"
+        lines.append(f"{name:<14}{stats['errors']:>6}{stats['seconds']:>12.3f}{ratio:>10.2f}  {mismatches}")
+
+    for name, stats in report["engines"].items():
+        if stats["examples"]:
+            lines.append("")
+            lines.append(f"{name} 的问题示例:")
+            lines.extend(f"  {example}" for example in stats["examples"][:20])
+    return "\n".join(lines)
+
+
+def has_regressions(report: dict) -> bool:
+    """是否有引擎出错，或出现参考引擎没有的差异"""
+    return any(
+        stats["regressions"] or (stats["errors"] and name != report["reference"])
+        for name, stats in report["engines"].items()
+    )
@@ -4,109 +4,585 @@ Excel 服务类
 """
 
 import io
+import os
 import logging
-from typing import List, BinaryIO
+import sqlite3
+import zipfile
+import copy
+from xml.etree.ElementTree import ParseError
+from typing import List, BinaryIO, Iterator, Callable, Optional, Dict, Tuple
 from openpyxl import load_workbook
 from openpyxl.workbook import Workbook
 from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.cell.cell import MergedCell
+from openpyxl.utils import get_column_letter, column_index_from_string
+
+from services.column_map import ColumnMap
+from services.row_filter import RowFilter
+from services.column_cache import ColumnStreamCache
+from services.job_store import JobStore, copy_result, job_key
+from services.job_trace import JobTrace, activate, bind, phase
+from services.workbook_index import IndexUnsupported, WorkbookIndex, WorkbookIndexStore
+from services.xlsx_fast_engine import CellValueReader, FastXlsxEngine, FastPathUnsupported
+from utils.cancellation import (
+    CancelToken, CancellableFile, JobCancelled, activate_token, bind_token, check_cancelled, release_memory,
+)
+from utils.stream_utils import iter_written_chunks, DEFAULT_CHUNK_SIZE
+from utils.mapped_input import MappedInput, ExcelSource
 
 logger = logging.getLogger(__name__)
 
+# 工作簿索引保存目录（位于上传目录中）
+INDEX_DIR = os.path.join("uploads", "index")
+
+# 列分解缓存目录，同一文件以不同的列重复处理时直接拼接
+CACHE_DIR = os.path.join("uploads", "columns")
+
+# 任务存储和结果缓存目录，多个服务进程共享
+JOB_DIR = os.path.join("uploads", "jobs")
+
+# 是否启用任务存储和结果缓存：1 启用，0 关闭；未设置时仅在多进程模式下启用
+RESULT_CACHE_ENV = "EXCEL_RESULT_CACHE"
+
+# 可选的处理引擎
+ENGINES = ("auto", "fast", "openpyxl")
+
+# 检查工作簿结构时出现这些错误说明快速引擎无法读取（XML 损坏、部件缺失、加密或
+# 不支持的压缩方式等），auto 模式下交给 openpyxl 处理，由其给出具体错误
+INSPECT_FALLBACK_ERRORS = (
+    FastPathUnsupported, IndexUnsupported, zipfile.BadZipFile, ParseError, KeyError, ValueError,
+    NotImplementedError, RuntimeError,
+)
+
+# 预览时读取的最大行号（表头 + 4 行示例数据）
+PREVIEW_MAX_ROW = 5
+
+def result_cache_dir() -> Optional[str]:
+    """
+    根据环境变量决定任务存储和结果缓存的目录
+    
+    单进程时相同的请求不会被重复处理，缓存结果只会占用磁盘，因此默认只在
+    EXCEL_WORKERS 大于 1 时启用；EXCEL_RESULT_CACHE 可显式开启或关闭。
+    
+    Returns:
+        Optional[str]: 结果缓存目录，不启用时返回 None
+    """
+    setting = os.environ.get(RESULT_CACHE_ENV, "").strip().lower()
+    if setting in ("1", "true", "yes", "on"):
+        return JOB_DIR
+    if setting in ("0", "false", "no", "off"):
+        return None
+    try:
+        workers = int(os.environ.get("EXCEL_WORKERS", "1"))
+    except ValueError:
+        workers = 1
+    return JOB_DIR if workers > 1 else None
+
 class ExcelService:
     """Excel 处理服务"""
     
-    def get_columns_info(self, file_content: bytes) -> List[dict]:
+    def __init__(self, index_dir: str = INDEX_DIR, engine: str = "auto",
+                 cache_dir: Optional[str] = CACHE_DIR, job_dir: Optional[str] = None):
+        """
+        以上目录均可由多个进程共享，多进程运行时相同的任务只处理一次
+        
+        Args:
+            index_dir: 工作簿索引的保存目录
+            engine: 处理引擎，auto（优先快速引擎）、fast 或 openpyxl
+            cache_dir: 列分解缓存目录，为 None 时不缓存
+            job_dir: 任务存储和结果缓存目录，为 None 时不缓存结果（见 result_cache_dir）
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"未知的处理引擎: {engine}")
+        self.index_store = WorkbookIndexStore(index_dir)
+        self.column_cache = ColumnStreamCache(cache_dir) if cache_dir else None
+        self.job_store = JobStore(job_dir) if job_dir else None
+        self.engine = engine
+    
+    def get_columns_info(self, file_content: ExcelSource, trace: Optional[JobTrace] = None,
+                         cancel: Optional[CancelToken] = None) -> List[dict]:
         """
         获取 Excel 文件的列信息
         
+        优先通过工作簿索引直接读取活动工作表的前几行，
+        索引不适用时回退为完整加载工作簿。
+        
         Args:
-            file_content: Excel 文件的二进制内容
+            file_content: Excel 文件的二进制内容，或磁盘上的文件路径/文件对象（通过 mmap 读取）
+            trace: 可选的性能跟踪，记录本次处理的各阶段
+            cancel: 可选的取消令牌，取消后在下一个检查点抛出 JobCancelled
         
         Returns:
             List[dict]: 列信息列表
         """
         try:
-            # 从字节流加载工作簿
-            file_stream = io.BytesIO(file_content)
-            workbook = load_workbook(file_stream, data_only=True)
-            
+            with activate(trace), activate_token(cancel), MappedInput(file_content) as source:
+                return self._get_columns_info(source)
+        except JobCancelled as e:
+            logger.info(f"预览已取消: {e}")
+            release_memory(e)
+            raise
+        except Exception as e:
+            logger.error(f"获取列信息时出错: {str(e)}", exc_info=True)
+            raise Exception(f"获取列信息失败: {str(e)}")
+    
+    def _get_columns_info(self, source: MappedInput) -> List[dict]:
+        """读取列信息，优先使用索引"""
+        try:
+            columns_info = self._columns_info_from_index(source)
+        except Exception as e:
+            logger.info(f"无法通过索引预览，回退为完整解析: {str(e)}")
+            columns_info = None
+        
+        if columns_info is None:
+            with phase("加载工作簿"):
+                workbook = load_workbook(CancellableFile(source.open()), data_only=True)
+                
             # 获取第一个工作表
             worksheet = workbook.active
             
-            columns_info = []
-            
-            if worksheet.max_row > 0 and worksheet.max_column > 0:
-                # 获取第一行作为表头
-                for col in range(1, worksheet.max_column + 1):
-                    cell_value = worksheet.cell(row=1, column=col).value
-                    column_name = str(cell_value) if cell_value is not None else f"列{col}"
-                    
-                    # 获取该列的一些示例数据
-                    sample_data = []
-                    for row in range(2, min(6, worksheet.max_row + 1)):  # 最多取4行示例数据
-                        cell_value = worksheet.cell(row=row, column=col).value
-                        if cell_value is not None:
-                            sample_data.append(str(cell_value))
-                    
-                    columns_info.append({
-                        "index": col,
-                        "name": column_name,
-                        "sample_data": sample_data[:3]  # 只返回前3个示例
-                    })
-            
-            logger.info(f"成功获取列信息，共 {len(columns_info)} 列")
-            return columns_info
+            columns_info = self._build_columns_info(
+                worksheet.max_row,
+                worksheet.max_column,
+                lambda row, col: worksheet.cell(row=row, column=col).value
+            )
+        
+        logger.info(f"成功获取列信息，共 {len(columns_info)} 列")
+        return columns_info
+    
+    def _columns_info_from_index(self, source: MappedInput) -> List[dict]:
+        """
+        通过工作簿索引读取活动工作表的表头和示例数据
+        
+        Args:
+            source: Excel 文件内容
+        
+        Returns:
+            List[dict]: 列信息列表
+        
+        Raises:
+            IndexUnsupported: 工作簿不适合通过索引读取时
+        """
+        with zipfile.ZipFile(source.open()) as archive:
+            with phase("读取工作簿索引"):
+                index = self.index_store.get_or_build(source.digest, archive)
+            sheet = index.active_sheet
+            
+            with phase("读取预览行"):
+                rows = {
+                    row: dict(cells)
+                    for row, cells in index.iter_rows(archive, sheet, 1, PREVIEW_MAX_ROW)
+                }
             
-        except Exception as e:
-            logger.error(f"获取列信息时出错: {str(e)}", exc_info=True)
-            raise Exception(f"获取列信息失败: {str(e)}")
+            # 共享字符串按需解码，只解析预览用到的几个
+            shared_strings = None
+            values = {}
+            try:
+                for row, cells in rows.items():
+                    for col, cell in cells.items():
+                        if cell.get("t") == "s" and shared_strings is None:
+                            shared_strings = index.load_shared_strings(archive)
+                        values[(row, col)] = index.cell_value(cell, shared_strings)
+            finally:
+                if shared_strings is not None:
+                    shared_strings.close()
+        
+        return self._build_columns_info(
+            sheet["max_row"],
+            sheet["max_column"],
+            lambda row, col: values.get((row, col))
+        )
+    
+    def _build_columns_info(self, max_row: int, max_column: int,
+                            value_at: Callable[[int, int], object]) -> List[dict]:
+        """
+        根据单元格取值函数生成列信息
+        
+        Args:
+            max_row: 工作表最大行号
+            max_column: 工作表最大列号
+            value_at: (行, 列) -> 单元格值
+        
+        Returns:
+            List[dict]: 列信息列表
+        """
+        columns_info = []
+        
+        if max_row > 0 and max_column > 0:
+            # 获取第一行作为表头
+            for col in range(1, max_column + 1):
+                cell_value = value_at(1, col)
+                column_name = str(cell_value) if cell_value is not None else f"列{col}"
+                
+                # 获取该列的一些示例数据
+                sample_data = []
+                for row in range(2, min(PREVIEW_MAX_ROW + 1, max_row + 1)):  # 最多取4行示例数据
+                    cell_value = value_at(row, col)
+                    if cell_value is not None:
+                        sample_data.append(str(cell_value))
+                
+                columns_info.append({
+                    "index": col,
+                    "name": column_name,
+                    "sample_data": sample_data[:3]  # 只返回前3个示例
+                })
+        
+        return columns_info
     
-    def delete_columns(self, file_content: bytes, column_indices: List[int]) -> bytes:
+    def delete_columns(self, file_content: ExcelSource, column_indices: List[int],
+                       row_filter: Optional[RowFilter] = None, trace: Optional[JobTrace] = None,
+                       cancel: Optional[CancelToken] = None) -> bytes:
         """
         删除 Excel 文件中的指定列
         
         Args:
-            file_content: Excel 文件的二进制内容
+            file_content: Excel 文件的二进制内容，或磁盘上的文件路径/文件对象（通过 mmap 读取）
             column_indices: 要删除的列索引列表（从1开始，降序排列）
+            row_filter: 可选的行过滤条件，在删除列的同一遍处理中执行
+            trace: 可选的性能跟踪，记录本次处理的各阶段
+            cancel: 可选的取消令牌，取消后在下一个检查点停止处理
         
         Returns:
             bytes: 处理后的 Excel 文件二进制内容
         
         Raises:
             Exception: 当处理过程中出现错误时
+            JobCancelled: 处理被取消时
         """
-        try:
-            # 从字节流加载工作簿
-            file_stream = io.BytesIO(file_content)
-            workbook = load_workbook(file_stream, data_only=False)
+        with activate(trace), activate_token(cancel):
+            write = self._delete_writer(file_content, column_indices, row_filter)
+        return self._process(bind_token(cancel, bind(trace, write)))
+    
+    def project_columns(self, file_content: ExcelSource, column_order: List[int],
+                        row_filter: Optional[RowFilter] = None, trace: Optional[JobTrace] = None,
+                        cancel: Optional[CancelToken] = None) -> bytes:
+        """
+        按指定顺序保留 Excel 文件中的列（投影），未列出的列被删除
+        
+        Args:
+            file_content: Excel 文件的二进制内容，或磁盘上的文件路径/文件对象（通过 mmap 读取）
+            column_order: 要保留的列索引，按输出顺序排列（从1开始，不重复）
+            row_filter: 可选的行过滤条件，在同一遍处理中执行
+            trace: 可选的性能跟踪，记录本次处理的各阶段
+            cancel: 可选的取消令牌，取消后在下一个检查点停止处理
+        
+        Returns:
+            bytes: 处理后的 Excel 文件二进制内容
+        
+        Raises:
+            Exception: 当处理过程中出现错误时
+            JobCancelled: 处理被取消时
+        """
+        with activate(trace), activate_token(cancel):
+            write = self._project_writer(file_content, column_order, row_filter)
+        return self._process(bind_token(cancel, bind(trace, write)))
+    
+    def stream_delete_columns(self, file_content: ExcelSource, column_indices: List[int],
+                              row_filter: Optional[RowFilter] = None,
+                              chunk_size: int = DEFAULT_CHUNK_SIZE,
+                              trace: Optional[JobTrace] = None,
+                              cancel: Optional[CancelToken] = None) -> Iterator[bytes]:
+        """
+        以流式方式删除 Excel 文件中的指定列
+        
+        处理在后台线程中进行，zip 条目在生成的同时逐块输出（使用数据描述符），
+        调用方无需等待整个文件生成完毕即可开始发送，输出侧内存占用保持恒定。
+        
+        Args:
+            file_content: Excel 文件的二进制内容，或磁盘上的文件路径/文件对象（通过 mmap 读取）
+            column_indices: 要删除的列索引列表（从1开始，降序排列）
+            row_filter: 可选的行过滤条件
+            chunk_size: 每个输出数据块的大小
+            trace: 可选的性能跟踪，处理在后台线程中进行时同样记录
+            cancel: 可选的取消令牌，取消后后台线程停止处理并释放内存
+        
+        Returns:
+            Iterator[bytes]: 处理后文件的数据块迭代器
+        
+        Raises:
+            Exception: 当处理过程中出现错误时（在迭代过程中抛出）
+            JobCancelled: 处理被取消时（在迭代过程中抛出）
+        """
+        with activate(trace), activate_token(cancel):
+            write = self._delete_writer(file_content, column_indices, row_filter)
+        return self._stream(bind_token(cancel, bind(trace, write)), chunk_size, cancel)
+    
+    def stream_project_columns(self, file_content: ExcelSource, column_order: List[int],
+                               row_filter: Optional[RowFilter] = None,
+                               chunk_size: int = DEFAULT_CHUNK_SIZE,
+                               trace: Optional[JobTrace] = None,
+                               cancel: Optional[CancelToken] = None) -> Iterator[bytes]:
+        """
+        以流式方式按指定顺序保留 Excel 文件中的列
+        
+        Args:
+            file_content: Excel 文件的二进制内容，或磁盘上的文件路径/文件对象（通过 mmap 读取）
+            column_order: 要保留的列索引，按输出顺序排列
+            row_filter: 可选的行过滤条件
+            chunk_size: 每个输出数据块的大小
+            trace: 可选的性能跟踪，处理在后台线程中进行时同样记录
+            cancel: 可选的取消令牌，取消后后台线程停止处理并释放内存
+        
+        Returns:
+            Iterator[bytes]: 处理后文件的数据块迭代器
+        """
+        with activate(trace), activate_token(cancel):
+            write = self._project_writer(file_content, column_order, row_filter)
+        return self._stream(bind_token(cancel, bind(trace, write)), chunk_size, cancel)
+    
+    def _delete_writer(self, file_content: ExcelSource, column_indices: List[int],
+                       row_filter: Optional[RowFilter]) -> Callable[[BinaryIO], None]:
+        """选择删除列使用的引擎，返回向输出写入结果的函数"""
+        column_map = ColumnMap.for_deletion(column_indices)
+        source = MappedInput(file_content)
+        write = self._select_writer(
+            source,
+            column_map,
+            row_filter,
+            lambda: self._load_and_delete(source, column_indices, row_filter)
+        )
+        return self._shared_writer(source, "delete-columns", column_map.deleted, row_filter, write)
+    
+    def _project_writer(self, file_content: ExcelSource, column_order: List[int],
+                        row_filter: Optional[RowFilter]) -> Callable[[BinaryIO], None]:
+        """选择列投影使用的引擎，返回向输出写入结果的函数"""
+        column_map = ColumnMap.for_projection(column_order)
+        source = MappedInput(file_content)
+        write = self._select_writer(
+            source,
+            column_map,
+            row_filter,
+            lambda: self._load_and_project(source, column_order, row_filter)
+        )
+        return self._shared_writer(source, "project-columns", column_map.order, row_filter, write)
+    
+    def _shared_writer(self, source: MappedInput, operation: str, columns: List[int],
+                       row_filter: Optional[RowFilter],
+                       write: Callable[[BinaryIO], None]) -> Callable[[BinaryIO], None]:
+        """
+        通过任务存储执行处理
+        
+        已有相同任务的结果时直接输出；其他进程正在处理相同任务时等待其结果；
+        否则由当前进程处理，输出的同时保存结果。
+        
+        Args:
+            source: Excel 文件内容
+            operation: 操作名称
+            columns: 删除或保留的列
+            row_filter: 可选的行过滤条件
+            write: 实际处理的写入函数（负责关闭 source）
+        
+        Returns:
+            Callable[[BinaryIO], None]: 向输出写入处理结果的函数
+        """
+        if self.job_store is None:
+            return write
+        
+        params = {
+            "columns": columns,
+            "row_filter": row_filter.signature() if row_filter is not None and row_filter.active else None,
+            "engine": self.engine,
+        }
+        key = job_key(source.digest, operation, params)
+        store = self.job_store
+        
+        def write_shared(output: BinaryIO):
+            try:
+                with phase("查询任务存储"):
+                    result = store.open_result(key)
+                    if result is None and not store.claim(key, operation):
+                        logger.info(f"相同的任务 {key[:12]} 正在处理，等待结果")
+                        result = store.wait(key)
+                        if result is None:
+                            # 另一进程处理失败或超时，自行处理但不保存结果
+                            write(output)
+                            return
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"任务存储不可用: {str(e)}")
+                write(output)
+                return
             
-            logger.info(f"成功加载工作簿，包含 {len(workbook.worksheets)} 个工作表")
-            
-            # 处理每个工作表
-            for sheet_name in workbook.sheetnames:
-                worksheet = workbook[sheet_name]
-                logger.info(f"处理工作表: {sheet_name}")
-                
-                # 检查工作表是否有数据
-                if worksheet.max_row == 1 and worksheet.max_column == 1:
-                    # 空工作表，跳过
-                    continue
-                
-                # 验证列索引是否有效
-                max_column = worksheet.max_column
-                invalid_columns = [col for col in column_indices if col > max_column]
-                if invalid_columns:
-                    logger.warning(f"工作表 {sheet_name} 中的无效列索引: {invalid_columns} (最大列数: {max_column})")
-                
-                # 删除有效的列（从右到左删除，避免索引变化）
-                valid_columns = [col for col in column_indices if col <= max_column]
-                for col_index in valid_columns:
-                    logger.info(f"删除工作表 {sheet_name} 的第 {col_index} 列")
-                    self._delete_column_with_style(worksheet, col_index)
+            if result is not None:
+                logger.info(f"使用已缓存的处理结果 {key[:12]}")
+                source.close()
+                with phase("输出缓存的结果"):
+                    copy_result(result, output)
+                return
             
+            try:
+                recorder = store.recorder(output)
+            except OSError as e:
+                logger.warning(f"无法保存处理结果: {str(e)}")
+                store.fail(key, str(e))
+                write(output)
+                return
+            try:
+                write(recorder)
+            except BaseException as e:
+                try:
+                    store.fail(key, str(e) or type(e).__name__, recorder)
+                except (OSError, sqlite3.Error) as store_error:
+                    logger.warning(f"记录任务失败状态时出错: {str(store_error)}")
+                raise
+            try:
+                store.complete(key, recorder)
+            except (OSError, sqlite3.Error) as e:
+                # 结果已经输出，保存失败只影响之后的请求
+                logger.warning(f"保存处理结果失败: {str(e)}")
+        
+        return write_shared
+    
+    def _select_writer(self, source: MappedInput, column_map: ColumnMap,
+                       row_filter: Optional[RowFilter],
+                       build: Callable[[], Workbook]) -> Callable[[BinaryIO], None]:
+        """
+        选择处理引擎
+        
+        快速引擎只改写与列有关的 XML，样式等部件原样保留，行过滤在流式改写中逐行判断；
+        图形、批注、表格等情况由 openpyxl 引擎处理。auto 模式下快速引擎出错且输出尚可重写时，
+        自动改用 openpyxl 引擎重新生成。
+        
+        Args:
+            source: Excel 文件内容，写入完成后关闭
+            column_map: 列映射
+            row_filter: 可选的行过滤条件
+            build: 使用 openpyxl 加载并处理工作簿的函数
+        
+        Returns:
+            Callable[[BinaryIO], None]: 向输出写入处理结果的函数
+        """
+        def write_openpyxl(output: BinaryIO):
+            try:
+                with phase("openpyxl 加载并处理"):
+                    workbook = build()
+                with phase("保存工作簿"):
+                    workbook.save(CancellableFile(output))
+            finally:
+                source.close()
+        
+        if self.engine == "openpyxl":
+            return write_openpyxl
+        
+        archive = None
+        index = None
+        try:
+            with phase("检查快速引擎是否适用"):
+                archive = zipfile.ZipFile(source.open())
+                parts = FastXlsxEngine.inspect(archive)
+                if row_filter is not None and row_filter.active:
+                    # 行过滤需要每个工作表参与判断的行数以及解析单元格值所需的样式信息
+                    index = self.index_store.get_or_build(source.digest, archive)
+                    row_limits = self._filter_row_limits(index, parts["sheet_paths"])
+        except BaseException as e:
+            if archive is not None:
+                archive.close()
+            if self.engine == "fast" or not isinstance(e, INSPECT_FALLBACK_ERRORS):
+                source.close()
+                raise
+            logger.info(f"快速引擎不适用，使用 openpyxl 引擎: {type(e).__name__}: {str(e)}")
+            return write_openpyxl
+        
+        def write_fast(output: BinaryIO):
+            logger.info("使用快速引擎处理" + ("（内存映射输入）" if source.is_mapped else ""))
+            try:
+                with phase("快速引擎处理"):
+                    if index is None:
+                        self._transform_fast(source, archive, parts, column_map, output)
+                    else:
+                        self._transform_filtered(source, archive, parts, column_map, output,
+                                                 row_filter, index, row_limits)
+            except Exception as e:
+                if self.engine == "fast" or not output.seekable():
+                    raise
+                logger.warning(f"快速引擎处理失败，改用 openpyxl 引擎: {str(e)}", exc_info=True)
+                output.seek(0)
+                output.truncate()
+                with phase("改用 openpyxl 重新生成"):
+                    build().save(CancellableFile(output))
+            finally:
+                archive.close()
+                source.close()
+        
+        return write_fast
+    
+    def _transform_fast(self, source: MappedInput, archive: zipfile.ZipFile, parts: dict,
+                        column_map: ColumnMap, output: BinaryIO):
+        """
+        使用快速引擎处理，启用缓存时工作表从列分解缓存拼接
+        
+        文件第一次处理时在改写的同时生成缓存，之后以任意列映射处理同一文件
+        都只需拼接保留的列，不再解压和解析工作表。
+        """
+        engine = FastXlsxEngine(column_map)
+        entry = None
+        if self.column_cache is not None:
+            try:
+                with phase("打开列分解缓存"):
+                    entry = self.column_cache.open(source.digest, archive, parts["sheet_paths"])
+            except OSError as e:
+                logger.warning(f"列分解缓存不可用: {str(e)}")
+        
+        if entry is None:
+            engine.transform(archive, output, parts, buffer=source.buffer)
+            return
+        
+        try:
+            engine.transform(archive, output, parts, buffer=source.buffer, sheet_writers=entry.sheet_writers())
+        except BaseException:
+            entry.abort()
+            raise
+        entry.commit()
+    
+    def _transform_filtered(self, source: MappedInput, archive: zipfile.ZipFile, parts: dict,
+                            column_map: ColumnMap, output: BinaryIO, row_filter: RowFilter,
+                            index: WorkbookIndex, row_limits: Dict[str, int]):
+        """
+        使用快速引擎同时处理列和行过滤
+        
+        列分解缓存保存的是未过滤的行，这里直接从源文件改写；
+        去重键超出内存上限后写入临时数据库，整个过程的内存占用与行数无关。
+        """
+        values = CellValueReader(index, archive)
+        try:
+            engine = FastXlsxEngine(column_map, row_filter, row_limits, values)
+            engine.transform(archive, output, parts, buffer=source.buffer)
+        finally:
+            values.close()
+    
+    @staticmethod
+    def _filter_row_limits(index: WorkbookIndex, sheet_paths: List[str]) -> Dict[str, int]:
+        """
+        每个工作表参与行过滤的最后一行，与 openpyxl 加载后的 max_row 相同（包括合并区域）
+        
+        Raises:
+            FastPathUnsupported: 工作表中有没有 r 属性的单元格，无法从索引得到最大行时
+        """
+        limits = {}
+        for sheet in index.sheets:
+            if sheet["path"] not in sheet_paths:
+                continue
+            if sheet.get("implicit_refs"):
+                raise FastPathUnsupported(f"工作表 {sheet['name']} 的单元格缺少引用，无法确定过滤范围")
+            limits[sheet["path"]] = sheet["max_row"]
+        missing = set(sheet_paths) - set(limits)
+        if missing:
+            raise FastPathUnsupported(f"索引中缺少工作表 {sorted(missing)}")
+        return limits
+    
+    def _process(self, write: Callable[[BinaryIO], None]) -> bytes:
+        """
+        生成处理结果并返回字节内容
+        
+        Args:
+            write: 向输出写入处理结果的函数
+        
+        Returns:
+            bytes: 处理后的 Excel 文件二进制内容
+        """
+        try:
             # 保存到字节流
             output_stream = io.BytesIO()
-            workbook.save(output_stream)
+            write(output_stream)
             output_stream.seek(0)
             
             result = output_stream.getvalue()
@@ -114,10 +590,224 @@ class ExcelService:
             
             return result
             
+        except JobCancelled as e:
+            # 丢弃已生成的部分输出，立即回收处理过程中的工作簿等对象
+            logger.info(f"处理已取消: {e}")
+            output_stream = None
+            release_memory(e)
+            raise
         except Exception as e:
             logger.error(f"处理 Excel 文件时出错: {str(e)}", exc_info=True)
             raise Exception(f"Excel 文件处理失败: {str(e)}")
     
+    def _stream(self, write: Callable[[BinaryIO], None], chunk_size: int,
+                cancel: Optional[CancelToken] = None) -> Iterator[bytes]:
+        """
+        在后台线程中生成处理结果，并以数据块的形式输出
+        
+        Args:
+            write: 向输出写入处理结果的函数
+            chunk_size: 每个输出数据块的大小
+            cancel: 可选的取消令牌
+        
+        Returns:
+            Iterator[bytes]: 数据块迭代器
+        """
+        def produce(output: BinaryIO):
+            write(output)
+            logger.info("成功以流式方式输出 Excel 文件")
+        
+        try:
+            yield from iter_written_chunks(produce, chunk_size=chunk_size, cancel=cancel)
+        except Exception as e:
+            logger.error(f"流式处理 Excel 文件时出错: {str(e)}", exc_info=True)
+            raise Exception(f"Excel 文件处理失败: {str(e)}")
+    
+    def _load_and_delete(self, source: MappedInput, column_indices: List[int],
+                         row_filter: Optional[RowFilter] = None) -> Workbook:
+        """
+        加载工作簿并删除每个工作表中的指定列
+        
+        Args:
+            source: Excel 文件内容
+            column_indices: 要删除的列索引列表（从1开始，降序排列）
+            row_filter: 可选的行过滤条件
+        
+        Returns:
+            Workbook: 处理后的工作簿
+        """
+        # 从字节流或内存映射加载工作簿
+        with phase("加载工作簿"):
+            workbook = load_workbook(CancellableFile(source.open()), data_only=False)
+        
+        logger.info(f"成功加载工作簿，包含 {len(workbook.worksheets)} 个工作表")
+        
+        # 处理每个工作表
+        for sheet_name in workbook.sheetnames:
+            check_cancelled()
+            worksheet = workbook[sheet_name]
+            logger.info(f"处理工作表: {sheet_name}")
+            
+            # 检查工作表是否有数据
+            if worksheet.max_row == 1 and worksheet.max_column == 1:
+                # 空工作表，跳过
+                continue
+            
+            # 验证列索引是否有效
+            max_column = worksheet.max_column
+            invalid_columns = [col for col in column_indices if col > max_column]
+            if invalid_columns:
+                logger.warning(f"工作表 {sheet_name} 中的无效列索引: {invalid_columns} (最大列数: {max_column})")
+            
+            valid_columns = [col for col in column_indices if col <= max_column]
+            
+            if row_filter is not None and row_filter.active:
+                # 行过滤与列删除在一次单元格重排中完成
+                logger.info(f"工作表 {sheet_name}: 删除列 {valid_columns}，{row_filter.describe()}")
+                row_filter.start_sheet()
+                try:
+                    self._remap_worksheet(worksheet, ColumnMap.for_deletion(valid_columns), row_filter)
+                finally:
+                    row_filter.close()
+                continue
+            
+            # 删除有效的列（从右到左删除，避免索引变化）
+            for col_index in valid_columns:
+                logger.info(f"删除工作表 {sheet_name} 的第 {col_index} 列")
+                self._delete_column_with_style(worksheet, col_index)
+        
+        return workbook
+    
+    def _load_and_project(self, source: MappedInput, column_order: List[int],
+                          row_filter: Optional[RowFilter] = None) -> Workbook:
+        """
+        加载工作簿并对每个工作表执行列投影
+        
+        Args:
+            source: Excel 文件内容
+            column_order: 要保留的列索引，按输出顺序排列
+            row_filter: 可选的行过滤条件
+        
+        Returns:
+            Workbook: 处理后的工作簿
+        """
+        with phase("加载工作簿"):
+            workbook = load_workbook(CancellableFile(source.open()), data_only=False)
+        
+        logger.info(f"成功加载工作簿，包含 {len(workbook.worksheets)} 个工作表")
+        
+        column_map = ColumnMap.for_projection(column_order)
+        for sheet_name in workbook.sheetnames:
+            check_cancelled()
+            worksheet = workbook[sheet_name]
+            logger.info(f"工作表 {sheet_name}: 按顺序保留列 {column_order}")
+            
+            max_column = worksheet.max_column
+            missing_columns = [col for col in column_order if col > max_column]
+            if missing_columns:
+                logger.warning(f"工作表 {sheet_name} 中不存在的列: {missing_columns} (最大列数: {max_column})，输出为空列")
+            
+            if row_filter is not None and row_filter.active:
+                row_filter.start_sheet()
+            try:
+                self._remap_worksheet(worksheet, column_map, row_filter)
+            finally:
+                if row_filter is not None:
+                    row_filter.close()
+        
+        return workbook
+    
+    def _remap_worksheet(self, worksheet: Worksheet, column_map: ColumnMap,
+                         row_filter: Optional[RowFilter] = None):
+        """
+        一次遍历完成列重排和行过滤
+        
+        每个单元格只移动一次，行高、列宽和合并单元格随之调整，
+        避免逐列 delete_cols / 逐行 delete_rows 的重复移动。
+        
+        Args:
+            worksheet: 工作表对象
+            column_map: 原始列 -> 输出列的映射
+            row_filter: 可选的行过滤条件
+        """
+        # 按行分组（合并单元格的占位单元格不参与取值）
+        rows: Dict[int, List[Tuple[int, object]]] = {}
+        for (row, col), cell in worksheet._cells.items():
+            rows.setdefault(row, []).append((col, cell))
+        
+        # 计算行映射：保留的行依次上移，填补被删除的行
+        row_map: Dict[int, int] = {}
+        dropped = 0
+        max_row = max(rows) if rows else 0
+        for row in range(1, max_row + 1):
+            cells = rows.get(row, [])
+            if row_filter is not None and row_filter.active:
+                values = {
+                    col: cell.value for col, cell in cells
+                    if not isinstance(cell, MergedCell) and cell.value is not None
+                }
+                if not row_filter.keep(row, values):
+                    dropped += 1
+                    continue
+            row_map[row] = row - dropped
+        
+        # 记录合并区域并先取消合并，移动完成后按新位置重新合并
+        merged_ranges = [cell_range.bounds for cell_range in worksheet.merged_cells.ranges]
+        for cell_range in list(worksheet.merged_cells.ranges):
+            worksheet.unmerge_cells(cell_range.coord)
+        
+        new_cells = {}
+        for (row, col), cell in worksheet._cells.items():
+            new_row = row_map.get(row)
+            new_col = column_map.get(col)
+            if new_row is None or new_col is None:
+                continue
+            cell.row = new_row
+            cell.column = new_col
+            if cell.hyperlink is not None:
+                # 超链接保存时使用自身记录的位置，需要随单元格更新
+                cell.hyperlink.ref = cell.coordinate
+            new_cells[(new_row, new_col)] = cell
+        worksheet._cells = new_cells
+        
+        # 行高等行属性
+        row_dimensions = list(worksheet.row_dimensions.items())
+        worksheet.row_dimensions.clear()
+        for row, dimension in row_dimensions:
+            new_row = row_map.get(row, None if row <= max_row else row - dropped)
+            if new_row is not None:
+                dimension.index = new_row
+                worksheet.row_dimensions[new_row] = dimension
+        
+        # 列宽等列属性，被删除列之后的区间整体左移
+        column_dimensions = list(worksheet.column_dimensions.values())
+        worksheet.column_dimensions.clear()
+        for dimension in column_dimensions:
+            min_col = dimension.min or column_index_from_string(dimension.index)
+            max_col = dimension.max or min_col
+            for new_min, new_max in column_map.remap_span(min_col, max_col):
+                new_dimension = copy.copy(dimension)
+                new_dimension.index = get_column_letter(new_min)
+                new_dimension.min = new_min
+                new_dimension.max = new_max
+                worksheet.column_dimensions[new_dimension.index] = new_dimension
+        
+        # 重新合并：列方向只能映射为一个连续区间，行方向取保留下来的首尾行
+        for min_col, min_row, max_col, max_row in merged_ranges:
+            col_spans = column_map.remap_span(min_col, max_col)
+            kept_rows = [row_map[row] for row in range(min_row, max_row + 1) if row in row_map]
+            if len(col_spans) != 1 or not kept_rows:
+                continue
+            (new_min_col, new_max_col), new_min_row, new_max_row = col_spans[0], kept_rows[0], kept_rows[-1]
+            if new_min_col == new_max_col and new_min_row == new_max_row:
+                continue
+            worksheet.merge_cells(
+                start_row=new_min_row, start_column=new_min_col,
+                end_row=new_max_row, end_column=new_max_col
+            )
+        
+        logger.info(f"工作表 {worksheet.title} 重排完成，删除 {dropped} 行")
+    
     def _delete_column_with_style(self, worksheet: Worksheet, column_index: int):
         """
         删除指定列并正确处理合并单元格
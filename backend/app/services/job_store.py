@@ -0,0 +1,464 @@
+"""
+任务存储与结果缓存
+多个服务进程通过同一目录下的 SQLite 数据库共享任务状态：
+相同的任务（文件内容和处理参数都相同）同一时间只由一个进程处理，
+其他进程等待其结果；完成的结果保存在磁盘上，之后的相同请求直接返回
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import logging
+from typing import BinaryIO, List, Optional
+
+from utils.cancellation import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+# 结果格式或处理逻辑变化时递增，使旧结果失效
+RESULT_VERSION = 1
+
+# 默认最多保留的结果数量、总大小和单个结果的大小
+DEFAULT_MAX_ENTRIES = 200
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_RESULT_BYTES = 256 * 1024 * 1024
+
+# 等待其他进程完成同一任务的最长时间和轮询间隔（秒）；
+# 等待期间占用一个线程池线程，超时后自行处理
+WAIT_TIMEOUT = 120
+WAIT_INTERVAL = 0.2
+
+# 处理中的任务超过该时间未完成，视为处理进程已退出
+STALE_JOB_AGE = 3600
+
+# 数据库被其他进程锁定时的等待时间（秒）
+DB_TIMEOUT = 30
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_DB_NAME = "jobs.db"
+_TEMP_PREFIX = "tmp-"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker INTEGER NOT NULL,
+    worker_started INTEGER,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    last_used_at REAL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    size INTEGER,
+    error TEXT
+)
+"""
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def job_key(digest: str, operation: str, params: dict) -> str:
+    """
+    计算任务的键
+
+    Args:
+        digest: 输入文件内容摘要
+        operation: 操作名称
+        params: 影响结果的全部参数（可序列化为 JSON）
+    """
+    payload = json.dumps([RESULT_VERSION, digest, operation, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Windows 上查询进程状态所需的权限和运行中进程的退出码
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+_STILL_ACTIVE = 259
+
+
+def _windows_process_start_time(pid: int) -> Optional[int]:
+    """Windows 上进程的创建时间（FILETIME），进程不存在或已退出时返回 None"""
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD))
+    kernel32.GetProcessTimes.argtypes = (wintypes.HANDLE,) + (ctypes.POINTER(wintypes.FILETIME),) * 4
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+    handle = kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        return None
+    try:
+        # 其他进程仍持有句柄时，已退出的进程也能打开，需要检查退出码
+        exit_code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)) or exit_code.value != _STILL_ACTIVE:
+            return None
+        times = [wintypes.FILETIME() for _ in range(4)]
+        if not kernel32.GetProcessTimes(handle, *(ctypes.byref(value) for value in times)):
+            return None
+        return times[0].dwHighDateTime << 32 | times[0].dwLowDateTime
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _process_start_time(pid: int) -> Optional[int]:
+    """
+    进程的启动时间，无法获取时返回 None
+
+    Linux 上读取 /proc（系统启动后的时钟周期数），Windows 上读取进程创建时间。
+    """
+    if os.name == "nt":
+        try:
+            return _windows_process_start_time(pid)
+        except (OSError, AttributeError):
+            return None
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # 进程名可能包含空格和括号，从最后一个右括号之后解析；启动时间是第 22 个字段
+    try:
+        return int(stat[stat.rindex(b")") + 2:].split()[19])
+    except (ValueError, IndexError):
+        return None
+
+
+def _process_alive(pid: int, started: Optional[int] = None) -> bool:
+    """
+    同一台机器上的进程是否仍在运行（无法检测的平台上视为运行中）
+
+    进程号会被重复使用（容器或服务重启后尤其常见），记录了启动时间时同时比较启动时间，
+    进程号相同但启动时间不同说明原进程已经退出。
+    """
+    if started is not None:
+        return _process_start_time(pid) == started
+    if os.name == "nt":
+        return _process_start_time(pid) is not None
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class ResultRecorder:
+    """
+    把写入输出的数据同时写入临时文件，输出可定位时同步定位
+
+    zipfile 在可定位的输出上会回填本地文件头，临时文件跟随同样的定位，
+    最终内容与输出完全一致。超过大小上限后停止记录。
+    """
+
+    def __init__(self, output: BinaryIO, path: str, max_bytes: int):
+        self.output = output
+        self.path = path
+        self.max_bytes = max_bytes
+        self.overflow = False
+        self._file = open(path, "wb")
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.output.seekable()
+
+    def tell(self) -> int:
+        return self.output.tell()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        position = self.output.seek(offset, whence)
+        if self._file is not None:
+            self._file.seek(position)
+        return position
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        result = self.output.truncate(size)
+        if self._file is not None:
+            self._file.truncate(size)
+        return result
+
+    def write(self, data) -> int:
+        written = self.output.write(data)
+        if self._file is not None:
+            self._file.write(data)
+            if self._file.tell() > self.max_bytes:
+                logger.info(f"结果超过 {self.max_bytes} 字节，不再缓存")
+                self.overflow = True
+                self.discard()
+        return written
+
+    def flush(self):
+        self.output.flush()
+
+    def close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """放弃记录并删除临时文件"""
+        self.close_file()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class JobStore:
+    """
+    基于 SQLite 的任务存储
+
+    任务状态: running（某个进程正在处理）、done（结果已保存）、failed（处理失败，可重新领取）。
+    SQLite 负责进程间的锁，数据库和结果文件需位于本机磁盘。
+    """
+
+    def __init__(self, directory: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_result_bytes: int = DEFAULT_MAX_RESULT_BYTES):
+        """
+        Args:
+            directory: 数据库和结果文件的目录
+            max_entries: 最多保留的结果数量
+            max_bytes: 结果总大小上限（字节）
+            max_result_bytes: 单个结果的大小上限，超过时不缓存
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_result_bytes = max_result_bytes
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """每次操作使用独立连接，连接不跨线程共享"""
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        connection = sqlite3.connect(os.path.join(self.directory, _DB_NAME), timeout=DB_TIMEOUT,
+                                     isolation_level=None)
+        if not self._initialized:
+            # WAL 模式下读取不阻塞写入
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(_SCHEMA)
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+            if "worker_started" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN worker_started INTEGER")
+            self._clear_orphans(connection)
+            self._initialized = True
+        return connection
+
+    def _clear_orphans(self, connection: sqlite3.Connection):
+        """删除处理进程已退出的任务记录（例如服务或容器重启前未完成的任务）"""
+        rows = connection.execute(
+            "SELECT key, worker, worker_started FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+        orphans = [key for key, worker, started in rows if not _process_alive(worker, started)]
+        for key in orphans:
+            connection.execute("DELETE FROM jobs WHERE key = ? AND status = ?", (key, RUNNING))
+        if orphans:
+            logger.info(f"清理 {len(orphans)} 个处理进程已退出的任务")
+
+    def _result_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.xlsx")
+
+    def open_result(self, key: str) -> Optional[BinaryIO]:
+        """
+        打开已完成任务的结果
+
+        Returns:
+            Optional[BinaryIO]: 结果文件，未完成或文件已被淘汰时返回 None
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT status FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] != DONE:
+                return None
+            try:
+                # 打开后即使被其他进程淘汰也能继续读取（Windows 上淘汰会失败并推迟）
+                result = open(self._result_path(key), "rb")
+            except OSError:
+                connection.execute("DELETE FROM jobs WHERE key = ? AND status = ?", (key, DONE))
+                return None
+            connection.execute(
+                "UPDATE jobs SET last_used_at = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            return result
+        finally:
+            connection.close()
+
+    def claim(self, key: str, operation: str) -> bool:
+        """
+        领取任务
+
+        Returns:
+            bool: 是否由当前进程处理；任务已在其他地方处理中或已完成时返回 False
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT status, worker, worker_started, created_at FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                status, worker, started, created_at = row
+                stale = status == RUNNING and (
+                    now - created_at > STALE_JOB_AGE or not _process_alive(worker, started))
+                if status == DONE or (status == RUNNING and not stale):
+                    connection.execute("COMMIT")
+                    return False
+                if stale:
+                    logger.warning(f"任务 {key[:12]} 的处理进程 {worker} 已无响应，重新处理")
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (key, operation, status, worker, worker_started, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, operation, RUNNING, os.getpid(), _process_start_time(os.getpid()), now),
+            )
+            connection.execute("COMMIT")
+            return True
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def wait(self, key: str, timeout: float = WAIT_TIMEOUT) -> Optional[BinaryIO]:
+        """
+        等待其他进程完成同一任务
+
+        Returns:
+            Optional[BinaryIO]: 结果文件；处理失败、超时、结果未缓存或处理进程已退出时返回 None
+
+        Raises:
+            JobCancelled: 等待期间当前请求被取消时
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            connection = self._connect()
+            try:
+                row = connection.execute(
+                    "SELECT status, worker, worker_started FROM jobs WHERE key = ?", (key,)).fetchone()
+            finally:
+                connection.close()
+            if row is None or row[0] == FAILED:
+                return None
+            if row[0] == DONE:
+                return self.open_result(key)
+            if not _process_alive(row[1], row[2]):
+                return None
+            check_cancelled()
+            time.sleep(WAIT_INTERVAL)
+        logger.warning(f"等待任务 {key[:12]} 超时")
+        return None
+
+    def recorder(self, output: BinaryIO) -> ResultRecorder:
+        """创建记录结果的输出包装"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{_TEMP_PREFIX}{uuid.uuid4().hex}")
+        return ResultRecorder(output, path, self.max_result_bytes)
+
+    def complete(self, key: str, recorder: ResultRecorder):
+        """保存结果并标记任务完成；结果过大时删除任务记录，之后的请求重新处理"""
+        recorder.close_file()
+        connection = self._connect()
+        try:
+            if recorder.overflow:
+                connection.execute("DELETE FROM jobs WHERE key = ?", (key,))
+                return
+            size = os.path.getsize(recorder.path)
+            os.replace(recorder.path, self._result_path(key))
+            now = time.time()
+            connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, last_used_at = ?, size = ?, error = NULL WHERE key = ?",
+                (DONE, now, now, size, key),
+            )
+        except OSError as e:
+            logger.warning(f"保存任务 {key[:12]} 的结果失败: {str(e)}")
+            recorder.discard()
+            connection.execute("DELETE FROM jobs WHERE key = ?", (key,))
+        finally:
+            connection.close()
+        self.evict()
+
+    def fail(self, key: str, error: str, recorder: Optional[ResultRecorder] = None):
+        """标记任务失败，等待中的进程将自行处理"""
+        if recorder is not None:
+            recorder.discard()
+        connection = self._connect()
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE key = ? AND worker = ?",
+                (FAILED, time.time(), error[:1000], key, os.getpid()),
+            )
+        finally:
+            connection.close()
+
+    def jobs(self, limit: int = 50) -> List[dict]:
+        """最近的任务，按创建时间倒序"""
+        connection = self._connect()
+        try:
+            connection.row_factory = sqlite3.Row
+            rows = connection.execute(
+                "SELECT key, operation, status, worker, created_at, finished_at, last_used_at, hits, size, error "
+                "FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+    def evict(self):
+        """按最近使用时间淘汰超出数量或大小上限的结果，并清理遗留的临时文件"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT key, size FROM jobs WHERE status = ? ORDER BY last_used_at DESC", (DONE,)).fetchall()
+            kept_bytes = 0
+            expired = []
+            for number, (key, size) in enumerate(rows):
+                kept_bytes += size or 0
+                if number >= self.max_entries or kept_bytes > self.max_bytes:
+                    expired.append(key)
+            for key in expired:
+                try:
+                    os.remove(self._result_path(key))
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    # 仍被读取（Windows），留待下次淘汰
+                    continue
+                connection.execute("DELETE FROM jobs WHERE key = ? AND status = ?", (key, DONE))
+            # 失败的任务记录只用于查看，保留最近的一部分
+            connection.execute(
+                "DELETE FROM jobs WHERE status = ? AND key NOT IN "
+                "(SELECT key FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?)",
+                (FAILED, FAILED, self.max_entries),
+            )
+        finally:
+            connection.close()
+        if expired:
+            logger.info(f"淘汰 {len(expired)} 个缓存的处理结果")
+
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.startswith(_TEMP_PREFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > STALE_JOB_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def copy_result(result: BinaryIO, output: BinaryIO):
+    """把缓存的结果写入输出并关闭结果文件"""
+    with result:
+        shutil.copyfileobj(result, output, COPY_CHUNK_SIZE)
@@ -0,0 +1,400 @@
+"""
+单次处理的性能跟踪
+按请求开启，记录各处理阶段的起止时间，可选地定时采样执行线程的调用栈，
+结果保存为 Chrome Trace Event 格式（可用 chrome://tracing、Perfetto 等查看）
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import threading
+import contextlib
+from typing import Callable, Dict, List, Optional
+
+# 调用栈采样间隔（秒）
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# 默认最多保留的跟踪文件数量
+DEFAULT_MAX_TRACES = 100
+
+# 跟踪文件保存目录（位于上传目录中）
+TRACE_DIR = os.path.join("uploads", "traces")
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._-]{0,63}$")
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# 阶段事件和采样事件分别显示为两个进程
+_PHASE_PID = 1
+_SAMPLE_PID = 2
+
+_local = threading.local()
+_NO_PHASE = contextlib.nullcontext()
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def is_valid_trace_id(trace_id: str) -> bool:
+    """跟踪 ID 由服务端生成，为 32 位十六进制小写字符串"""
+    return bool(trace_id) and _TRACE_ID_RE.match(trace_id) is not None
+
+
+def is_valid_request_id(request_id: str) -> bool:
+    """请求 ID 只能包含字母、数字、点、下划线和连字符，且不以点开头"""
+    return bool(request_id) and _REQUEST_ID_RE.match(request_id) is not None
+
+
+class JobTrace:
+    """一次处理的跟踪记录"""
+
+    def __init__(self, request_id: Optional[str], operation: str, profile: bool = False,
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL, args: Optional[dict] = None):
+        """
+        跟踪 ID 由服务端生成，作为保存跟踪结果的键；客户端提供的请求 ID 只作为标签，
+        不同客户端使用相同的请求 ID 时不会互相覆盖
+
+        Args:
+            request_id: 客户端提供的请求 ID，没有时为 None
+            operation: 操作名称，如 delete-columns
+            profile: 是否同时采样调用栈
+            sample_interval: 采样间隔（秒）
+            args: 附加在整体事件上的信息，如文件名
+        """
+        self.trace_id = new_trace_id()
+        self.request_id = request_id
+        self.operation = operation
+        self.profile = profile
+        self.sample_interval = sample_interval
+        self.args = dict(args or {})
+        self.events: List[dict] = []
+        self.threads: Dict[int, str] = {}
+        self._start = time.perf_counter()
+        self._wall_start = time.time()
+        self._lock = threading.Lock()
+        # 正在执行本次处理的线程 -> 嵌套层数，只采样这些线程
+        self._active: Dict[int, int] = {}
+        self._sampler: Optional[_StackSampler] = None
+        self._finished = None
+        self._register_thread()
+
+    def _now(self) -> float:
+        """距开始的微秒数"""
+        return (time.perf_counter() - self._start) * 1_000_000
+
+    def _register_thread(self):
+        thread = threading.current_thread()
+        with self._lock:
+            self.threads.setdefault(thread.ident, thread.name)
+
+    def _enter(self):
+        self._register_thread()
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = self._active.get(ident, 0) + 1
+
+    def _exit(self):
+        ident = threading.get_ident()
+        with self._lock:
+            depth = self._active.pop(ident) - 1
+            if depth:
+                self._active[ident] = depth
+
+    def active_threads(self) -> List[int]:
+        with self._lock:
+            return list(self._active)
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **args):
+        """记录一个处理阶段，阶段可以嵌套"""
+        start = self._now()
+        try:
+            yield
+        finally:
+            event = {
+                "name": name, "cat": "phase", "ph": "X", "pid": _PHASE_PID,
+                "tid": threading.get_ident(), "ts": start, "dur": self._now() - start,
+            }
+            if args:
+                event["args"] = args
+            with self._lock:
+                self.events.append(event)
+
+    def _start_sampler(self):
+        with self._lock:
+            if not self.profile or self._sampler is not None or self._finished is not None:
+                return
+            self._sampler = _StackSampler(self)
+        self._sampler.start()
+
+    def finish(self, error: Optional[str] = None) -> dict:
+        """
+        结束跟踪，生成 Chrome Trace Event 格式的结果
+
+        Args:
+            error: 处理失败时的错误信息
+
+        Returns:
+            dict: 可直接序列化为 JSON 的跟踪结果
+        """
+        if self._finished is not None:
+            return self._finished
+        end = self._now()
+        if self._sampler is not None:
+            self._sampler.stop()
+
+        args = dict(self.args, trace_id=self.trace_id, request_id=self.request_id)
+        if error:
+            args["error"] = error
+        events = [
+            {"name": "process_name", "ph": "M", "pid": _PHASE_PID, "args": {"name": "处理阶段"}},
+            {"name": self.operation, "cat": "job", "ph": "X", "pid": _PHASE_PID,
+             "tid": next(iter(self.threads)), "ts": 0, "dur": end, "args": args},
+        ]
+        for ident, name in self.threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": _PHASE_PID, "tid": ident, "args": {"name": name}})
+        if self._sampler is not None:
+            events.append({"name": "process_name", "ph": "M", "pid": _SAMPLE_PID, "args": {"name": "调用栈采样"}})
+            for ident in self._sampler.sampled:
+                events.append({"name": "thread_name", "ph": "M", "pid": _SAMPLE_PID, "tid": ident,
+                               "args": {"name": self.threads.get(ident, str(ident))}})
+            events.extend(self._sampler.events)
+        with self._lock:
+            events.extend(self.events)
+
+        self._finished = {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "metadata": {
+                "trace_id": self.trace_id,
+                "request_id": self.request_id,
+                "operation": self.operation,
+                "started_at": self._wall_start,
+                "profile": self.profile,
+                "sample_interval": self.sample_interval if self.profile else None,
+            },
+        }
+        return self._finished
+
+
+class _StackSampler(threading.Thread):
+    """
+    定时读取执行线程的调用栈
+
+    相邻采样中相同的栈帧合并为一个持续事件，在跟踪查看器中显示为火焰图。
+    """
+
+    def __init__(self, trace: JobTrace):
+        super().__init__(name="trace-sampler", daemon=True)
+        self.trace = trace
+        self.events: List[dict] = []
+        self.sampled: List[int] = []
+        # 线程 -> 当前打开的栈帧 [(帧名称, 开始时间)]
+        self._open: Dict[int, List[tuple]] = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.trace.sample_interval):
+            self._sample()
+        self._sample()
+        now = self.trace._now()
+        for ident in list(self._open):
+            self._close(ident, 0, now)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def _sample(self):
+        now = self.trace._now()
+        frames = sys._current_frames()
+        active = self.trace.active_threads()
+        for ident in list(self._open):
+            # 线程已不再执行本次处理（如线程池线程转去处理其他请求）
+            if ident not in active:
+                self._close(ident, 0, now)
+        for ident in active:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.reverse()
+            self._record(ident, stack, now)
+
+    def _record(self, ident: int, stack: List[str], now: float):
+        opened = self._open.setdefault(ident, [])
+        if ident not in self.sampled:
+            self.sampled.append(ident)
+        common = 0
+        while common < len(opened) and common < len(stack) and opened[common][0] == stack[common]:
+            common += 1
+        self._close(ident, common, now)
+        opened.extend((name, now) for name in stack[common:])
+
+    def _close(self, ident: int, depth: int, now: float):
+        opened = self._open.get(ident, [])
+        while len(opened) > depth:
+            name, start = opened.pop()
+            self.events.append({
+                "name": name, "cat": "sample", "ph": "X", "pid": _SAMPLE_PID,
+                "tid": ident, "ts": start, "dur": now - start,
+            })
+
+
+# ---- 当前线程的跟踪 ----
+
+@contextlib.contextmanager
+def activate(trace: Optional[JobTrace]):
+    """在当前线程中启用跟踪，trace 为 None 时不做任何事"""
+    if trace is None:
+        yield
+        return
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    trace._enter()
+    trace._start_sampler()
+    stack.append(trace)
+    try:
+        yield
+    finally:
+        stack.pop()
+        trace._exit()
+
+
+def bind(trace: Optional[JobTrace], func: Callable) -> Callable:
+    """返回在执行线程中启用跟踪后再调用 func 的函数"""
+    if trace is None:
+        return func
+
+    def traced(*args, **kwargs):
+        with activate(trace):
+            return func(*args, **kwargs)
+
+    return traced
+
+
+def current_trace() -> Optional[JobTrace]:
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def phase(name: str, **args):
+    """
+    记录当前线程所属跟踪中的一个阶段，未启用跟踪时开销可忽略
+
+    用法:
+        with phase("加载工作簿"):
+            ...
+    """
+    trace = current_trace()
+    if trace is None:
+        return _NO_PHASE
+    return trace.phase(name, **args)
+
+
+class TraceStore:
+    """
+    按跟踪 ID 保存跟踪结果，超出数量上限时删除最早的
+
+    文件名为 {跟踪 ID}.json，有请求 ID 时为 {跟踪 ID}.{请求 ID}.json，列出时不必读取文件内容。
+    """
+
+    def __init__(self, directory: str = TRACE_DIR, max_entries: int = DEFAULT_MAX_TRACES):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def path(self, trace_id: str, request_id: Optional[str] = None) -> str:
+        if not is_valid_trace_id(trace_id):
+            raise ValueError(f"无效的跟踪 ID: {trace_id}")
+        if request_id is None:
+            return os.path.join(self.directory, f"{trace_id}.json")
+        if not is_valid_request_id(request_id):
+            raise ValueError(f"无效的请求 ID: {request_id}")
+        return os.path.join(self.directory, f"{trace_id}.{request_id}.json")
+
+    @staticmethod
+    def _parse_name(name: str) -> Optional[tuple]:
+        """从文件名解析 (跟踪 ID, 请求 ID)，不是跟踪文件时返回 None"""
+        trace_id, _, request_id = name[:-len(".json")].partition(".")
+        if not is_valid_trace_id(trace_id):
+            return None
+        return trace_id, request_id or None
+
+    def save(self, trace_id: str, trace: dict, request_id: Optional[str] = None) -> str:
+        """
+        保存跟踪结果
+
+        Args:
+            trace_id: 跟踪 ID
+            trace: 跟踪结果
+            request_id: 客户端提供的请求 ID，作为标签保存在文件名中
+
+        Returns:
+            str: 跟踪文件路径
+        """
+        path = self.path(trace_id, request_id)
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        self._evict()
+        return path
+
+    def get(self, trace_id: str) -> Optional[str]:
+        """获取跟踪文件路径，不存在时返回 None"""
+        if not is_valid_trace_id(trace_id):
+            return None
+        for entry in self._entries():
+            if self._parse_name(entry.name)[0] == trace_id:
+                return entry.path
+        return None
+
+    def list(self, request_id: Optional[str] = None) -> List[dict]:
+        """
+        按时间倒序列出已保存的跟踪
+
+        Args:
+            request_id: 只列出带有该请求 ID 的跟踪
+        """
+        entries = []
+        for entry in self._entries():
+            trace_id, label = self._parse_name(entry.name)
+            if request_id is not None and label != request_id:
+                continue
+            entries.append({
+                "trace_id": trace_id,
+                "request_id": label,
+                "size": entry.stat().st_size,
+                "created_at": entry.stat().st_mtime,
+            })
+        entries.sort(key=lambda entry: entry["created_at"], reverse=True)
+        return entries
+
+    def _entries(self) -> List[os.DirEntry]:
+        try:
+            return [entry for entry in os.scandir(self.directory)
+                    if entry.name.endswith(".json") and entry.is_file() and self._parse_name(entry.name)]
+        except OSError:
+            return []
+
+    def _evict(self):
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+# 请求处理和管理接口共用的跟踪存储
+trace_store = TraceStore()
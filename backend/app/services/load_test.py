@@ -0,0 +1,531 @@
+"""
+接口压力测试
+按给定的并发数和文件大小组合向 /api/excel/preview 和 /api/excel/delete-columns 发送请求，
+统计延迟分位数、吞吐量、错误率和服务进程的内存峰值。
+可以直接在本进程内调用 ASGI 应用，也可以请求本地运行的 uvicorn。
+"""
+
+import io
+import os
+import sys
+import time
+import uuid
+import glob
+import random
+import struct
+import asyncio
+import logging
+import math
+import threading
+import subprocess
+import http.client
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from openpyxl import Workbook
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = {
+    "preview": "/api/excel/preview",
+    "delete-columns": "/api/excel/delete-columns",
+}
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# 内存采样间隔（秒）
+RSS_SAMPLE_INTERVAL = 0.05
+
+# 启动 uvicorn 后等待健康检查通过的最长时间（秒）
+SERVER_START_TIMEOUT = 30
+
+
+# ---- 请求内容 ----
+
+class FileSize:
+    """文件大小组合中的一项：行数 x 列数，按权重抽取"""
+
+    def __init__(self, rows: int, columns: int, weight: int = 1):
+        self.rows = rows
+        self.columns = columns
+        self.weight = weight
+        self.content: Optional[bytes] = None
+
+    @property
+    def label(self) -> str:
+        return f"{self.rows}x{self.columns}"
+
+    def build(self) -> bytes:
+        """生成该大小的工作簿（同一大小只生成一次）"""
+        if self.content is None:
+            self.content = make_workbook(self.rows, self.columns)
+        return self.content
+
+
+def parse_sizes(sizes_str: str) -> List[FileSize]:
+    """
+    解析文件大小组合
+
+    Args:
+        sizes_str: 逗号分隔的 行数x列数[*权重]，如 "200x10*5,20000x20"
+
+    Returns:
+        List[FileSize]: 文件大小列表
+
+    Raises:
+        ValueError: 格式不正确
+    """
+    sizes = []
+    for part in sizes_str.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        shape, _, weight = part.partition("*")
+        rows, _, columns = shape.lower().partition("x")
+        try:
+            size = FileSize(int(rows), int(columns), int(weight) if weight else 1)
+        except ValueError:
+            raise ValueError(f"无效的文件大小: {part}，格式为 行数x列数[*权重]")
+        if size.rows < 1 or size.columns < 1 or size.weight < 1:
+            raise ValueError(f"无效的文件大小: {part}，行数、列数和权重必须大于0")
+        sizes.append(size)
+    if not sizes:
+        raise ValueError("至少需要一种文件大小")
+    return sizes
+
+
+def make_workbook(rows: int, columns: int) -> bytes:
+    """生成密集数据的工作簿，第一行为表头"""
+    rnd = random.Random(rows * 100003 + columns)
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("数据")
+    worksheet.append([f"列{col}" for col in range(1, columns + 1)])
+    for row in range(rows):
+        worksheet.append([
+            rnd.randint(0, 100000) if col % 3 == 0 else
+            round(rnd.uniform(0, 1e6), 2) if col % 3 == 1 else
+            f"文本{rnd.randint(0, 5000)}"
+            for col in range(columns)
+        ])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def make_distinct(content: bytes) -> bytes:
+    """
+    修改 zip 注释使内容摘要各不相同，用于绕过索引和列分解缓存
+
+    openpyxl 保存的文件没有注释，结尾的两个字节即注释长度。
+    """
+    token = uuid.uuid4().hex.encode("ascii")
+    return content[:-2] + struct.pack("<H", len(token)) + token
+
+
+def build_multipart(fields: Dict[str, str], filename: str, content: bytes) -> Tuple[bytes, str]:
+    """
+    构造 multipart/form-data 请求体
+
+    Returns:
+        Tuple[bytes, str]: (请求体, Content-Type)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8"))
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {XLSX_CONTENT_TYPE}\r\n\r\n".encode("utf-8"))
+    parts.append(content)
+    parts.append(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+# ---- 请求方式 ----
+
+class InProcessTransport:
+    """直接调用 ASGI 应用，不经过网络"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, path: str, body: bytes, content_type: str) -> Tuple[int, int]:
+        """
+        发送 POST 请求
+
+        Returns:
+            Tuple[int, int]: (状态码, 响应体字节数)
+        """
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode("ascii"),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"host", b"loadtest"),
+                (b"content-type", content_type.encode("ascii")),
+                (b"content-length", str(len(body)).encode("ascii")),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("loadtest", 80),
+        }
+        sent = False
+        finished = asyncio.Event()
+        status = 0
+        received = 0
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # 流式响应会监听断开事件，响应发送完之前不能返回断开
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status, received
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                received += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finished.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+        return status, received
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """通过 HTTP 请求已运行的服务，每个请求在线程池中使用独立连接"""
+
+    def __init__(self, base_url: str, concurrency: int):
+        parsed = urllib.parse.urlparse(base_url)
+        if parsed.scheme != "http" or not parsed.hostname:
+            raise ValueError(f"只支持 http 地址: {base_url}")
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip("/")
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _request(self, path: str, body: bytes, content_type: str) -> Tuple[int, int]:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=600)
+        try:
+            connection.request("POST", self.prefix + path, body=body, headers={"Content-Type": content_type})
+            response = connection.getresponse()
+            received = 0
+            while True:
+                chunk = response.read(64 * 1024)
+                if not chunk:
+                    break
+                received += len(chunk)
+            return response.status, received
+        finally:
+            connection.close()
+
+    async def request(self, path: str, body: bytes, content_type: str) -> Tuple[int, int]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._request, path, body, content_type)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class UvicornServer:
+    """在子进程中启动 uvicorn，测试结束后停止"""
+
+    def __init__(self, app_dir: str, port: int, workers: int = 1):
+        self.app_dir = app_dir
+        self.port = port
+        self.workers = workers
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        command = [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(self.port),
+            "--workers", str(self.workers), "--log-level", "warning",
+        ]
+        # 与 main.py 的多进程模式一致，结果缓存是否启用取决于 EXCEL_WORKERS
+        env = dict(os.environ, EXCEL_WORKERS=str(self.workers))
+        self.process = subprocess.Popen(command, cwd=self.app_dir, env=env)
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"uvicorn 启动失败，退出码 {self.process.returncode}")
+            try:
+                with urllib.request.urlopen(f"{self.url}/health", timeout=1):
+                    logger.info(f"uvicorn 已启动: {self.url}（{self.workers} 个工作进程）")
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"uvicorn 在 {SERVER_START_TIMEOUT} 秒内未就绪")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+# ---- 内存采样 ----
+
+def _child_pids(pid: int) -> List[int]:
+    children = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(path, "r") as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return children
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """
+    进程及其全部子进程的常驻内存之和（字节），仅支持 Linux
+
+    Returns:
+        Optional[int]: 无法读取时返回 None
+    """
+    total = 0
+    found = False
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        found = True
+                        break
+        except OSError:
+            continue
+        pending.extend(_child_pids(current))
+    return total if found else None
+
+
+class RssSampler(threading.Thread):
+    """在后台线程中定期采样服务进程的内存，记录峰值"""
+
+    def __init__(self, pid: int, interval: float = RSS_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.baseline = process_tree_rss(pid)
+        self.peak = self.baseline
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            rss = process_tree_rss(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+# ---- 运行与统计 ----
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """最近秩法计算分位数：取第 ceil(fraction * n) 个值"""
+    if not sorted_values:
+        return None
+    # 先舍去浮点误差，例如 0.95 * 100 = 95.00000000000001
+    rank = math.ceil(round(fraction * len(sorted_values), 9))
+    index = max(0, min(len(sorted_values) - 1, rank - 1))
+    return sorted_values[index]
+
+
+class LoadTestRunner:
+    """按并发数持续发送请求，直到达到请求数或持续时间"""
+
+    def __init__(self, transport, endpoints: List[str], sizes: List[FileSize],
+                 concurrency: int = 4, columns: str = "2", stream: bool = False,
+                 distinct: bool = False, seed: int = 0):
+        """
+        Args:
+            transport: InProcessTransport 或 HttpTransport
+            endpoints: 请求的接口（ENDPOINTS 中的名称），随机轮换
+            sizes: 文件大小组合
+            concurrency: 同时进行的请求数
+            columns: delete-columns 请求删除的列
+            stream: delete-columns 是否使用流式响应
+            distinct: 每个请求使用内容不同的文件，绕过服务端缓存
+            seed: 随机种子
+        """
+        self.transport = transport
+        self.endpoints = endpoints
+        self.sizes = sizes
+        self.concurrency = concurrency
+        self.columns = columns
+        self.stream = stream
+        self.distinct = distinct
+        self.rnd = random.Random(seed)
+
+    def _next_request(self) -> Tuple[str, FileSize, bytes, str]:
+        endpoint = self.rnd.choice(self.endpoints)
+        size = self.rnd.choices(self.sizes, weights=[size.weight for size in self.sizes])[0]
+        content = size.build()
+        if self.distinct:
+            content = make_distinct(content)
+        fields = {}
+        if endpoint == "delete-columns":
+            fields = {"columns": self.columns, "stream": "true" if self.stream else "false"}
+        body, content_type = build_multipart(fields, f"load-{size.label}.xlsx", content)
+        return endpoint, size, body, content_type
+
+    async def _run(self, requests: Optional[int], duration: Optional[float],
+                   on_result: Callable[[dict], None]):
+        deadline = time.perf_counter() + duration if duration else None
+        issued = 0
+
+        async def worker():
+            nonlocal issued
+            while True:
+                if requests is not None and issued >= requests:
+                    return
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                issued += 1
+                endpoint, size, body, content_type = self._next_request()
+                started = time.perf_counter()
+                error = None
+                status, received = 0, 0
+                try:
+                    status, received = await self.transport.request(ENDPOINTS[endpoint], body, content_type)
+                    if status >= 400:
+                        error = f"HTTP {status}"
+                except Exception as e:
+                    error = f"{type(e).__name__}: {str(e)}"
+                on_result({
+                    "endpoint": endpoint,
+                    "size": size.label,
+                    "latency": time.perf_counter() - started,
+                    "status": status,
+                    "sent": len(body),
+                    "received": received,
+                    "error": error,
+                })
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def run(self, requests: Optional[int] = None, duration: Optional[float] = None,
+            warmup: int = 0, server_pid: Optional[int] = None) -> dict:
+        """
+        运行压力测试
+
+        Args:
+            requests: 总请求数（与 duration 至少指定一个）
+            duration: 持续时间（秒）
+            warmup: 正式计时前先发送的请求数，不计入结果
+            server_pid: 服务进程号，用于采样内存；None 时不采样
+
+        Returns:
+            dict: 汇总报告
+        """
+        if requests is None and duration is None:
+            raise ValueError("需要指定请求数或持续时间")
+        for size in self.sizes:
+            size.build()
+
+        if warmup:
+            asyncio.run(self._run(warmup, None, lambda result: None))
+
+        results: List[dict] = []
+        sampler = RssSampler(server_pid) if server_pid is not None else None
+        if sampler is not None:
+            sampler.start()
+        started = time.perf_counter()
+        try:
+            asyncio.run(self._run(requests, duration, results.append))
+        finally:
+            elapsed = time.perf_counter() - started
+            if sampler is not None:
+                sampler.stop()
+
+        report = summarize(results, elapsed)
+        report["concurrency"] = self.concurrency
+        report["sizes"] = {size.label: {"weight": size.weight, "bytes": len(size.content)} for size in self.sizes}
+        report["rss_baseline"] = sampler.baseline if sampler is not None else None
+        report["rss_peak"] = sampler.peak if sampler is not None else None
+        return report
+
+
+def summarize(results: List[dict], elapsed: float) -> dict:
+    """按接口和文件大小分组统计结果"""
+    groups: Dict[str, List[dict]] = {"全部": results}
+    for result in results:
+        groups.setdefault(f"{result['endpoint']} {result['size']}", []).append(result)
+
+    summary = {}
+    for name, group in groups.items():
+        latencies = sorted(result["latency"] for result in group if result["error"] is None)
+        errors = [result for result in group if result["error"] is not None]
+        summary[name] = {
+            "requests": len(group),
+            "errors": len(errors),
+            "error_rate": len(errors) / len(group) if group else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+            "throughput": len(group) / elapsed if elapsed else 0.0,
+            "error_examples": sorted({result["error"] for result in errors})[:5],
+        }
+    return {"elapsed": elapsed, "groups": summary}
+
+
+def format_report(report: dict) -> str:
+    """把汇总报告格式化为文本表格"""
+
+    def ms(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    def mb(value: Optional[int]) -> str:
+        return "不可用" if value is None else f"{value / 1024 / 1024:.1f} MB"
+
+    sizes = "，".join(f"{label}（{info['bytes'] / 1024:.0f} KB，权重 {info['weight']}）"
+                     for label, info in report["sizes"].items())
+    lines = [
+        f"并发数: {report['concurrency']}，耗时: {report['elapsed']:.1f} 秒，文件: {sizes}",
+        f"服务进程内存: 基线 {mb(report['rss_baseline'])}，峰值 {mb(report['rss_peak'])}",
+        "",
+        f"{'分组':<28}{'请求':>7}{'错误率':>8}{'p50(ms)':>9}{'p95(ms)':>9}{'p99(ms)':>9}{'最大(ms)':>10}{'吞吐(次/秒)':>12}",
+    ]
+    for name, stats in report["groups"].items():
+        lines.append(
+            f"{name:<28}{stats['requests']:>7}{stats['error_rate']:>8.1%}{ms(stats['p50']):>9}"
+            f"{ms(stats['p95']):>9}{ms(stats['p99']):>9}{ms(stats['max']):>10}{stats['throughput']:>12.2f}"
+        )
+    errors = report["groups"]["全部"]["error_examples"]
+    if errors:
+        lines.append("")
+        lines.append("错误示例:")
+        lines.extend(f"  {error}" for error in errors)
+    return "\n".join(lines)
@@ -0,0 +1,188 @@
+"""
+行过滤
+在删除列的同一遍处理中按条件丢弃行：空行、指定列等于某些值的行、重复行
+"""
+
+import os
+import hashlib
+import logging
+import sqlite3
+import tempfile
+from typing import Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 去重键在内存中最多保留的数量，超过后转存到磁盘
+DEFAULT_MAX_MEMORY_KEYS = 200_000
+
+
+class DedupKeySet:
+    """
+    去重键集合
+    键先保存在内存中（16 字节摘要），数量超过上限后转存到临时 SQLite 文件，
+    内存占用与行数无关
+    """
+
+    def __init__(self, max_memory_keys: int = DEFAULT_MAX_MEMORY_KEYS):
+        self.max_memory_keys = max_memory_keys
+        self._keys: Set[bytes] = set()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path: Optional[str] = None
+
+    @staticmethod
+    def digest(values: tuple) -> bytes:
+        """计算键摘要，repr 可以区分 1 与 "1" 等不同类型的值"""
+        return hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).digest()
+
+    def add(self, values: tuple) -> bool:
+        """
+        加入一个键
+
+        Args:
+            values: 参与去重的列值
+
+        Returns:
+            bool: 键是否是第一次出现
+        """
+        key = self.digest(values)
+
+        if self._db is not None:
+            cursor = self._db.execute("INSERT OR IGNORE INTO keys (k) VALUES (?)", (key,))
+            return cursor.rowcount == 1
+
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        if len(self._keys) > self.max_memory_keys:
+            self._spill()
+        return True
+
+    def _spill(self):
+        """把内存中的键转存到磁盘"""
+        fd, self._db_path = tempfile.mkstemp(prefix="dedup-", suffix=".sqlite")
+        os.close(fd)
+        self._db = sqlite3.connect(self._db_path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE keys (k BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT INTO keys (k) VALUES (?)", ((key,) for key in self._keys))
+        logger.info(f"去重键数量超过 {self.max_memory_keys}，已转存到磁盘")
+        self._keys = set()
+
+    def close(self):
+        """释放内存和临时文件"""
+        self._keys = set()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._db_path is not None:
+            try:
+                os.remove(self._db_path)
+            except OSError:
+                pass
+            self._db_path = None
+
+
+class RowFilter:
+    """行过滤条件，列号均为原始文件中的列号（从1开始）"""
+
+    def __init__(
+        self,
+        drop_blank: bool = False,
+        drop_values: Optional[Dict[int, Set[str]]] = None,
+        dedupe_columns: Optional[List[int]] = None,
+        header_rows: int = 1,
+        max_memory_keys: int = DEFAULT_MAX_MEMORY_KEYS,
+    ):
+        """
+        Args:
+            drop_blank: 是否删除空行
+            drop_values: 列号 -> 值集合，该列的值（转为字符串）在集合中时删除该行
+            dedupe_columns: 按这些列的值去重，只保留第一次出现的行
+            header_rows: 表头行数，表头行始终保留且不参与过滤
+            max_memory_keys: 去重键在内存中的最大数量
+        """
+        self.drop_blank = drop_blank
+        self.drop_values = drop_values or {}
+        self.dedupe_columns = sorted(dedupe_columns) if dedupe_columns else []
+        self.header_rows = header_rows
+        self.max_memory_keys = max_memory_keys
+        self._seen: Optional[DedupKeySet] = None
+
+    @property
+    def active(self) -> bool:
+        """是否设置了任何过滤条件"""
+        return bool(self.drop_blank or self.drop_values or self.dedupe_columns)
+
+    def describe(self) -> str:
+        """用于日志的条件描述"""
+        parts = []
+        if self.drop_blank:
+            parts.append("删除空行")
+        for col, values in sorted(self.drop_values.items()):
+            parts.append(f"删除第 {col} 列为 {sorted(values)} 的行")
+        if self.dedupe_columns:
+            parts.append(f"按第 {self.dedupe_columns} 列去重")
+        return "，".join(parts)
+
+    def signature(self) -> dict:
+        """与结果有关的全部条件，用作结果缓存键的一部分"""
+        return {
+            "drop_blank": self.drop_blank,
+            "drop_values": {str(col): sorted(values) for col, values in sorted(self.drop_values.items())},
+            "dedupe_columns": self.dedupe_columns,
+            "header_rows": self.header_rows,
+        }
+
+    def start_sheet(self):
+        """开始处理新的工作表，去重状态按工作表独立"""
+        self.close()
+        if self.dedupe_columns:
+            self._seen = DedupKeySet(self.max_memory_keys)
+
+    def keep(self, row: int, values: Dict[int, object]) -> bool:
+        """
+        判断一行是否保留
+
+        Args:
+            row: 行号（从1开始）
+            values: 该行中非空单元格的 列号 -> 值
+
+        Returns:
+            bool: 是否保留该行
+        """
+        if row <= self.header_rows:
+            return True
+
+        if self.drop_blank and _is_blank(values.values()):
+            return False
+
+        for col, targets in self.drop_values.items():
+            value = values.get(col)
+            if ("" if value is None else str(value)) in targets:
+                return False
+
+        if self._seen is not None:
+            key = tuple(values.get(col) for col in self.dedupe_columns)
+            if not self._seen.add(key):
+                return False
+
+        return True
+
+    def close(self):
+        """释放去重使用的资源"""
+        if self._seen is not None:
+            self._seen.close()
+            self._seen = None
+
+
+def _is_blank(values: Iterable[object]) -> bool:
+    """一行中没有任何非空白的值"""
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, str) and not value.strip():
+            continue
+        return False
+    return True
@@ -0,0 +1,116 @@
+"""
+共享字符串表
+只记录每个 <si> 元素在原始 XML 中的位置，按需解析并缓存最近使用的字符串，
+读取表头等少量字符串时不必解码整张表
+"""
+
+import re
+import logging
+import zipfile
+from array import array
+from collections import OrderedDict
+from typing import BinaryIO, Optional
+from xml.etree.ElementTree import fromstring
+
+from openpyxl.cell.text import Text
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 256 * 1024
+
+# 已解码字符串的缓存数量
+DEFAULT_CACHE_SIZE = 4096
+
+_ROOT_START_RE = re.compile(rb"<((?:[\w.-]+:)?sst)\b[^>]*?(/?)>")
+_SI_RE = re.compile(rb"<((?:[\w.-]+:)?si)\b[^>]*?(?:/>|>.*?</\1>)", re.S)
+
+
+class SharedStringTable:
+    """
+    共享字符串表
+
+    解压后的 XML 保存在一个缓冲区中，每个字符串只占两个偏移量；
+    缓冲区和偏移量随访问的下标按需向后扩展，下标靠前的字符串不需要读取整个部件。
+    """
+
+    def __init__(self, source: BinaryIO, cache_size: int = DEFAULT_CACHE_SIZE):
+        """
+        Args:
+            source: sharedStrings.xml 的只读文件对象，读完或 close() 时关闭
+            cache_size: 已解码字符串的最大缓存数量
+        """
+        self.cache_size = cache_size
+        self._source: Optional[BinaryIO] = source
+        self._buffer = bytearray()
+        self._starts = array("Q")
+        self._ends = array("Q")
+        self._scan_pos = 0
+        self._root = None
+        self._cache: "OrderedDict[int, str]" = OrderedDict()
+
+    @classmethod
+    def open(cls, archive: zipfile.ZipFile, path: str,
+             cache_size: int = DEFAULT_CACHE_SIZE) -> "SharedStringTable":
+        """打开工作簿中的共享字符串部件"""
+        return cls(archive.open(path), cache_size)
+
+    def __len__(self) -> int:
+        self._scan_to(None)
+        return len(self._starts)
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        value = self._cache.get(index)
+        if value is not None:
+            self._cache.move_to_end(index)
+            return value
+
+        self._scan_to(index)
+        if not 0 <= index < len(self._starts):
+            raise IndexError(f"共享字符串下标超出范围: {index}")
+
+        value = self._decode(index)
+        self._cache[index] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    def _scan_to(self, index: Optional[int]):
+        """定位到第 index 个字符串为止，index 为 None 时扫描整张表"""
+        while self._source is not None and (index is None or len(self._starts) <= index):
+            chunk = self._source.read(READ_CHUNK_SIZE)
+            if not chunk:
+                self.close()
+                break
+            self._buffer += chunk
+
+            if self._root is None:
+                match = _ROOT_START_RE.search(self._buffer)
+                if match is None:
+                    continue
+                # 保留根元素的开始标签（含命名空间声明），单独解析 <si> 时使用
+                self._root = (match.group(0).rstrip(b"/>") + b">", b"</" + match.group(1) + b">")
+                self._scan_pos = match.end()
+                if match.group(2):
+                    self.close()
+                    break
+
+            # 只记录完整的元素，不完整的尾部留待下次读取后重新匹配
+            for match in _SI_RE.finditer(self._buffer, self._scan_pos):
+                self._starts.append(match.start())
+                self._ends.append(match.end())
+                self._scan_pos = match.end()
+
+    def _decode(self, index: int) -> str:
+        """解析单个 <si> 元素，规则与 openpyxl 的 read_string_table 相同"""
+        start_tag, end_tag = self._root
+        fragment = bytes(self._buffer[self._starts[index]:self._ends[index]])
+        node = fromstring(start_tag + fragment + end_tag)[0]
+        return Text.from_tree(node).content.replace("x005F_", "")
+
+    def close(self):
+        """关闭源文件，已读取的内容仍可访问"""
+        if self._source is not None:
+            self._source.close()
+            self._source = None
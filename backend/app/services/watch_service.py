@@ -0,0 +1,387 @@
+"""
+目录监控服务
+监控输入目录中新出现的 Excel 文件，按配置的列规则增量处理
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import logging
+from concurrent.futures import ProcessPoolExecutor, Future
+from datetime import datetime
+from typing import List, Dict, Optional
+
+from services.excel_service import ExcelService
+from utils.file_utils import validate_excel_file, generate_filename, ensure_directory_exists
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FILENAME = ".watch-ledger.jsonl"
+MANIFEST_FILENAME = "manifest.jsonl"
+
+
+def _process_file(source_path: str, output_path: str, column_indices: List[int]) -> dict:
+    """
+    在工作进程中处理单个文件
+
+    Args:
+        source_path: 输入文件路径
+        output_path: 输出文件路径
+        column_indices: 要删除的列索引列表（降序）
+
+    Returns:
+        dict: 处理结果统计
+    """
+    started = time.time()
+    input_size = os.path.getsize(source_path)
+
+    # 传入路径，由服务通过 mmap 读取
+    # 监控目录中的文件各不相同，不需要列分解缓存
+    result = ExcelService(cache_dir=None, job_dir=None).delete_columns(source_path, column_indices)
+
+    # 先写临时文件再重命名，避免下游读到写了一半的结果
+    tmp_path = output_path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(result)
+    os.replace(tmp_path, output_path)
+
+    return {
+        "input_size": input_size,
+        "output_size": len(result),
+        "duration": round(time.time() - started, 3),
+    }
+
+
+class _InotifyWaiter:
+    """
+    基于 inotify 的目录事件等待器（仅 Linux）
+    其他平台上不可用，由调用方回退为定时轮询
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, directory: str):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, f"无法监控目录: {directory}")
+
+        self.fd = fd
+
+    def wait(self, timeout: float) -> bool:
+        """
+        等待目录事件
+
+        Args:
+            timeout: 最长等待秒数
+
+        Returns:
+            bool: 是否收到了事件
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+
+        # 只关心“有变化”，事件内容直接丢弃，具体文件由扫描确定
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+        return True
+
+    def close(self):
+        """关闭 inotify 句柄"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FolderWatcher:
+    """目录监控处理器"""
+
+    def __init__(
+        self,
+        input_dir: str,
+        output_dir: str,
+        column_indices: List[int],
+        workers: int = 2,
+        settle_seconds: float = 2.0,
+        poll_interval: float = 1.0,
+        ledger_path: Optional[str] = None,
+    ):
+        """
+        Args:
+            input_dir: 监控的输入目录
+            output_dir: 结果输出目录
+            column_indices: 要删除的列索引列表（降序）
+            workers: 工作进程数
+            settle_seconds: 文件大小和修改时间保持不变多久后才认为写入完成
+            poll_interval: 轮询间隔（inotify 不可用时使用）
+            ledger_path: 处理记录文件路径，默认放在输出目录中
+
+        Raises:
+            ValueError: 输出目录与输入目录相同时（结果文件会被当作新文件再次处理）
+        """
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        if os.path.normcase(os.path.realpath(self.input_dir)) == os.path.normcase(os.path.realpath(self.output_dir)):
+            raise ValueError(f"输出目录不能与输入目录相同: {self.output_dir}")
+        self.column_indices = column_indices
+        self.workers = max(1, workers)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.ledger_path = ledger_path or os.path.join(self.output_dir, LEDGER_FILENAME)
+        self.manifest_path = os.path.join(self.output_dir, MANIFEST_FILENAME)
+
+        # 文件名 -> (大小, 修改时间, 首次观察到该状态的时间)
+        self._pending: Dict[str, tuple] = {}
+        # 文件名 -> 正在执行的任务
+        self._running: Dict[str, Future] = {}
+        # 任务 -> (提交时的文件大小, 修改时间, 输出路径)
+        self._submitted: Dict[Future, tuple] = {}
+        self._stopped = False
+
+        ensure_directory_exists(self.output_dir)
+        self.ledger = self._load_ledger()
+
+    def _load_ledger(self) -> Dict[str, dict]:
+        """
+        读取处理记录，用于重启后跳过已完成的文件
+
+        记录文件每行一条，同一文件的后一条覆盖前一条；存在被覆盖或损坏的行时重写为每个文件一行。
+        """
+        if not os.path.exists(self.ledger_path):
+            return {}
+        ledger: Dict[str, dict] = {}
+        lines = 0
+        try:
+            with open(self.ledger_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                        ledger[entry.pop("source")] = entry
+                    except (ValueError, KeyError, AttributeError):
+                        # 写入中途退出时最后一行可能不完整，该文件会被重新处理
+                        logger.warning(f"忽略损坏的处理记录: {line.strip()[:100]}")
+        except OSError as e:
+            logger.warning(f"读取处理记录失败，将重新开始记录: {str(e)}")
+            return {}
+
+        if lines > len(ledger):
+            try:
+                self._compact_ledger(ledger)
+            except OSError as e:
+                logger.warning(f"整理处理记录失败: {str(e)}")
+        return ledger
+
+    def _compact_ledger(self, ledger: Dict[str, dict]):
+        """原子方式把处理记录重写为每个文件一行"""
+        tmp_path = self.ledger_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for source, entry in ledger.items():
+                f.write(json.dumps(dict(entry, source=source), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.ledger_path)
+
+    def _append_ledger(self, filename: str):
+        """追加一个文件的处理记录，写入量与已记录的文件数无关"""
+        with open(self.ledger_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(self.ledger[filename], source=filename), ensure_ascii=False) + "\n")
+
+    def _append_manifest(self, record: dict):
+        """追加一条处理清单记录"""
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _is_candidate(self, filename: str) -> bool:
+        """判断文件是否需要处理（排除 Excel 锁文件、隐藏文件和临时文件）"""
+        if filename.startswith(("~$", ".")) or filename.endswith((".tmp", ".part")):
+            return False
+        return validate_excel_file(filename)
+
+    def _is_done(self, filename: str, stat: os.stat_result) -> bool:
+        """文件是否已按当前内容和列规则处理过"""
+        entry = self.ledger.get(filename)
+        return (
+            entry is not None
+            and entry.get("size") == stat.st_size
+            and entry.get("mtime_ns") == stat.st_mtime_ns
+            and entry.get("columns") == self.column_indices
+        )
+
+    def scan_once(self) -> List[str]:
+        """
+        扫描输入目录，返回已写入完成且尚未处理的文件
+
+        Returns:
+            List[str]: 可以提交处理的文件名列表
+        """
+        now = time.monotonic()
+        ready = []
+        seen = set()
+
+        try:
+            entries = list(os.scandir(self.input_dir))
+        except FileNotFoundError:
+            logger.warning(f"输入目录不存在: {self.input_dir}")
+            return ready
+
+        for entry in entries:
+            if not entry.is_file() or not self._is_candidate(entry.name):
+                continue
+
+            name = entry.name
+            seen.add(name)
+            if name in self._running:
+                continue
+
+            stat = entry.stat()
+            if self._is_done(name, stat):
+                self._pending.pop(name, None)
+                continue
+
+            state = (stat.st_size, stat.st_mtime_ns)
+            previous = self._pending.get(name)
+            if previous is None or previous[:2] != state:
+                # 新文件或仍在写入，重新开始计时
+                self._pending[name] = state + (now,)
+                continue
+
+            if stat.st_size > 0 and now - previous[2] >= self.settle_seconds:
+                ready.append(name)
+
+        # 清理已经消失的文件
+        for name in list(self._pending):
+            if name not in seen:
+                del self._pending[name]
+
+        return sorted(ready)
+
+    def _submit(self, executor: ProcessPoolExecutor, filename: str):
+        """提交单个文件到工作进程"""
+        source_path = os.path.join(self.input_dir, filename)
+        output_path = os.path.join(self.output_dir, generate_filename(filename, "_processed"))
+
+        stat = os.stat(source_path)
+        logger.info(f"开始处理文件: {filename}")
+        future = executor.submit(_process_file, source_path, output_path, self.column_indices)
+        self._submitted[future] = (stat.st_size, stat.st_mtime_ns, output_path)
+        self._running[filename] = future
+
+    def _collect(self):
+        """收集已完成的任务，更新处理记录和清单"""
+        for filename, future in list(self._running.items()):
+            if not future.done():
+                continue
+
+            del self._running[filename]
+            self._pending.pop(filename, None)
+            size, mtime_ns, output_path = self._submitted.pop(future)
+
+            record = {
+                "source": filename,
+                "output": os.path.basename(output_path),
+                "columns": self.column_indices,
+                "finished_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            try:
+                stats = future.result()
+                record.update(stats)
+                record["status"] = "done"
+                logger.info(f"文件处理完成: {filename}，耗时 {stats['duration']} 秒")
+            except Exception as e:
+                record["status"] = "failed"
+                record["error"] = str(e)
+                logger.error(f"文件处理失败: {filename}: {str(e)}")
+
+            # 失败的文件同样记录，文件内容变化后才会重新处理
+            self.ledger[filename] = {
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "columns": self.column_indices,
+                "status": record["status"],
+                "output": record["output"],
+                "finished_at": record["finished_at"],
+            }
+            if "error" in record:
+                self.ledger[filename]["error"] = record["error"]
+
+            self._append_ledger(filename)
+            self._append_manifest(record)
+
+    def stop(self):
+        """请求停止监控循环"""
+        self._stopped = True
+
+    def run(self, once: bool = False):
+        """
+        运行监控循环
+
+        Args:
+            once: 为 True 时处理完当前目录中的文件后退出
+        """
+        waiter = None
+        if not once and sys.platform.startswith("linux"):
+            try:
+                waiter = _InotifyWaiter(self.input_dir)
+                logger.info("使用 inotify 监控输入目录")
+            except (OSError, AttributeError) as e:
+                logger.info(f"inotify 不可用，改为轮询: {str(e)}")
+
+        logger.info(f"开始监控目录: {self.input_dir} -> {self.output_dir}")
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                while not self._stopped:
+                    self._collect()
+                    for filename in self.scan_once():
+                        self._submit(executor, filename)
+
+                    # 空文件可能永远不会写完，单次模式下不等待
+                    waiting = [name for name, state in self._pending.items() if state[0] > 0]
+                    if once and not waiting and not self._running:
+                        break
+
+                    # 有文件处于等待稳定或处理中状态时，需要定期复查
+                    timeout = self.poll_interval
+                    if waiter is not None and not self._pending and not self._running:
+                        timeout = max(self.poll_interval, 60.0)
+
+                    if waiter is not None:
+                        waiter.wait(timeout)
+                    else:
+                        time.sleep(timeout)
+
+                # 等待已提交的任务结束，保证记录完整
+                for future in list(self._running.values()):
+                    future.exception()
+                self._collect()
+        finally:
+            if waiter is not None:
+                waiter.close()
+
+        logger.info("目录监控已停止")
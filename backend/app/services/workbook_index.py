@@ -0,0 +1,543 @@
+"""
+工作簿索引
+记录 zip 条目位置、工作表名称与部件路径、维度信息以及 sheetData 在工作表 XML 中的位置，
+首次访问文件时构建并保存到磁盘，之后的预览等操作可以直接定位到所需的工作表和行
+"""
+
+import io
+import os
+import re
+import json
+import time
+import logging
+import uuid
+import posixpath
+import zipfile
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import XMLPullParser, fromstring, Element
+
+from openpyxl.cell.text import Text
+from openpyxl.styles.stylesheet import Stylesheet
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+
+from services.shared_strings import SharedStringTable
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 3
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# 默认最多保留的索引数量和总大小
+DEFAULT_MAX_INDEXES = 1000
+DEFAULT_MAX_INDEX_BYTES = 256 * 1024 * 1024
+
+# 超过该时间仍未完成的临时文件视为写入进程已退出（秒）
+STALE_TEMP_AGE = 3600
+
+SHEET_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+WORKSHEET_REL_TYPE = REL_NS + "/worksheet"
+SHARED_STRINGS_REL_TYPE = REL_NS + "/sharedStrings"
+STYLES_REL_TYPE = REL_NS + "/styles"
+
+ROW_TAG = "{%s}row" % SHEET_MAIN_NS
+CELL_TAG = "{%s}c" % SHEET_MAIN_NS
+VALUE_TAG = "{%s}v" % SHEET_MAIN_NS
+INLINE_STRING_TAG = "{%s}is" % SHEET_MAIN_NS
+
+_ROOT_TAG_RE = re.compile(rb"<(?:[A-Za-z_][\w.-]*:)?worksheet\b[^>]*>")
+_SHEET_DATA_RE = re.compile(rb"<sheetData\s*(/?)>")
+_SHEET_DATA_END = b"</sheetData>"
+_ROW_RE = re.compile(rb"<row\b([^>]*)>")
+_ROW_NUMBER_RE = re.compile(rb'\br="(\d+)"')
+_CELL_RE = re.compile(rb"<c[\s/>]")
+_CELL_REF_RE = re.compile(rb'<c\b[^>]*?\br="([A-Z]+)(\d+)"')
+_DIMENSION_RE = re.compile(rb'<dimension\b[^>]*?\bref="([^"]+)"')
+_MERGE_CELL_RE = re.compile(rb'<mergeCell\b[^>]*?\bref="\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?"')
+
+
+class IndexUnsupported(Exception):
+    """工作簿结构不适合通过索引直接读取，调用方应回退到完整解析"""
+
+
+def resolve_target(base_dir: str, target: str) -> str:
+    """把关系文件中的 Target 解析为 zip 内的部件路径"""
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def read_relationships(archive: zipfile.ZipFile, rels_path: str) -> Dict[str, Tuple[str, str]]:
+    """读取关系文件，返回 Id -> (类型, 目标)"""
+    try:
+        root = fromstring(archive.read(rels_path))
+    except KeyError:
+        return {}
+    return {
+        rel.get("Id"): (rel.get("Type"), rel.get("Target"))
+        for rel in root.iter("{%s}Relationship" % PKG_REL_NS)
+    }
+
+
+def find_workbook_part(archive: zipfile.ZipFile) -> str:
+    """从根关系中找到 workbook.xml 的路径"""
+    for rel_type, target in read_relationships(archive, "_rels/.rels").values():
+        if rel_type.endswith("/officeDocument"):
+            return resolve_target("", target)
+    raise IndexUnsupported("找不到工作簿部件")
+
+
+class WorkbookIndex:
+    """工作簿索引"""
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    @property
+    def digest(self) -> str:
+        return self.data["digest"]
+
+    @property
+    def sheets(self) -> List[dict]:
+        return self.data["sheets"]
+
+    @property
+    def entries(self) -> Dict[str, dict]:
+        return self.data["entries"]
+
+    @property
+    def active_sheet(self) -> dict:
+        """与 openpyxl 的 workbook.active 对应的工作表"""
+        sheets = self.sheets
+        if not sheets:
+            raise IndexUnsupported("工作簿中没有工作表")
+        active = self.data.get("active_sheet", 0)
+        return sheets[active] if 0 <= active < len(sheets) else sheets[0]
+
+    def sheet(self, name: str) -> dict:
+        """按名称获取工作表索引"""
+        for sheet in self.sheets:
+            if sheet["name"] == name:
+                return sheet
+        raise KeyError(name)
+
+    @classmethod
+    def build(cls, archive: zipfile.ZipFile, digest: str) -> "WorkbookIndex":
+        """
+        扫描工作簿并构建索引
+
+        Args:
+            archive: 已打开的工作簿 zip 文件
+            digest: 文件内容摘要
+
+        Returns:
+            WorkbookIndex: 构建好的索引
+        """
+        entries = {
+            info.filename: {
+                "offset": info.header_offset,
+                "compress_type": info.compress_type,
+                "compress_size": info.compress_size,
+                "file_size": info.file_size,
+                "crc": info.CRC,
+            }
+            for info in archive.infolist()
+        }
+
+        workbook_path = find_workbook_part(archive)
+        workbook_dir = posixpath.dirname(workbook_path)
+        rels_path = posixpath.join(workbook_dir, "_rels", posixpath.basename(workbook_path) + ".rels")
+        rels = read_relationships(archive, rels_path)
+
+        workbook_root = fromstring(archive.read(workbook_path))
+        workbook_pr = workbook_root.find("{%s}workbookPr" % SHEET_MAIN_NS)
+        date1904 = workbook_pr is not None and workbook_pr.get("date1904") in ("1", "true")
+
+        active_sheet = 0
+        view = workbook_root.find("{%s}bookViews/{%s}workbookView" % (SHEET_MAIN_NS, SHEET_MAIN_NS))
+        if view is not None and view.get("activeTab"):
+            active_sheet = int(view.get("activeTab"))
+
+        sheets = []
+        for sheet in workbook_root.iter("{%s}sheet" % SHEET_MAIN_NS):
+            rel_type, target = rels.get(sheet.get("{%s}id" % REL_NS), (None, None))
+            if target is None:
+                continue
+            path = resolve_target(workbook_dir, target)
+            info = {"name": sheet.get("name"), "path": path, "worksheet": rel_type == WORKSHEET_REL_TYPE}
+            if info["worksheet"] and path in entries:
+                info.update(cls._scan_sheet(archive, path))
+            sheets.append(info)
+
+        shared_strings_path = styles_path = None
+        for rel_type, target in rels.values():
+            if rel_type == SHARED_STRINGS_REL_TYPE:
+                shared_strings_path = resolve_target(workbook_dir, target)
+            elif rel_type == STYLES_REL_TYPE:
+                styles_path = resolve_target(workbook_dir, target)
+
+        date_styles, timedelta_styles = [], []
+        if styles_path and styles_path in entries:
+            stylesheet = Stylesheet.from_tree(fromstring(archive.read(styles_path)))
+            date_styles = sorted(stylesheet.date_formats)
+            timedelta_styles = sorted(stylesheet.timedelta_formats)
+
+        return cls({
+            "version": INDEX_VERSION,
+            "digest": digest,
+            "entries": entries,
+            "workbook_path": workbook_path,
+            "sheets": sheets,
+            "active_sheet": active_sheet,
+            "date1904": date1904,
+            "shared_strings_path": shared_strings_path,
+            "styles_path": styles_path,
+            "date_styles": date_styles,
+            "timedelta_styles": timedelta_styles,
+        })
+
+    @staticmethod
+    def _scan_sheet(archive: zipfile.ZipFile, path: str) -> dict:
+        """
+        扫描单个工作表 XML，记录维度、最大行列以及 sheetData 的位置
+
+        只使用正则定位标签，不构建元素树，扫描成本接近一次解压。
+        最大行列与 openpyxl 一致：合并区域中的单元格同样计入。
+        """
+        root_tag = None
+        dimension = None
+        sheet_data_offset = None
+        row_count = 0
+        row_number = 0
+        max_row = 0
+        max_col_ref = b""
+        cell_count = 0
+        ref_count = 0
+        finished = False
+        tail = b""
+
+        base = 0
+        carry = b""
+        with archive.open(path) as f:
+            while not finished:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer = carry + chunk
+                # 最后一个 '<' 之前的标签都是完整的（属性值中不能出现未转义的 '<'）
+                cut = buffer.rfind(b"<")
+                if cut <= 0:
+                    carry = buffer
+                    continue
+                data, carry = buffer[:cut], buffer[cut:]
+
+                if root_tag is None:
+                    match = _ROOT_TAG_RE.search(data)
+                    if match is None:
+                        carry = buffer
+                        continue
+                    if not match.group(0).startswith(b"<worksheet"):
+                        raise IndexUnsupported("工作表使用了命名空间前缀")
+                    root_tag = match.group(0).decode("utf-8")
+
+                if sheet_data_offset is None:
+                    if dimension is None:
+                        match = _DIMENSION_RE.search(data)
+                        if match:
+                            dimension = match.group(1).decode("ascii")
+                    match = _SHEET_DATA_RE.search(data)
+                    if match is None:
+                        base += len(data)
+                        continue
+                    if match.group(1):
+                        # <sheetData/>，没有任何行
+                        sheet_data_offset = base + match.end()
+                        tail = data[match.end():]
+                        break
+                    sheet_data_offset = base + match.end()
+                    start = match.end()
+                else:
+                    start = 0
+
+                end = data.find(_SHEET_DATA_END, start)
+                if end >= 0:
+                    finished = True
+                    section = data[start:end]
+                    tail = data[end:]
+                else:
+                    section = data[start:]
+
+                for match in _ROW_RE.finditer(section):
+                    number = _ROW_NUMBER_RE.search(match.group(1))
+                    row_number = int(number.group(1)) if number else row_number + 1
+                    row_count += 1
+
+                cell_count += len(_CELL_RE.findall(section))
+                for col_ref, row_ref in _CELL_REF_RE.findall(section):
+                    ref_count += 1
+                    if (len(col_ref), col_ref) > (len(max_col_ref), max_col_ref):
+                        max_col_ref = col_ref
+                    row_value = int(row_ref)
+                    if row_value > max_row:
+                        max_row = row_value
+
+                base += len(data)
+
+            # sheetData 之后的部分（合并单元格等）通常很小，直接读完
+            tail += carry + f.read()
+
+        max_column = column_index_from_string(max_col_ref.decode("ascii")) if max_col_ref else 1
+        for first_col, first_row, last_col, last_row in _MERGE_CELL_RE.findall(tail):
+            max_column = max(max_column, column_index_from_string((last_col or first_col).decode("ascii")))
+            max_row = max(max_row, int(last_row or first_row))
+
+        if root_tag is None:
+            raise IndexUnsupported(f"无法识别工作表 {path}")
+
+        return {
+            "root_tag": root_tag,
+            "dimension": dimension,
+            "max_row": max(1, max_row),
+            "max_column": max(1, max_column),
+            "row_count": row_count,
+            "sheet_data_offset": sheet_data_offset,
+            # 存在没有 r 属性的单元格时，最大行列无法从引用中得到
+            "implicit_refs": cell_count != ref_count,
+        }
+
+    def iter_rows(
+        self,
+        archive: zipfile.ZipFile,
+        sheet: dict,
+        min_row: int = 1,
+        max_row: Optional[int] = None,
+    ) -> Iterator[Tuple[int, List[Tuple[int, Element]]]]:
+        """
+        读取指定范围内的行，从 sheetData 开始解析，读到 max_row 后立即停止
+
+        压缩的工作表无法随机访问，定位到 sheetData 时 zipfile 仍会解压之前的内容，
+        只是不再解析；因此这里只适合读取开头的少量行（如预览）。
+
+        Args:
+            archive: 已打开的工作簿 zip 文件
+            sheet: 工作表索引
+            min_row: 起始行号（从1开始）
+            max_row: 结束行号，None 表示读到末尾
+
+        Returns:
+            Iterator: (行号, [(列号, 单元格元素)]) 迭代器
+        """
+        if not sheet.get("worksheet") or sheet.get("implicit_refs"):
+            raise IndexUnsupported(f"工作表 {sheet['name']} 不支持按索引读取")
+        if not sheet["row_count"]:
+            return
+
+        start, row_number = sheet["sheet_data_offset"], 0
+
+        parser = XMLPullParser(events=("end",))
+        parser.feed(sheet["root_tag"].encode("utf-8") + b"<sheetData>")
+        keep = len(_SHEET_DATA_END) - 1
+
+        with archive.open(sheet["path"]) as f:
+            f.seek(start)
+            tail = b""
+            finished = False
+            while not finished:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    data, finished = tail, True
+                else:
+                    data = tail + chunk
+                    end = data.find(_SHEET_DATA_END)
+                    if end >= 0:
+                        data, finished = data[:end], True
+                    else:
+                        data, tail = data[:-keep], data[-keep:]
+                if finished:
+                    data += b"</sheetData></worksheet>"
+                parser.feed(data)
+
+                for _, element in parser.read_events():
+                    if element.tag != ROW_TAG:
+                        continue
+                    row_number = int(element.get("r", row_number + 1))
+                    if max_row is not None and row_number > max_row:
+                        return
+                    if row_number >= min_row:
+                        cells = []
+                        for cell in element.iter(CELL_TAG):
+                            ref = cell.get("r")
+                            column = column_index_from_string(ref.rstrip("0123456789"))
+                            cells.append((column, cell))
+                        yield row_number, cells
+                    element.clear()
+
+    def load_shared_strings(self, archive: zipfile.ZipFile) -> SharedStringTable:
+        """
+        打开共享字符串表
+
+        字符串在访问时才解码，调用方须在 archive 关闭前使用完毕并调用 close()。
+        """
+        path = self.data.get("shared_strings_path")
+        if not path or path not in self.entries:
+            return SharedStringTable(io.BytesIO(b""))
+        return SharedStringTable.open(archive, path)
+
+    def cell_value(self, cell: Element, shared_strings):
+        """
+        按 openpyxl 的 data_only=True 规则解析单元格的值
+
+        Args:
+            cell: 单元格元素
+            shared_strings: 共享字符串表（支持按下标访问）
+
+        Returns:
+            单元格的值
+        """
+        data_type = cell.get("t", "n")
+        if data_type == "inlineStr":
+            child = cell.find(INLINE_STRING_TAG)
+            return Text.from_tree(child).content if child is not None else None
+
+        return self.typed_value(data_type, cell.findtext(VALUE_TAG, None) or None, cell.get("s", 0), shared_strings)
+
+    def typed_value(self, data_type: str, value: Optional[str], style_id, shared_strings):
+        """
+        按单元格类型转换 <v> 中的文本，规则与 openpyxl 相同
+
+        Args:
+            data_type: 单元格的 t 属性
+            value: <v> 中的文本，没有值时为 None
+            style_id: 单元格的 s 属性
+            shared_strings: 共享字符串表（支持按下标访问）
+
+        Returns:
+            单元格的值
+        """
+        if value is None:
+            return None
+
+        if data_type == "n":
+            value = float(value) if ("." in value or "E" in value or "e" in value) else int(value)
+            style_id = int(style_id)
+            if style_id in self.data["date_styles"]:
+                epoch = CALENDAR_MAC_1904 if self.data["date1904"] else CALENDAR_WINDOWS_1900
+                try:
+                    value = from_excel(value, epoch, timedelta=style_id in self.data["timedelta_styles"])
+                except (OverflowError, ValueError):
+                    value = "#VALUE!"
+            return value
+        if data_type == "s":
+            return shared_strings[int(value)]
+        if data_type == "b":
+            return bool(int(value))
+        if data_type == "d":
+            return from_ISO8601(value)
+        return value
+
+
+class WorkbookIndexStore:
+    """把索引以 JSON 形式保存在上传目录中，超出数量或大小上限时删除最久未使用的"""
+
+    def __init__(self, directory: str, max_entries: int = DEFAULT_MAX_INDEXES,
+                 max_bytes: int = DEFAULT_MAX_INDEX_BYTES):
+        """
+        Args:
+            directory: 索引文件目录
+            max_entries: 最多保留的索引数量
+            max_bytes: 索引总大小上限（字节）
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.idx.json")
+
+    def load(self, digest: str) -> Optional[WorkbookIndex]:
+        """读取已保存的索引，不存在或版本不符时返回 None"""
+        path = self._path(digest)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != INDEX_VERSION:
+            return None
+        # 以修改时间记录最近使用时间，淘汰时保留常用的索引
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return WorkbookIndex(data)
+
+    def save(self, index: WorkbookIndex):
+        """原子方式保存索引"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(index.digest)
+        # 多个进程或线程可能同时保存同一索引，临时文件名不能相同
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index.data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """按最近使用时间淘汰超出数量或大小上限的索引，并清理遗留的临时文件"""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith(".tmp"):
+                if now - stat.st_mtime > STALE_TEMP_AGE:
+                    self._remove(entry.path)
+                continue
+            if entry.name.endswith(".idx.json"):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort(reverse=True)
+        kept_bytes = 0
+        expired = 0
+        for number, (mtime, size, path) in enumerate(entries):
+            kept_bytes += size
+            if number >= self.max_entries or kept_bytes > self.max_bytes:
+                self._remove(path)
+                expired += 1
+        if expired:
+            logger.info(f"淘汰 {expired} 个工作簿索引")
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get_or_build(self, digest: str, archive: zipfile.ZipFile) -> WorkbookIndex:
+        """
+        获取文件的索引，首次访问时构建并保存
+
+        Args:
+            digest: 文件内容摘要（MappedInput.digest，与列分解缓存和任务存储共用）
+            archive: 基于该内容打开的 zip 文件
+
+        Returns:
+            WorkbookIndex: 工作簿索引
+        """
+        index = self.load(digest)
+        if index is not None:
+            return index
+
+        index = WorkbookIndex.build(archive, digest)
+        try:
+            self.save(index)
+        except OSError as e:
+            logger.warning(f"保存工作簿索引失败: {str(e)}")
+        return index
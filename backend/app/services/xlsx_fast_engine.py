@@ -0,0 +1,1210 @@
+"""
+快速列处理引擎
+直接在 XML 层面改写工作表：单元格按行流式处理，只对与列有关的元数据
+（列宽、合并单元格、条件格式、数据验证、自动筛选、超链接、打印区域等）做定向修改，
+styles.xml、共享字符串等其他部件直接复制压缩数据，不经过 openpyxl 的反序列化和重新序列化
+"""
+
+import re
+import html
+import shutil
+import logging
+import tempfile
+import posixpath
+import zipfile
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+from xml.etree.ElementTree import fromstring
+from xml.sax.saxutils import escape, unescape
+
+from openpyxl.cell.text import Text
+from openpyxl.formula.translate import Translator
+from openpyxl.utils import get_column_letter, column_index_from_string
+
+from services.column_map import ColumnMap
+from services.job_trace import phase
+from services.row_filter import RowFilter
+from services.workbook_index import (
+    REL_NS,
+    SHEET_MAIN_NS,
+    WORKSHEET_REL_TYPE,
+    WorkbookIndex,
+    find_workbook_part,
+    read_relationships,
+    resolve_target,
+)
+from utils.cancellation import check_cancelled
+from utils.zip_writer import ZipStreamWriter, raw_entry_data
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 256 * 1024
+
+# 分解工作表时每块包含的行数
+ROWS_PER_CHUNK = 4096
+
+# 分解工作表时代替列字母和数组公式范围的占位字节（XML 文本中不会出现）
+COLUMN_PLACEHOLDER = b"\x00"
+REF_PLACEHOLDER = b"\x01"
+
+# 无法直接复制压缩数据时，解压复制未改动的部件每次读写的大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# 行过滤时改写后的行数据先暂存，超过该大小写入临时文件
+ROW_SPOOL_SIZE = 8 * 1024 * 1024
+
+CALC_CHAIN_REL_TYPE = REL_NS + "/calcChain"
+
+# 工作表关系中允许出现的类型，其他类型（图形、批注、表格、数据透视表等）
+# 含有与列位置相关的锚点或引用，交给 openpyxl 引擎处理
+SUPPORTED_SHEET_REL_TYPES = {
+    REL_NS + "/hyperlink",
+    REL_NS + "/printerSettings",
+}
+
+_ROOT_TAG_RE = re.compile(rb"<(?:[A-Za-z_][\w.-]*:)?worksheet\b")
+_SHEET_DATA_START_RE = re.compile(rb"<sheetData\s*(/?)>")
+_SHEET_DATA_END = b"</sheetData>"
+
+_ROW_RE = re.compile(rb"<row\b([^>]*?)(/>|>(.*?)</row>)", re.S)
+_CELL_RE = re.compile(rb"<c\b([^>]*?)(/>|>(.*?)</c>)", re.S)
+_SPANS_RE = re.compile(rb'\s+spans="[^"]*"')
+_R_ATTR_RE = re.compile(rb'(\s)r="([^"]*)"')
+_ROW_NUMBER_RE = re.compile(rb'\br="(\d+)"')
+_FORMULA_RE = re.compile(rb"<f\b([^>]*?)(/>|>(.*?)</f>)", re.S)
+_FORMULA_START_RE = re.compile(rb"<f\b[^>]*>")
+_VALUE_RE = re.compile(rb"<v\b[^>]*?(?:/>|>(.*?)</v>)", re.S)
+_INLINE_STRING_RE = re.compile(rb"<is>(.*?)</is>", re.S)
+_PLAIN_TEXT_RE = re.compile(rb"<t(?:\s[^>]*)?>([^<]*)</t>$")
+_TYPE_ATTR_RE = re.compile(rb'\st="([^"]*)"')
+_STYLE_ATTR_RE = re.compile(rb'\ss="(\d+)"')
+_ROW_START_RE = re.compile(rb"<row\b[^>]*?/?>")
+_CELL_ROW_RE = re.compile(rb'(<c\b[^>]*?\sr="[A-Z]+)\d+"')
+_ROW_RANGE_RE = re.compile(r"^(\$?[A-Z]{1,3}\$?)(\d+)(?::(\$?[A-Z]{1,3}\$?)(\d+))?$")
+
+_CELL_REF_RE = re.compile(r"^(\$?)([A-Z]{1,3})(\$?)(\d+)$")
+_COL_REF_RE = re.compile(r"^(\$?)([A-Z]{1,3})$")
+_ROW_REF_RE = re.compile(r"^\$?\d+$")
+
+_WORKBOOK_SHEET_RE = re.compile(rb"<(?:[A-Za-z_][\w.-]*:)?sheet\b")
+
+_DEFINED_NAME_RE = re.compile(rb'(<definedName\b[^>]*?\bname="(_xlnm\.[^"]+)"[^>]*>)(.*?)(</definedName>)', re.S)
+_DEFINED_NAME_REF_RE = re.compile(
+    r"((?:'(?:[^']|'')+'|[^'!,()\s]+)!)(\$?[A-Z]{1,3}\$?\d*(?::\$?[A-Z]{1,3}\$?\d*)?)"
+)
+
+
+class FastPathUnsupported(Exception):
+    """工作簿包含快速引擎无法安全处理的内容，调用方应回退到 openpyxl 引擎"""
+
+
+def _attr(tag: bytes, name: bytes) -> Optional[str]:
+    """读取起始标签中的属性值"""
+    match = re.search(rb"\s" + name + rb'="([^"]*)"', tag)
+    return match.group(1).decode("utf-8") if match else None
+
+
+def _set_attr(tag: bytes, name: bytes, value: Optional[str]) -> bytes:
+    """设置或删除起始标签中的属性（value 为 None 时删除）"""
+    pattern = re.compile(rb"\s" + name + rb'="[^"]*"')
+    if value is None:
+        return pattern.sub(b"", tag, count=1)
+    replacement = b" " + name + b'="' + value.encode("utf-8") + b'"'
+    if pattern.search(tag):
+        return pattern.sub(lambda _: replacement, tag, count=1)
+    end = len(tag) - (2 if tag.endswith(b"/>") else 1)
+    return tag[:end] + replacement + tag[end:]
+
+
+class RangeMapper:
+    """按列映射改写单元格引用、区间和区间列表"""
+
+    def __init__(self, column_map: ColumnMap):
+        self.column_map = column_map
+        self._letters: Dict[int, str] = {}
+
+    def letter(self, column: int) -> str:
+        letter = self._letters.get(column)
+        if letter is None:
+            letter = self._letters[column] = get_column_letter(column)
+        return letter
+
+    def cell(self, ref: str) -> Optional[str]:
+        """改写单个单元格引用，列被删除时返回 None"""
+        match = _CELL_REF_RE.match(ref)
+        if match is None:
+            return ref
+        col_abs, letters, row_abs, row = match.groups()
+        new_column = self.column_map.get(column_index_from_string(letters))
+        if new_column is None:
+            return None
+        return f"{col_abs}{self.letter(new_column)}{row_abs}{row}"
+
+    def _parse_range(self, ref: str):
+        """
+        解析区间为 (首端列前缀, 尾端列前缀, 首端行后缀, 尾端行后缀, 起始列, 结束列)
+
+        不涉及列的引用（如整行 1:5 或命名引用）返回 None。
+        """
+        parts = ref.split(":")
+        if len(parts) == 1:
+            parts = [ref, ref]
+        if len(parts) != 2:
+            return None
+
+        start, end = parts
+        if _ROW_REF_RE.match(start) and _ROW_REF_RE.match(end):
+            return None
+
+        start_match = _CELL_REF_RE.match(start) or _COL_REF_RE.match(start)
+        end_match = _CELL_REF_RE.match(end) or _COL_REF_RE.match(end)
+        if start_match is None or end_match is None:
+            return None
+
+        start_groups = start_match.groups()
+        end_groups = end_match.groups()
+        min_col = column_index_from_string(start_groups[1])
+        max_col = column_index_from_string(end_groups[1])
+        if min_col > max_col:
+            min_col, max_col = max_col, min_col
+        return (
+            start_groups[0], end_groups[0],
+            "".join(start_groups[2:]), "".join(end_groups[2:]),
+            min_col, max_col,
+        )
+
+    def _format_range(self, parsed, new_min: int, new_max: int) -> str:
+        start_prefix, end_prefix, start_suffix, end_suffix = parsed[:4]
+        first = f"{start_prefix}{self.letter(new_min)}{start_suffix}"
+        last = f"{end_prefix}{self.letter(new_max)}{end_suffix}"
+        return first if first == last else f"{first}:{last}"
+
+    def spans(self, ref: str) -> Optional[List[str]]:
+        """
+        改写一个区间，输出可能拆分为多个区间
+
+        Returns:
+            Optional[List[str]]: 改写后的区间列表；不涉及列的引用（如整行 1:5）返回 None 表示原样保留
+        """
+        parsed = self._parse_range(ref)
+        if parsed is None:
+            return None
+        return [
+            self._format_range(parsed, new_min, new_max)
+            for new_min, new_max in self.column_map.remap_span(parsed[4], parsed[5])
+        ]
+
+    def bounding(self, ref: str) -> Optional[str]:
+        """改写区间并取外接矩形，适用于只能是单个区间的属性（如 dimension）"""
+        parsed = self._parse_range(ref)
+        if parsed is None:
+            return ref
+        spans = self.column_map.remap_span(parsed[4], parsed[5])
+        if not spans:
+            return None
+        return self._format_range(parsed, min(span[0] for span in spans), max(span[1] for span in spans))
+
+    def single(self, ref: str) -> Optional[str]:
+        """改写必须保持为单个连续区间的引用（如合并单元格），无法保持时返回 None"""
+        spans = self.spans(ref)
+        if spans is None:
+            return ref
+        return spans[0] if len(spans) == 1 else None
+
+    def sqref(self, sqref: str) -> Optional[str]:
+        """改写以空格分隔的区间列表，全部被删除时返回 None"""
+        result = []
+        for ref in sqref.split():
+            spans = self.spans(ref)
+            result.extend([ref] if spans is None else spans)
+        return " ".join(result) if result else None
+
+
+class RowMap:
+    """
+    行过滤后的行号映射
+
+    只记录被删除的行号（递增），保留的行在输出中的行号等于原行号减去它之前被删除的行数。
+    """
+
+    def __init__(self):
+        self._dropped = array("L")
+
+    @property
+    def dropped(self) -> int:
+        """已删除的行数"""
+        return len(self._dropped)
+
+    def drop(self, row: int):
+        self._dropped.append(row)
+
+    def get(self, row: int) -> Optional[int]:
+        """原始行在输出中的行号，行被删除时返回 None"""
+        index = bisect_left(self._dropped, row)
+        if index < len(self._dropped) and self._dropped[index] == row:
+            return None
+        return row - index
+
+    def span(self, first: int, last: int) -> Optional[Tuple[int, int]]:
+        """区间内保留下来的首尾行在输出中的行号，整个区间都被删除时返回 None"""
+        new_first = first - bisect_left(self._dropped, first)
+        new_last = last - bisect_right(self._dropped, last)
+        return (new_first, new_last) if new_first <= new_last else None
+
+    def ref(self, ref: str) -> Optional[str]:
+        """改写单元格或区域引用中的行号，引用的行全部被删除时返回 None"""
+        match = _ROW_RANGE_RE.match(ref)
+        if match is None:
+            return ref
+        start_col, start_row, end_col, end_row = match.groups()
+        if end_col is None:
+            row = self.get(int(start_row))
+            return None if row is None else f"{start_col}{row}"
+        span = self.span(int(start_row), int(end_row))
+        return None if span is None else f"{start_col}{span[0]}:{end_col}{span[1]}"
+
+
+class CellValueReader:
+    """
+    从单元格 XML 片段解析值，供行过滤判断
+
+    规则与 openpyxl 以 data_only=False 加载时相同：公式单元格的值是以 "=" 开头的公式文本，
+    其余类型按工作簿索引中记录的日期格式等信息转换，共享字符串表在第一次用到时打开。
+    """
+
+    def __init__(self, index: WorkbookIndex, archive: zipfile.ZipFile):
+        self.index = index
+        self.archive = archive
+        self._shared_strings = None
+
+    def value(self, attrs: bytes, body: Optional[bytes]):
+        """
+        Args:
+            attrs: 单元格的属性部分
+            body: 单元格的内容（共享公式已展开），自闭合的单元格为 None
+
+        Returns:
+            单元格的值，没有值时为 None
+        """
+        if body is None:
+            return None
+        formula = _FORMULA_RE.search(body)
+        if formula is not None:
+            return "=" + _xml_text(formula.group(3))
+
+        match = _TYPE_ATTR_RE.search(attrs)
+        data_type = match.group(1).decode("ascii") if match else "n"
+        if data_type == "inlineStr":
+            match = _INLINE_STRING_RE.search(body)
+            if match is None:
+                return None
+            plain = _PLAIN_TEXT_RE.match(match.group(1))
+            if plain is not None:
+                # 只有一段 <t> 的常见情况不构建元素树
+                return _xml_text(plain.group(1))
+            element = fromstring(b'<is xmlns="' + SHEET_MAIN_NS.encode("ascii") + b'">' + match.group(1) + b"</is>")
+            return Text.from_tree(element).content
+
+        match = _VALUE_RE.search(body)
+        text = _xml_text(match.group(1)) if match is not None else ""
+        if not text:
+            return None
+        if data_type == "s" and self._shared_strings is None:
+            self._shared_strings = self.index.load_shared_strings(self.archive)
+        match = _STYLE_ATTR_RE.search(attrs)
+        return self.index.typed_value(data_type, text, match.group(1) if match else 0, self._shared_strings)
+
+    def close(self):
+        if self._shared_strings is not None:
+            self._shared_strings.close()
+            self._shared_strings = None
+
+
+def _xml_text(data: Optional[bytes]) -> str:
+    """元素文本中的实体引用还原为字符"""
+    return html.unescape(data.decode("utf-8")) if data else ""
+
+
+class FastXlsxEngine:
+    """基于 XML 流式改写的列处理引擎"""
+
+    def __init__(self, column_map: ColumnMap, row_filter: Optional[RowFilter] = None,
+                 row_limits: Optional[Dict[str, int]] = None, values: Optional[CellValueReader] = None):
+        """
+        Args:
+            column_map: 原始列 -> 输出列的映射，对所有工作表生效
+            row_filter: 可选的行过滤条件
+            row_limits: 需要过滤的工作表部件路径 -> 参与过滤的最后一行（与 openpyxl 的 max_row 相同），
+                未列出的工作表不过滤
+            values: 行过滤时解析单元格值的读取器
+        """
+        self.column_map = column_map
+        self.ranges = RangeMapper(column_map)
+        self.row_filter = row_filter if row_filter is not None and row_filter.active else None
+        self.row_limits = row_limits or {}
+        self.values = values
+
+    @staticmethod
+    def inspect(archive: zipfile.ZipFile) -> dict:
+        """
+        检查工作簿能否由快速引擎处理，并收集需要改写的部件
+
+        Args:
+            archive: 已打开的工作簿 zip 文件
+
+        Returns:
+            dict: 工作簿部件路径、工作表部件列表和需要删除的计算链部件
+
+        Raises:
+            FastPathUnsupported: 工作簿包含无法安全处理的内容时
+        """
+        try:
+            workbook_path = find_workbook_part(archive)
+        except Exception as e:
+            raise FastPathUnsupported(f"无法识别工作簿结构: {str(e)}")
+
+        workbook_dir = posixpath.dirname(workbook_path)
+        workbook_rels_path = posixpath.join(workbook_dir, "_rels", posixpath.basename(workbook_path) + ".rels")
+        names = set(archive.namelist())
+
+        sheet_paths = []
+        calc_chain_path = None
+        for rel_type, target in read_relationships(archive, workbook_rels_path).values():
+            path = resolve_target(workbook_dir, target)
+            if rel_type == WORKSHEET_REL_TYPE and path in names:
+                sheet_paths.append(path)
+            elif rel_type == CALC_CHAIN_REL_TYPE:
+                calc_chain_path = path
+
+        # 关系类型不是过渡格式（如 Strict OOXML）、图表工作表或部件缺失时，
+        # 找到的工作表比工作簿中列出的少，继续处理会原样输出这些工作表
+        sheet_count = len(_WORKBOOK_SHEET_RE.findall(archive.read(workbook_path)))
+        if not sheet_paths or len(sheet_paths) != sheet_count:
+            raise FastPathUnsupported(f"工作簿列出 {sheet_count} 个工作表，其中 {len(sheet_paths)} 个可以处理")
+
+        for path in sheet_paths:
+            rels_path = posixpath.join(posixpath.dirname(path), "_rels", posixpath.basename(path) + ".rels")
+            for rel_type, _ in read_relationships(archive, rels_path).values():
+                if rel_type not in SUPPORTED_SHEET_REL_TYPES:
+                    raise FastPathUnsupported(f"工作表 {path} 包含 {rel_type.rsplit('/', 1)[-1]}")
+
+            with archive.open(path) as f:
+                head = f.read(4096)
+            match = _ROOT_TAG_RE.search(head)
+            if match is None or not match.group(0).startswith(b"<worksheet"):
+                raise FastPathUnsupported(f"工作表 {path} 使用了命名空间前缀")
+
+        return {
+            "workbook_path": workbook_path,
+            "workbook_rels_path": workbook_rels_path,
+            "sheet_paths": sheet_paths,
+            "calc_chain_path": calc_chain_path,
+        }
+
+    def transform(self, archive: zipfile.ZipFile, output: BinaryIO, parts: Optional[dict] = None,
+                  buffer=None, sheet_writers: Optional[Dict[str, Callable]] = None):
+        """
+        处理整个工作簿并写入输出
+
+        工作表逐个流式改写后立即写入 zip，其余部件原样复制。
+
+        Args:
+            archive: 已打开的源工作簿
+            output: 输出文件对象（可以是不可定位的流）
+            parts: inspect 的结果，为 None 时重新检查
+            buffer: 源文件的完整内容（bytes 或 mmap），提供时未改动的部件
+                通过 memoryview 切片直接写出压缩数据，不解压也不重新压缩
+            sheet_writers: 工作表部件路径 -> 生成该工作表的函数 (engine, write) -> 行数，
+                用于从已分解的缓存中拼接工作表，未提供的工作表从源文件改写
+        """
+        if parts is None:
+            parts = self.inspect(archive)
+        sheet_paths = set(parts["sheet_paths"])
+        calc_chain_path = parts["calc_chain_path"]
+
+        with ZipStreamWriter(output) as target:
+            for info in archive.infolist():
+                check_cancelled()
+                name = info.filename
+                if name == calc_chain_path:
+                    # 单元格移动后计算链失效，Excel 打开时会重新生成
+                    continue
+
+                if name in sheet_paths:
+                    with phase("改写工作表", part=name):
+                        self._transform_sheet(archive, info, target, (sheet_writers or {}).get(name))
+                elif name == parts["workbook_path"]:
+                    self._copy_rewritten(target, info, self._rewrite_workbook(archive.read(name)))
+                elif calc_chain_path and name == parts["workbook_rels_path"]:
+                    self._copy_rewritten(target, info, self._drop_relationship(archive.read(name), CALC_CHAIN_REL_TYPE))
+                elif calc_chain_path and name == "[Content_Types].xml":
+                    self._copy_rewritten(target, info, self._drop_override(archive.read(name), calc_chain_path))
+                else:
+                    self._copy_entry(archive, info, target, buffer)
+
+    def _copy_entry(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo, target: ZipStreamWriter, buffer=None):
+        """
+        原样复制一个部件
+
+        CRC 和大小沿用中央目录中的记录，压缩数据从源文件的 memoryview 切片直接写出，
+        大部件（如共享字符串）既不解压也不进入中间字节对象。
+        没有源文件内容或条目加密、本地文件头异常时，按块解压后重新压缩。
+        """
+        data = raw_entry_data(buffer, info) if buffer is not None else None
+        if data is not None:
+            with data:
+                target.write_raw(self._new_info(info, info.compress_type), data, info.CRC, info.file_size)
+            return
+        force_zip64 = info.file_size > zipfile.ZIP64_LIMIT // 2
+        with archive.open(info) as source, target.open(self._new_info(info), force_zip64=force_zip64) as sink:
+            shutil.copyfileobj(source, sink, COPY_CHUNK_SIZE)
+
+    def _copy_rewritten(self, target: ZipStreamWriter, info: zipfile.ZipInfo, data: bytes):
+        """以源条目的元数据写入新内容"""
+        target.writestr(self._new_info(info), data)
+
+    @staticmethod
+    def _new_info(info: zipfile.ZipInfo, compress_type: int = zipfile.ZIP_DEFLATED) -> zipfile.ZipInfo:
+        """沿用源条目的名称、时间和属性，重新写出的内容使用 deflate 压缩"""
+        new_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+        new_info.compress_type = compress_type
+        new_info.external_attr = info.external_attr
+        return new_info
+
+    # ---- 工作表 ----
+
+    def _transform_sheet(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo, target: ZipStreamWriter,
+                         sheet_writer: Optional[Callable] = None):
+        """流式改写单个工作表"""
+        force_zip64 = info.file_size > zipfile.ZIP64_LIMIT // 2
+        with target.open(self._new_info(info), force_zip64=force_zip64) as sink:
+            if sheet_writer is not None:
+                row_count = sheet_writer(self, sink.write)
+                logger.info(f"快速引擎从缓存拼接工作表 {info.filename}: {row_count} 行")
+                return
+            last_row = self.row_limits.get(info.filename) if self.row_filter is not None else None
+            if last_row is None:
+                rewriter = _SheetRewriter(self)
+                with archive.open(info) as source:
+                    rewriter.run(source, sink.write)
+            else:
+                rewriter = _FilteringSheetRewriter(self, last_row)
+                self.row_filter.start_sheet()
+                try:
+                    with archive.open(info) as source:
+                        rewriter.run(source, sink.write)
+                finally:
+                    self.row_filter.close()
+                logger.info(f"工作表 {info.filename}: {self.row_filter.describe()}，删除 {rewriter.rows.dropped} 行")
+        logger.info(f"快速引擎处理工作表 {info.filename}: {rewriter.row_count} 行")
+
+    def rewrite_head(self, head: bytes, rows: Optional[RowMap] = None) -> bytes:
+        """
+        改写 sheetData 之前的部分：维度、视图和列宽
+
+        Args:
+            head: sheetData 之前的 XML
+            rows: 行过滤后的行号映射，提供时维度的行范围随之调整
+        """
+        head = re.sub(rb"<dimension\b[^>]*/>", lambda match: self._rewrite_dimension(match, rows), head)
+        head = re.sub(rb"<sheetView\b[^>]*[^/]>.*?</sheetView>", self._rewrite_sheet_view, head, flags=re.S)
+        head = re.sub(rb"<selection\b[^>]*/>", self._rewrite_selection, head)
+        head = re.sub(rb"<cols>(.*?)</cols>", self._rewrite_cols, head, flags=re.S)
+        return head
+
+    def rewrite_tail(self, tail: bytes, rows: Optional[RowMap] = None) -> bytes:
+        """
+        改写 sheetData 之后的部分：合并单元格、条件格式、数据验证等
+
+        Args:
+            tail: sheetData 之后的 XML
+            rows: 行过滤后的行号映射，提供时合并单元格和超链接随行移动，
+                其余区域与 openpyxl 引擎一样不调整行号
+        """
+        ranges = self.ranges
+        hyperlink_ref = ranges.single
+        if rows is not None:
+            def hyperlink_ref(ref: str) -> Optional[str]:
+                new_ref = ranges.single(ref)
+                return None if new_ref is None else rows.ref(new_ref)
+
+        tail = re.sub(rb"<autoFilter\b[^>]*?(?:/>|>.*?</autoFilter>)", self._rewrite_auto_filter, tail, flags=re.S)
+        tail = self._rewrite_list(tail, b"mergeCells", b"mergeCell", b"ref", lambda ref: self._merge_ref(ref, rows))
+        tail = self._rewrite_elements(tail, b"conditionalFormatting", b"sqref", ranges.sqref)
+        tail = self._rewrite_list(tail, b"dataValidations", b"dataValidation", b"sqref", ranges.sqref)
+        tail = self._rewrite_list(tail, b"hyperlinks", b"hyperlink", b"ref", hyperlink_ref)
+        tail = self._rewrite_list(tail, b"ignoredErrors", b"ignoredError", b"sqref", ranges.sqref)
+        tail = self._rewrite_list(tail, b"protectedRanges", b"protectedRange", b"sqref", ranges.sqref)
+        tail = self._rewrite_list(tail, b"colBreaks", b"brk", b"id", self._break_id)
+        tail = re.sub(
+            rb"<(x14:(?:conditionalFormatting|dataValidation|sparkline))\b[^>]*>.*?</\1>",
+            self._rewrite_x14, tail, flags=re.S
+        )
+        # 扩展区中的条目全部删除后，去掉空的容器
+        tail = re.sub(rb"<(x14:(?:conditionalFormattings|dataValidations))\b[^>]*>\s*</\1>", b"", tail)
+        return tail
+
+    def _rewrite_dimension(self, match, rows: Optional[RowMap] = None) -> bytes:
+        tag = match.group(0)
+        ref = _attr(tag, b"ref")
+        if ref is None:
+            return tag
+        new_ref = self.ranges.bounding(ref)
+        if new_ref is not None and rows is not None:
+            new_ref = rows.ref(new_ref)
+        return _set_attr(tag, b"ref", new_ref or "A1")
+
+    def _rewrite_sheet_view(self, match) -> bytes:
+        view = match.group(0)
+        pane_match = re.search(rb"<pane\b[^>]*/>", view)
+        if pane_match is None:
+            return view
+        active = _attr(pane_match.group(0), b"activePane")
+        pane = self._rewrite_pane(pane_match)
+        new_active = None
+        if pane and active in ("topRight", "bottomRight") and _attr(pane, b"xSplit") is None:
+            # 冻结的列都已不存在、只剩冻结行时，可滚动的只有左下窗格
+            new_active = "bottomLeft"
+            pane = _set_attr(pane, b"activePane", new_active)
+        view = view[:pane_match.start()] + pane + view[pane_match.end():]
+
+        if not pane:
+            # 冻结的行列都已不存在时去掉窗格，选择区域不再指定窗格
+            return self._keep_selection(view, active, None)
+        if new_active is not None:
+            return self._keep_selection(view, active, new_active)
+        return view
+
+    @staticmethod
+    def _keep_selection(view: bytes, active: Optional[str], pane: Optional[str]) -> bytes:
+        """只保留原活动窗格（找不到时为最后一个）的选择区域，并改为属于 pane 窗格（None 时不指定）"""
+        selections = list(re.finditer(rb"<selection\b[^>]*/>", view))
+        if not selections:
+            return view
+        kept = next((m for m in selections if _attr(m.group(0), b"pane") == active), selections[-1])
+        parts = []
+        position = 0
+        for selection in selections:
+            parts.append(view[position:selection.start()])
+            if selection is kept:
+                parts.append(_set_attr(selection.group(0), b"pane", pane))
+            position = selection.end()
+        parts.append(view[position:])
+        return b"".join(parts)
+
+    def _rewrite_pane(self, match) -> bytes:
+        tag = match.group(0)
+        x_split = _attr(tag, b"xSplit")
+        top_left = _attr(tag, b"topLeftCell")
+        if _attr(tag, b"state") in ("frozen", "frozenSplit"):
+            # 冻结列数为输出中开头连续的、原本就被冻结的列数；只冻结行时左上角始终在第一列
+            split = int(float(x_split or 0))
+            kept = 0
+            if self.column_map.is_projection:
+                for col in self.column_map.order:
+                    if col > split:
+                        break
+                    kept += 1
+            else:
+                kept = sum(1 for col in range(1, split + 1) if self.column_map.get(col) is not None)
+            tag = _set_attr(tag, b"xSplit", str(kept) if kept else None)
+            if not kept and not float(_attr(tag, b"ySplit") or 0):
+                return b""
+            match = _CELL_REF_RE.match(top_left or "")
+            if match is not None:
+                tag = _set_attr(tag, b"topLeftCell", self.ranges.letter(kept + 1) + match.group(4))
+        elif top_left is not None:
+            tag = _set_attr(tag, b"topLeftCell", self.ranges.cell(top_left))
+        return tag
+
+    def _rewrite_selection(self, match) -> bytes:
+        tag = match.group(0)
+        active = _attr(tag, b"activeCell")
+        if active is not None:
+            tag = _set_attr(tag, b"activeCell", self.ranges.cell(active))
+        sqref = _attr(tag, b"sqref")
+        if sqref is not None:
+            tag = _set_attr(tag, b"sqref", self.ranges.sqref(sqref))
+        return tag
+
+    def _rewrite_cols(self, match) -> bytes:
+        """列宽定义按映射拆分和移动，输出按列号排序且互不重叠"""
+        new_cols = []
+        for col_match in re.finditer(rb"<col\b[^>]*/>", match.group(1)):
+            tag = col_match.group(0)
+            min_col = int(_attr(tag, b"min"))
+            max_col = int(_attr(tag, b"max"))
+            for new_min, new_max in self.column_map.remap_span(min_col, max_col):
+                new_tag = _set_attr(tag, b"min", str(new_min))
+                new_cols.append((new_min, _set_attr(new_tag, b"max", str(new_max))))
+        if not new_cols:
+            return b""
+        new_cols.sort(key=lambda item: item[0])
+        return b"<cols>" + b"".join(tag for _, tag in new_cols) + b"</cols>"
+
+    def _rewrite_auto_filter(self, match) -> bytes:
+        """自动筛选区间只能是一个连续区间，筛选条件的 colId 是相对区间首列的偏移"""
+        element = match.group(0)
+        start_tag = re.match(rb"<autoFilter\b[^>]*?/?>", element).group(0)
+        ref = _attr(start_tag, b"ref")
+        if ref is None:
+            return element
+
+        new_ref = self.ranges.single(ref)
+        if new_ref is None:
+            return b""
+
+        min_col = column_index_from_string(re.match(r"\$?([A-Z]+)", ref).group(1))
+        new_min_col = column_index_from_string(re.match(r"\$?([A-Z]+)", new_ref).group(1))
+
+        def rewrite_filter_column(filter_match):
+            filter_tag = filter_match.group(0)
+            col_id = int(_attr(filter_tag, b"colId"))
+            new_column = self.column_map.get(min_col + col_id)
+            if new_column is None:
+                return b""
+            return re.sub(rb'colId="\d+"', b'colId="%d"' % (new_column - new_min_col), filter_tag, count=1)
+
+        element = re.sub(
+            rb"<filterColumn\b[^>]*?(?:/>|>.*?</filterColumn>)", rewrite_filter_column, element, flags=re.S
+        )
+        element = re.sub(rb"<(?:sortState|sortCondition)\b[^>]*>", self._rewrite_sort_ref, element)
+        return _set_attr(element[:len(start_tag)], b"ref", new_ref) + element[len(start_tag):]
+
+    def _rewrite_sort_ref(self, match) -> bytes:
+        tag = match.group(0)
+        ref = _attr(tag, b"ref")
+        if ref is None:
+            return tag
+        return _set_attr(tag, b"ref", self.ranges.bounding(ref) or ref)
+
+    def _merge_ref(self, ref: str, rows: Optional[RowMap] = None) -> Optional[str]:
+        """合并区域必须仍是一个至少包含两个单元格的连续区间，行方向取保留下来的首尾行"""
+        new_ref = self.ranges.single(ref)
+        if new_ref is not None and rows is not None:
+            new_ref = rows.ref(new_ref)
+        if new_ref is None or ":" not in new_ref:
+            return None
+        start, end = new_ref.split(":")
+        return None if start == end else new_ref
+
+    def _break_id(self, value: str) -> Optional[str]:
+        """分页符 id 表示在该列之后分页"""
+        new_column = self.column_map.get(int(value))
+        return None if new_column is None else str(new_column)
+
+    def _rewrite_elements(self, tail: bytes, tag: bytes, attr: bytes,
+                          rewrite: Callable[[str], Optional[str]]) -> bytes:
+        """改写同名元素的引用属性，引用全部失效的元素整体删除"""
+        pattern = re.compile(rb"<" + tag + rb"\b[^>]*?(?:/>|>.*?</" + tag + rb">)", re.S)
+
+        def replace(match):
+            element = match.group(0)
+            start_tag = re.match(rb"<" + tag + rb"\b[^>]*?/?>", element).group(0)
+            value = _attr(start_tag, attr)
+            if value is None:
+                return element
+            new_value = rewrite(value)
+            if new_value is None:
+                return b""
+            return _set_attr(start_tag, attr, new_value) + element[len(start_tag):]
+
+        return pattern.sub(replace, tail)
+
+    def _rewrite_list(self, tail: bytes, container: bytes, tag: bytes, attr: bytes,
+                      rewrite: Callable[[str], Optional[str]]) -> bytes:
+        """改写容器中的元素并更新 count 属性，容器为空时整体删除"""
+        pattern = re.compile(rb"(<" + container + rb"\b[^>]*>)(.*?)(</" + container + rb">)", re.S)
+
+        def replace(match):
+            start_tag, body, end_tag = match.groups()
+            body = self._rewrite_elements(body, tag, attr, rewrite)
+            count = len(re.findall(rb"<" + tag + rb"\b", body))
+            if count == 0:
+                return b""
+            for count_attr in (b"count", b"manualBreakCount"):
+                if _attr(start_tag, count_attr) is not None:
+                    start_tag = _set_attr(start_tag, count_attr, str(count))
+            return start_tag + body + end_tag
+
+        return pattern.sub(replace, tail)
+
+    def _rewrite_x14(self, match) -> bytes:
+        """扩展区中的条件格式、数据验证和迷你图使用 xm:sqref 保存位置"""
+        element = match.group(0)
+        sqref_match = re.search(rb"<xm:sqref>(.*?)</xm:sqref>", element, re.S)
+        if sqref_match is None:
+            return element
+        new_sqref = self.ranges.sqref(sqref_match.group(1).decode("utf-8"))
+        if new_sqref is None:
+            return b""
+        return element[:sqref_match.start(1)] + new_sqref.encode("utf-8") + element[sqref_match.end(1):]
+
+    # ---- 工作簿 ----
+
+    def _rewrite_workbook(self, data: bytes) -> bytes:
+        """改写打印区域、打印标题和筛选区域等内置名称中的列引用"""
+
+        def replace_name(match):
+            start_tag, name, body, end_tag = match.groups()
+            text = unescape(body.decode("utf-8"), {"&apos;": "'", "&quot;": '"'})
+
+            refs = []
+            for part in text.split(","):
+                ref_match = _DEFINED_NAME_REF_RE.fullmatch(part.strip())
+                if ref_match is None:
+                    refs.append(part)
+                    continue
+                prefix, ref = ref_match.groups()
+                spans = self.ranges.spans(ref)
+                if spans is None:
+                    refs.append(part)
+                elif name == b"_xlnm._FilterDatabase" and len(spans) != 1:
+                    # 与 autoFilter 一致：筛选区域无法保持连续时整体删除
+                    return b""
+                else:
+                    refs.extend(prefix + span for span in spans)
+
+            if not refs:
+                return b""
+            return start_tag + escape(",".join(refs)).encode("utf-8") + end_tag
+
+        return _DEFINED_NAME_RE.sub(replace_name, data)
+
+    @staticmethod
+    def _drop_relationship(data: bytes, rel_type: str) -> bytes:
+        return re.sub(rb'<Relationship\b[^>]*Type="' + re.escape(rel_type.encode("utf-8")) + rb'"[^>]*/>', b"", data)
+
+    @staticmethod
+    def _drop_override(data: bytes, part_path: str) -> bytes:
+        return re.sub(rb'<Override\b[^>]*PartName="/' + re.escape(part_path.encode("utf-8")) + rb'"[^>]*/>', b"", data)
+
+
+class _SheetRewriter:
+    """单个工作表的流式改写状态"""
+
+    def __init__(self, engine: FastXlsxEngine):
+        self.engine = engine
+        self.column_map = engine.column_map
+        self.ranges = engine.ranges
+        self.row_count = 0
+        self._row_number = 0
+        self._col_counter = 0
+        # 共享公式: si -> (主单元格坐标, 公式文本)
+        self._shared_formulas: Dict[bytes, Tuple[str, str]] = {}
+        # 列字母 -> (原始列号, 输出列字母)
+        self._ref_cache: Dict[bytes, Tuple[int, Optional[bytes]]] = {}
+        # 行过滤时当前行中非空单元格的 原始列号 -> 值
+        self._values: Optional[Dict[int, object]] = None
+
+    def run(self, source: BinaryIO, write: Callable[[bytes], None]):
+        """
+        读取源工作表 XML，改写后写出
+
+        Args:
+            source: 源工作表（解压后的）数据流
+            write: 输出函数
+        """
+        buffer = b""
+        # sheetData 之前的部分
+        while True:
+            chunk = source.read(READ_CHUNK_SIZE)
+            buffer += chunk
+            match = _SHEET_DATA_START_RE.search(buffer)
+            if match is not None or not chunk:
+                break
+
+        if match is None or match.group(1):
+            # 没有行数据，整个文件都作为头尾处理
+            buffer += source.read()
+            if match is None:
+                write(self._rewrite_head(buffer))
+                return
+            write(self._rewrite_head(buffer[:match.end()]))
+            write(self._rewrite_tail(buffer[match.end():]))
+            return
+
+        write(self._rewrite_head(buffer[:match.end()]))
+        buffer = buffer[match.end():]
+
+        # 行数据：每次处理缓冲区中所有完整的行
+        while True:
+            end = buffer.find(_SHEET_DATA_END)
+            if end >= 0:
+                write(self._rewrite_rows(buffer[:end], final=True)[0])
+                buffer = buffer[end:]
+                break
+
+            output, consumed = self._rewrite_rows(buffer, final=False)
+            write(output)
+            buffer = buffer[consumed:]
+
+            # 每读入一块检查一次是否已取消
+            check_cancelled()
+            chunk = source.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("工作表 XML 不完整：缺少 </sheetData>")
+            buffer += chunk
+
+        # sheetData 之后的部分
+        buffer += source.read()
+        write(self._rewrite_tail(buffer))
+
+    def _rewrite_head(self, head: bytes) -> bytes:
+        return self.engine.rewrite_head(head)
+
+    def _rewrite_tail(self, tail: bytes) -> bytes:
+        return self.engine.rewrite_tail(tail)
+
+    def _rewrite_rows(self, data: bytes, final: bool) -> Tuple[bytes, int]:
+        """改写数据中的完整行，返回输出和已消费的字节数"""
+        parts = []
+        position = 0
+        for match in _ROW_RE.finditer(data):
+            parts.append(data[position:match.start()])
+            parts.append(self._rewrite_row(match))
+            position = match.end()
+        if final:
+            parts.append(data[position:])
+            position = len(data)
+        return b"".join(parts), position
+
+    def _start_row(self, attrs: bytes) -> bytes:
+        """记录新行的行号，返回改写后的行属性"""
+        self.row_count += 1
+        number = _ROW_NUMBER_RE.search(attrs)
+        self._row_number = int(number.group(1)) if number else self._row_number + 1
+        self._col_counter = 0
+        # spans 只是读取优化提示，列变化后直接去掉
+        return _SPANS_RE.sub(b"", attrs)
+
+    def _rewrite_row(self, match) -> bytes:
+        attrs, closing, body = match.groups()
+        attrs = self._start_row(attrs)
+
+        if body is None:
+            return b"<row" + attrs + b"/>"
+
+        if self.column_map.is_projection:
+            # 列顺序可能改变，Excel 要求同一行的单元格按列号升序排列
+            cells = []
+            for cell_match in _CELL_RE.finditer(body):
+                fragment = self._rewrite_cell(cell_match)
+                if fragment:
+                    cells.append((self.column_map.get(self._col_counter), fragment))
+            cells.sort(key=lambda item: item[0])
+            body = b"".join(fragment for _, fragment in cells)
+        else:
+            body = _CELL_RE.sub(self._rewrite_cell, body)
+        return b"<row" + attrs + b">" + body + b"</row>"
+
+    def _parse_ref(self, ref: bytes) -> Tuple[int, Optional[bytes], bytes]:
+        """解析单元格引用为 (原始列号, 输出列字母, 行号)，列字母的解析结果会被缓存"""
+        split = len(ref.rstrip(b"0123456789"))
+        letters = ref[:split]
+        cached = self._ref_cache.get(letters)
+        if cached is None:
+            column = column_index_from_string(letters.decode("ascii"))
+            cached = self._ref_cache[letters] = (column, self._output_letters(column))
+        return cached[0], cached[1], ref[split:]
+
+    def _output_letters(self, column: int) -> Optional[bytes]:
+        """原始列在输出中的列字母，列被删除时返回 None"""
+        new_column = self.column_map.get(column)
+        return self.ranges.letter(new_column).encode("ascii") if new_column else None
+
+    def _rewrite_cell(self, match) -> bytes:
+        attrs, closing, body = match.groups()
+        ref_match = _R_ATTR_RE.search(attrs)
+        if ref_match is not None:
+            column, new_letters, row = self._parse_ref(ref_match.group(2))
+            self._col_counter = column
+        else:
+            # 没有 r 属性的单元格按位置推算，输出时补上显式引用
+            self._col_counter += 1
+            column = self._col_counter
+            row = str(self._row_number).encode("ascii")
+            new_letters = self._output_letters(column)
+
+        if body is not None and b"<f" in body:
+            body = self._rewrite_formula(body, column, row)
+
+        if self._values is not None:
+            value = self.engine.values.value(attrs, body)
+            if value is not None:
+                self._values[column] = value
+
+        if new_letters is None:
+            return b""
+
+        new_ref = b' r="' + new_letters + row + b'"'
+        if ref_match is not None:
+            attrs = attrs[:ref_match.start()] + new_ref + attrs[ref_match.end():]
+        else:
+            attrs = new_ref + attrs
+
+        if body is None:
+            return b"<c" + attrs + b"/>"
+        return b"<c" + attrs + b">" + body + b"</c>"
+
+    def _rewrite_formula(self, body: bytes, column: int, row: bytes) -> bytes:
+        """
+        公式文本保持不变（与 openpyxl 的 delete_cols 一致），
+        共享公式展开为普通公式，数组公式的范围随列移动
+        """
+        match = _FORMULA_RE.search(body)
+        if match is None:
+            return body
+        attrs, closing, text = match.groups()
+        formula_type = _attr(attrs, b"t")
+
+        if formula_type == "shared":
+            si = _attr(attrs, b"si").encode("ascii")
+            coordinate = f"{get_column_letter(column)}{row.decode('ascii')}"
+            if text:
+                formula = unescape(text.decode("utf-8"))
+                self._shared_formulas[si] = (coordinate, formula)
+            elif si in self._shared_formulas:
+                origin, master_formula = self._shared_formulas[si]
+                translated = Translator("=" + master_formula, origin=origin).translate_formula(coordinate)
+                formula = translated[1:]
+            else:
+                return body
+            new_formula = b"<f>" + escape(formula).encode("utf-8") + b"</f>"
+            return body[:match.start()] + new_formula + body[match.end():]
+
+        if formula_type in ("array", "dataTable"):
+            ref = _attr(attrs, b"ref")
+            if ref is not None:
+                start_tag = _FORMULA_START_RE.match(body, match.start()).group(0)
+                new_tag = _set_attr(start_tag, b"ref", self.ranges.bounding(ref) or ref)
+                return body[:match.start()] + new_tag + body[match.start() + len(start_tag):]
+
+        return body
+
+
+class _FilteringSheetRewriter(_SheetRewriter):
+    """
+    改写列的同时按行过滤条件删除行，保留的行依次上移
+
+    规则与 openpyxl 引擎的 _remap_worksheet 相同：不超过 last_row 的行逐行判断，
+    XML 中省略的行按空行处理，之后的行（只有行高等属性）不参与过滤、只随之上移。
+    读完 sheetData 之前无法确定维度，改写后的行先暂存（超过 ROW_SPOOL_SIZE 时写入临时文件），
+    最后依次写出头部、行数据和尾部，内存占用不随行数增长。
+    """
+
+    def __init__(self, engine: FastXlsxEngine, last_row: int):
+        super().__init__(engine)
+        self.row_filter = engine.row_filter
+        self.last_row = last_row
+        self.rows = RowMap()
+        self._values = {}
+        self._checked_row = 0
+        self._head = b""
+        self._tail = b""
+
+    def run(self, source: BinaryIO, write: Callable[[bytes], None]):
+        with tempfile.SpooledTemporaryFile(ROW_SPOOL_SIZE) as spool:
+            super().run(source, spool.write)
+            self._check_rows(self.last_row)
+            write(self.engine.rewrite_head(self._head, self.rows))
+            spool.seek(0)
+            while True:
+                chunk = spool.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                write(chunk)
+            write(self.engine.rewrite_tail(self._tail, self.rows))
+
+    def _rewrite_head(self, head: bytes) -> bytes:
+        self._head = head
+        return b""
+
+    def _rewrite_tail(self, tail: bytes) -> bytes:
+        self._tail = tail
+        return b""
+
+    def _check_rows(self, end: int):
+        """判断 XML 中省略的行（没有单元格），直到第 end 行"""
+        for row in range(self._checked_row + 1, min(end, self.last_row) + 1):
+            if not self.row_filter.keep(row, {}):
+                self.rows.drop(row)
+        self._checked_row = max(self._checked_row, end)
+
+    def _rewrite_row(self, match) -> bytes:
+        self._values = {}
+        output = super()._rewrite_row(match)
+        number = self._row_number
+        if number > self._checked_row:
+            self._check_rows(number - 1)
+        if self._checked_row < number <= self.last_row:
+            self._checked_row = number
+            if not self.row_filter.keep(number, self._values):
+                self.rows.drop(number)
+                return b""
+
+        new_number = number - self.rows.dropped
+        if new_number == number:
+            return output
+        # 单元格引用中的行号在改写列时保持原样（共享公式按原位置展开），这里统一换成新行号
+        new_row = str(new_number).encode("ascii")
+        start_tag = _ROW_START_RE.match(output).group(0)
+        return (_set_attr(start_tag, b"r", new_row.decode("ascii"))
+                + _CELL_ROW_RE.sub(rb"\g<1>" + new_row + b'"', output[len(start_tag):]))
+
+
+class SheetDecomposer(_SheetRewriter):
+    """
+    改写工作表的同时把行数据分解为与列映射无关的块
+
+    单元格引用中的列字母换成占位字节，共享公式展开为普通公式，数组公式的范围单独记录；
+    每攒够一块行就交给 store 保存，再按当前列映射拼接输出。
+    sheetData 前后的部分保留原文，之后可以按其他列映射重新改写。
+
+    块的结构为 (行起始标签列表, {列号: (行下标列表, 单元格片段列表)},
+    {列号: {行下标: 数组公式范围}}, {行下标: 单元格以外的内容})，可以直接用 marshal 保存。
+    """
+
+    def __init__(self, engine: FastXlsxEngine, store: Callable[[tuple], None],
+                 rows_per_chunk: int = ROWS_PER_CHUNK):
+        """
+        Args:
+            engine: 按当前列映射输出时使用的引擎
+            store: 保存一个行块的函数
+            rows_per_chunk: 每块的行数
+        """
+        super().__init__(engine)
+        self.head = b""
+        self.tail = b""
+        self.rows_per_chunk = rows_per_chunk
+        self._store = store
+        self._array_ref: Optional[str] = None
+        self._reset_chunk()
+
+    def _reset_chunk(self):
+        self._rows: List[bytes] = []
+        self._cells: Dict[int, Tuple[List[int], List[bytes]]] = {}
+        self._refs: Dict[int, Dict[int, str]] = {}
+        self._trailers: Dict[int, bytes] = {}
+
+    def _flush(self) -> bytes:
+        """保存当前块并返回按当前列映射拼接的输出"""
+        if not self._rows:
+            return b""
+        chunk = (self._rows, self._cells, self._refs, self._trailers)
+        self._store(chunk)
+        self._reset_chunk()
+        return assemble_chunk(self.engine, chunk)
+
+    def _rewrite_head(self, head: bytes) -> bytes:
+        self.head = head
+        return super()._rewrite_head(head)
+
+    def _rewrite_tail(self, tail: bytes) -> bytes:
+        self.tail = tail
+        return self._flush() + super()._rewrite_tail(tail)
+
+    def _rewrite_rows(self, data: bytes, final: bool) -> Tuple[bytes, int]:
+        # 行之间只有空白，不需要保留
+        output = []
+        position = 0
+        for match in _ROW_RE.finditer(data):
+            self._record_row(match)
+            position = match.end()
+            if len(self._rows) >= self.rows_per_chunk:
+                output.append(self._flush())
+        return b"".join(output), len(data) if final else position
+
+    def _record_row(self, match):
+        attrs, closing, body = match.groups()
+        attrs = self._start_row(attrs)
+        index = len(self._rows)
+
+        if body is None:
+            self._rows.append(b"<row" + attrs + b"/>")
+            return
+        self._rows.append(b"<row" + attrs + b">")
+
+        extra = []
+        position = 0
+        for cell_match in _CELL_RE.finditer(body):
+            if body[position:cell_match.start()].strip():
+                extra.append(body[position:cell_match.start()])
+            position = cell_match.end()
+
+            self._array_ref = None
+            fragment = self._rewrite_cell(cell_match)
+            column = self._col_counter
+            entry = self._cells.get(column)
+            if entry is None:
+                entry = self._cells[column] = ([], [])
+            entry[0].append(index)
+            entry[1].append(fragment)
+            if self._array_ref is not None:
+                self._refs.setdefault(column, {})[index] = self._array_ref
+
+        if body[position:].strip():
+            extra.append(body[position:])
+        if extra:
+            self._trailers[index] = b"".join(extra)
+
+    def _output_letters(self, column: int) -> Optional[bytes]:
+        return COLUMN_PLACEHOLDER
+
+    def _rewrite_formula(self, body: bytes, column: int, row: bytes) -> bytes:
+        match = _FORMULA_RE.search(body)
+        if match is not None and _attr(match.group(1), b"t") in ("array", "dataTable"):
+            ref = _attr(match.group(1), b"ref")
+            if ref is not None:
+                # 范围随列映射变化，拼接时再改写
+                self._array_ref = ref
+                start_tag = _FORMULA_START_RE.match(body, match.start()).group(0)
+                new_tag = _set_attr(start_tag, b"ref", REF_PLACEHOLDER.decode("ascii"))
+                return body[:match.start()] + new_tag + body[match.start() + len(start_tag):]
+        return super()._rewrite_formula(body, column, row)
+
+
+def assemble_chunk(engine: FastXlsxEngine, chunk: tuple) -> bytes:
+    """
+    按引擎的列映射拼接 SheetDecomposer 产生的行块
+
+    Args:
+        engine: 快速引擎
+        chunk: 行块
+
+    Returns:
+        bytes: 行块对应的 sheetData 内容
+    """
+    rows, cells, refs, trailers = chunk
+    column_map = engine.column_map
+
+    kept = sorted(
+        (new_column, column)
+        for new_column, column in ((column_map.get(column), column) for column in cells)
+        if new_column is not None
+    )
+
+    row_cells: List[List[bytes]] = [[] for _ in rows]
+    for new_column, column in kept:
+        letters = engine.ranges.letter(new_column).encode("ascii")
+        indexes, fragments = cells[column]
+        column_refs = refs.get(column)
+        for index, fragment in zip(indexes, fragments):
+            fragment = fragment.replace(COLUMN_PLACEHOLDER, letters, 1)
+            if column_refs is not None and index in column_refs:
+                ref = column_refs[index]
+                new_ref = engine.ranges.bounding(ref) or ref
+                fragment = fragment.replace(REF_PLACEHOLDER, new_ref.encode("utf-8"), 1)
+            row_cells[index].append(fragment)
+
+    parts = []
+    for index, tag in enumerate(rows):
+        parts.append(tag)
+        if tag.endswith(b"/>"):
+            continue
+        parts.extend(row_cells[index])
+        if index in trailers:
+            parts.append(trailers[index])
+        parts.append(b"</row>")
+    return b"".join(parts)
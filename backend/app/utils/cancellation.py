@@ -0,0 +1,137 @@
+"""
+处理取消工具模块
+客户端断开后通过取消令牌通知处理线程，处理线程在工作表、行块之间的检查点退出
+"""
+
+import gc
+import threading
+import contextlib
+import traceback
+from typing import Callable, Optional
+
+_local = threading.local()
+
+
+class JobCancelled(BaseException):
+    """
+    处理已被取消
+
+    与 asyncio.CancelledError 一样继承 BaseException，
+    避免被引擎回退、错误包装等 except Exception 分支当作普通错误重新处理。
+    """
+
+
+class CancelToken:
+    """取消令牌，由控制器在客户端断开时取消，处理线程在检查点检查"""
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "客户端已断开连接"):
+        """取消处理，可在任意线程中调用，重复调用时保留第一次的原因"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def check(self):
+        """
+        Raises:
+            JobCancelled: 令牌已被取消时
+        """
+        if self._event.is_set():
+            raise JobCancelled(self.reason)
+
+
+@contextlib.contextmanager
+def activate_token(token: Optional[CancelToken]):
+    """在当前线程中启用取消令牌，token 为 None 时不做任何事"""
+    if token is None:
+        yield
+        return
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(token)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def bind_token(token: Optional[CancelToken], func: Callable) -> Callable:
+    """返回在执行线程中启用取消令牌后再调用 func 的函数"""
+    if token is None:
+        return func
+
+    def cancellable(*args, **kwargs):
+        with activate_token(token):
+            return func(*args, **kwargs)
+
+    return cancellable
+
+
+def current_token() -> Optional[CancelToken]:
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def check_cancelled():
+    """
+    检查点：当前线程的处理已被取消时抛出 JobCancelled，未启用令牌时开销可忽略
+
+    Raises:
+        JobCancelled: 处理已被取消时
+    """
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].check()
+
+
+class CancellableFile:
+    """
+    在每次读写前检查取消令牌的文件包装
+
+    用于 openpyxl 的加载和保存：这两步内部无法插入检查点，
+    但会持续读写文件，取消后在下一次读写时即可退出。
+    取消后不再写出数据，避免未关闭的 ZipFile 在回收时写入中央目录并再次报错。
+    """
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._stopped = False
+
+    def read(self, *args):
+        check_cancelled()
+        return self._file.read(*args)
+
+    def write(self, data) -> int:
+        if self._stopped:
+            return len(data)
+        try:
+            check_cancelled()
+        except JobCancelled:
+            self._stopped = True
+            raise
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def release_memory(error: BaseException):
+    """
+    清除异常回溯中已结束栈帧的局部变量并立即回收
+
+    处理被中断时，工作簿等大对象仍被回溯中的栈帧引用，且 openpyxl 对象之间
+    存在循环引用，只靠引用计数不会释放，需要主动进行一次垃圾回收。
+
+    Args:
+        error: 中断处理的异常
+    """
+    traceback.clear_frames(error.__traceback__)
+    gc.collect()
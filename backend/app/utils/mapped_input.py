@@ -0,0 +1,141 @@
+"""
+输入文件映射模块
+磁盘上的 Excel 文件通过 mmap 只读映射，zip 部件以 memoryview 切片访问，
+不需要把整个文件读入 Python 字节对象
+"""
+
+import io
+import os
+import mmap
+import hashlib
+from typing import BinaryIO, Union
+
+# 服务接受的输入：文件内容、文件路径，或已打开的文件对象
+ExcelSource = Union[bytes, str, os.PathLike, BinaryIO]
+
+
+class _MappedReader(io.RawIOBase):
+    """内存映射上的只读文件对象，读取时从 memoryview 切片复制所需的部分"""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            # 与普通文件一致抛出 OSError，zipfile 据此判断文件过短而不是 zip 格式
+            raise OSError(22, "定位位置不能为负数")
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = self._view[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self._view[self._pos:self._pos + len(b)]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class MappedInput:
+    """
+    只读的 Excel 输入
+
+    字节内容直接使用；文件路径和带文件描述符的文件对象（如已落盘的上传临时文件）
+    映射到内存，页面由操作系统按需读入，不计入进程堆内存。
+    映射持有自己的文件描述符，原文件对象关闭后仍然可用。
+    """
+
+    def __init__(self, source: ExcelSource):
+        self._mmap = None
+        self._readers = []
+        self._digest = None
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.buffer = source
+        elif isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                self._map(f)
+        else:
+            try:
+                # 缓冲区中尚未写入文件的数据对映射不可见
+                source.flush()
+                self._map(source)
+            except (AttributeError, io.UnsupportedOperation):
+                # 没有文件描述符的文件对象（如 BytesIO）只能读出内容
+                source.seek(0)
+                self.buffer = source.read()
+
+    def _map(self, f: BinaryIO):
+        fileno = f.fileno()
+        if os.fstat(fileno).st_size == 0:
+            # 空文件无法映射
+            self.buffer = b""
+            return
+        self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        self.buffer = self._mmap
+
+    @property
+    def is_mapped(self) -> bool:
+        """内容是否来自内存映射"""
+        return self._mmap is not None
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    @property
+    def digest(self) -> str:
+        """内容的 SHA-256 摘要（十六进制），首次访问时计算"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.buffer).hexdigest()
+        return self._digest
+
+    def open(self) -> BinaryIO:
+        """
+        获取可定位的只读文件对象，供 zipfile / openpyxl 读取
+
+        每次调用返回独立的文件对象，各自维护读取位置，随 close() 一起关闭。
+        """
+        if self._mmap is not None:
+            reader = _MappedReader(self._mmap)
+            self._readers.append(reader)
+            return reader
+        return io.BytesIO(self.buffer)
+
+    def close(self):
+        """关闭读取对象并解除映射"""
+        for reader in self._readers:
+            reader.close()
+        self._readers = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self.buffer = b""
+
+    def __enter__(self) -> "MappedInput":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,155 @@
+"""
+流式输出工具模块
+把“写入文件对象”的生产过程转换为按块产出的迭代器
+"""
+
+import queue
+import logging
+import threading
+from typing import Callable, Iterator, BinaryIO, Optional
+
+from utils.cancellation import CancelToken, JobCancelled, release_memory
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_CHUNKS = 16
+
+_END = object()
+
+
+class StreamClosed(Exception):
+    """消费方已停止读取，生产方应尽快退出"""
+
+
+class QueueWriter:
+    """
+    不可定位（non-seekable）的只写文件对象
+    写入的数据按块放入有界队列，由另一线程取出
+
+    zipfile 在不可定位的输出上会为每个条目写入数据描述符（data descriptor），
+    因此条目可以边压缩边输出，不需要回填本地文件头。
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, max_chunks: int = DEFAULT_MAX_CHUNKS,
+                 cancel: Optional[CancelToken] = None):
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=max_chunks)
+        self.closed = False
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+        self._token = cancel
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        raise OSError("QueueWriter 不支持定位")
+
+    def write(self, data) -> int:
+        self._check_open()
+
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            chunk = bytes(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+            self._put(chunk)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _put(self, item):
+        # 队列满时阻塞，形成背压；同时定期检查消费方是否已放弃
+        while True:
+            self._check_open()
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self):
+        """写出剩余数据并标记结束"""
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def cancel(self):
+        """消费方放弃读取"""
+        self._cancelled.set()
+
+    def _check_open(self):
+        if self._cancelled.is_set() or (self._token is not None and self._token.cancelled):
+            raise StreamClosed("输出流已被关闭")
+
+
+def iter_written_chunks(
+    produce: Callable[[BinaryIO], None],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_chunks: int = DEFAULT_MAX_CHUNKS,
+    cancel: Optional[CancelToken] = None,
+) -> Iterator[bytes]:
+    """
+    在后台线程中执行写入函数，并以数据块的形式迭代其输出
+
+    内存占用受 chunk_size * max_chunks 限制，与输出总大小无关。
+
+    Args:
+        produce: 接收一个文件对象并向其写入数据的函数
+        chunk_size: 每个数据块的大小
+        max_chunks: 队列中最多缓存的数据块数量
+        cancel: 可选的取消令牌，取消后写入立即失败，后台线程退出并释放内存
+
+    Returns:
+        Iterator[bytes]: 输出数据块迭代器
+
+    Raises:
+        Exception: 写入函数中出现的异常会在迭代时重新抛出
+        JobCancelled: 处理被取消时
+    """
+    writer = QueueWriter(chunk_size=chunk_size, max_chunks=max_chunks, cancel=cancel)
+    errors = []
+
+    def run():
+        try:
+            produce(writer)
+            writer.finish()
+        except StreamClosed as e:
+            logger.info("客户端已停止接收，终止输出")
+            release_memory(e)
+        except JobCancelled as e:
+            logger.info(f"处理已取消: {e}")
+            release_memory(e)
+            errors.append(e)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                writer._put(_END)
+            except StreamClosed:
+                # 处理被取消时消费方可能仍在等待下一块，放入结束标记让其退出；
+                # 队列已满说明消费方没有在等待
+                try:
+                    writer.queue.put_nowait(_END)
+                except queue.Full:
+                    pass
+
+    thread = threading.Thread(target=run, name="stream-writer", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = writer.queue.get()
+            if item is _END:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+        if cancel is not None:
+            cancel.check()
+    finally:
+        writer.cancel()
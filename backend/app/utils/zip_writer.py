@@ -0,0 +1,270 @@
+"""
+zip 输出模块
+按顺序写出 zip 条目，输出可以是不可定位的流；
+未改动的条目直接写出源文件中的压缩数据，不解压也不重新压缩
+"""
+
+import zlib
+import struct
+import zipfile
+from typing import BinaryIO, List, Optional
+
+# zip 格式中的记录结构（APPNOTE.TXT 4.3）
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+_ZIP64_END_RECORD = struct.Struct("<4sQ2H2L4Q")
+_ZIP64_END_LOCATOR = struct.Struct("<4sLQL")
+_DESCRIPTOR = struct.Struct("<4sL2L")
+_ZIP64_DESCRIPTOR = struct.Struct("<4sL2Q")
+
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+_CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+_END_RECORD_SIGNATURE = b"PK\x05\x06"
+_ZIP64_END_RECORD_SIGNATURE = b"PK\x06\x06"
+_ZIP64_END_LOCATOR_SIGNATURE = b"PK\x06\x07"
+_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+
+_ZIP64_EXTRA_ID = 0x0001
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_COUNT_LIMIT = 0xFFFF
+
+# 通用标志位：加密、数据描述符、UTF-8 文件名
+_FLAG_ENCRYPTED = 0x01
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+_VERSION_DEFAULT = 20
+_VERSION_ZIP64 = 45
+
+# 写出源文件中的压缩数据时每次写出的大小
+RAW_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def raw_entry_data(buffer, info: zipfile.ZipInfo) -> Optional[memoryview]:
+    """
+    定位源文件中条目的压缩数据
+
+    Args:
+        buffer: 源 zip 文件的完整内容（bytes 或 mmap）
+        info: 条目信息，偏移量和压缩大小取自中央目录
+
+    Returns:
+        Optional[memoryview]: 压缩数据的切片；加密或本地文件头异常的条目返回 None
+    """
+    if info.flag_bits & _FLAG_ENCRYPTED:
+        return None
+    offset = info.header_offset
+    header = bytes(buffer[offset:offset + _LOCAL_HEADER.size])
+    if len(header) != _LOCAL_HEADER.size:
+        return None
+    fields = _LOCAL_HEADER.unpack(header)
+    if fields[0] != _LOCAL_HEADER_SIGNATURE:
+        return None
+    start = offset + _LOCAL_HEADER.size + fields[9] + fields[10]
+    end = start + info.compress_size
+    if end > len(buffer):
+        return None
+    return memoryview(buffer)[start:end]
+
+
+def _dos_time(date_time) -> tuple:
+    year, month, day, hour, minute, second = date_time[:6]
+    year = min(max(year, 1980), 2107)
+    return hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day
+
+
+class _Entry:
+    """已写出的条目，关闭输出时写入中央目录"""
+
+    def __init__(self, info: zipfile.ZipInfo, name: bytes, flags: int, offset: int, zip64: bool):
+        self.info = info
+        self.name = name
+        self.flags = flags
+        self.offset = offset
+        self.zip64 = zip64
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+
+class _EntryWriter:
+    """流式写入单个条目：边写边压缩，结束时写出数据描述符"""
+
+    def __init__(self, writer: "ZipStreamWriter", entry: _Entry, zip64: bool):
+        self._writer = writer
+        self._entry = entry
+        self._zip64 = zip64
+        self._compressor = (zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+                            if entry.info.compress_type == zipfile.ZIP_DEFLATED else None)
+
+    def write(self, data) -> int:
+        entry = self._entry
+        size = len(data)
+        entry.file_size += size
+        entry.crc = zlib.crc32(data, entry.crc)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        if data:
+            entry.compress_size += len(data)
+            self._writer._write(data)
+        return size
+
+    def close(self):
+        entry = self._entry
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            entry.compress_size += len(tail)
+            self._writer._write(tail)
+            self._compressor = None
+        if not self._zip64 and max(entry.file_size, entry.compress_size) > _ZIP64_LIMIT:
+            raise zipfile.LargeZipFile(f"条目 {entry.info.filename} 超过 4GB，需要 zip64 格式")
+        descriptor = _ZIP64_DESCRIPTOR if self._zip64 else _DESCRIPTOR
+        self._writer._write(descriptor.pack(_DESCRIPTOR_SIGNATURE, entry.crc, entry.compress_size, entry.file_size))
+        self._writer._entries.append(entry)
+
+    def __enter__(self) -> "_EntryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class ZipStreamWriter:
+    """
+    顺序写出的 zip 文件
+
+    只向输出追加数据、从不定位，输出可以是 socket 或队列等不可定位的流。
+    条目的名称、时间、压缩方式和属性取自传入的 ZipInfo。
+    """
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+        self._offset = 0
+        self._entries: List[_Entry] = []
+        self._closed = False
+
+    def _write(self, data):
+        self.output.write(data)
+        self._offset += len(data)
+
+    def _start_entry(self, info: zipfile.ZipInfo, flags: int, crc: int, compress_size: int,
+                     file_size: int, zip64: bool) -> _Entry:
+        """写出本地文件头"""
+        name = info.filename.encode("utf-8")
+        if not info.filename.isascii():
+            flags |= _FLAG_UTF8
+        entry = _Entry(info, name, flags, self._offset, zip64)
+        extra = b""
+        if zip64:
+            extra = struct.pack("<2H2Q", _ZIP64_EXTRA_ID, 16, file_size, compress_size)
+            compress_size = file_size = _ZIP64_LIMIT
+        dos_time, dos_date = _dos_time(info.date_time)
+        self._write(_LOCAL_HEADER.pack(
+            _LOCAL_HEADER_SIGNATURE, _VERSION_ZIP64 if zip64 else _VERSION_DEFAULT, flags,
+            info.compress_type, dos_time, dos_date, crc, compress_size, file_size, len(name), len(extra),
+        ))
+        self._write(name)
+        self._write(extra)
+        return entry
+
+    def open(self, info: zipfile.ZipInfo, force_zip64: bool = False) -> _EntryWriter:
+        """
+        流式写入一个条目（只支持 deflate 和不压缩），大小和 CRC 写在数据之后的描述符中
+
+        Args:
+            info: 条目信息
+            force_zip64: 条目可能超过 4GB 时需要指定
+        """
+        if info.compress_type not in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED):
+            raise ValueError(f"不支持的压缩方式: {info.compress_type}")
+        entry = self._start_entry(info, _FLAG_DATA_DESCRIPTOR, 0, 0, 0, force_zip64)
+        return _EntryWriter(self, entry, force_zip64)
+
+    def writestr(self, info: zipfile.ZipInfo, data: bytes):
+        """写入内容已知的条目"""
+        if info.compress_type not in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED):
+            raise ValueError(f"不支持的压缩方式: {info.compress_type}")
+        crc = zlib.crc32(data)
+        file_size = len(data)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            data = compressor.compress(data) + compressor.flush()
+        self.write_raw(info, data, crc, file_size)
+
+    def write_raw(self, info: zipfile.ZipInfo, data, crc: int, file_size: int):
+        """
+        写入已压缩的条目数据
+
+        Args:
+            info: 条目信息，压缩方式需与数据一致
+            data: 压缩后的数据（bytes 或 memoryview），分块写出
+            crc: 未压缩内容的 CRC-32
+            file_size: 未压缩内容的大小
+        """
+        compress_size = len(data)
+        zip64 = max(file_size, compress_size) > _ZIP64_LIMIT
+        entry = self._start_entry(info, 0, crc, compress_size, file_size, zip64)
+        with memoryview(data) as view:
+            for start in range(0, compress_size, RAW_COPY_CHUNK_SIZE):
+                self._write(view[start:start + RAW_COPY_CHUNK_SIZE])
+        entry.crc = crc
+        entry.compress_size = compress_size
+        entry.file_size = file_size
+        self._entries.append(entry)
+
+    def close(self):
+        """写出中央目录和结束记录"""
+        if self._closed:
+            return
+        self._closed = True
+        start = self._offset
+        for entry in self._entries:
+            self._write_central_header(entry)
+        size = self._offset - start
+        count = len(self._entries)
+
+        if count > _ZIP64_COUNT_LIMIT or size > _ZIP64_LIMIT or start > _ZIP64_LIMIT:
+            record_offset = self._offset
+            self._write(_ZIP64_END_RECORD.pack(
+                _ZIP64_END_RECORD_SIGNATURE, _ZIP64_END_RECORD.size - 12, _VERSION_ZIP64, _VERSION_ZIP64,
+                0, 0, count, count, size, start,
+            ))
+            self._write(_ZIP64_END_LOCATOR.pack(_ZIP64_END_LOCATOR_SIGNATURE, 0, record_offset, 1))
+            count = min(count, _ZIP64_COUNT_LIMIT)
+            size = min(size, _ZIP64_LIMIT)
+            start = min(start, _ZIP64_LIMIT)
+        self._write(_END_RECORD.pack(_END_RECORD_SIGNATURE, 0, 0, count, count, size, start, 0))
+        self.output.flush()
+
+    def _write_central_header(self, entry: _Entry):
+        info = entry.info
+        file_size, compress_size, offset = entry.file_size, entry.compress_size, entry.offset
+        fields = []
+        if file_size > _ZIP64_LIMIT:
+            fields.append(file_size)
+            file_size = _ZIP64_LIMIT
+        if compress_size > _ZIP64_LIMIT:
+            fields.append(compress_size)
+            compress_size = _ZIP64_LIMIT
+        if offset > _ZIP64_LIMIT:
+            fields.append(offset)
+            offset = _ZIP64_LIMIT
+        extra = struct.pack(f"<2H{len(fields)}Q", _ZIP64_EXTRA_ID, 8 * len(fields), *fields) if fields else b""
+        version = _VERSION_ZIP64 if fields or entry.zip64 else _VERSION_DEFAULT
+        dos_time, dos_date = _dos_time(info.date_time)
+        self._write(_CENTRAL_HEADER.pack(
+            _CENTRAL_HEADER_SIGNATURE, info.create_system << 8 | version, version, entry.flags,
+            info.compress_type, dos_time, dos_date, entry.crc, compress_size, file_size,
+            len(entry.name), len(extra), 0, 0, info.internal_attr, info.external_attr, offset,
+        ))
+        self._write(entry.name)
+        self._write(extra)
+
+    def __enter__(self) -> "ZipStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,62 @@
+"""
+目录监控入口
+监控输入目录，自动删除新 Excel 文件中的指定列并输出到结果目录
+
+用法:
+    python watch.py --input ./inbox --output ./outbox --columns 3,5
+"""
+
+import argparse
+import logging
+import multiprocessing
+import sys
+
+from controllers.excel_controller import parse_column_indices
+from services.watch_service import FolderWatcher
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监控目录并自动删除 Excel 文件中的指定列")
+    parser.add_argument("--input", required=True, help="监控的输入目录")
+    parser.add_argument("--output", required=True, help="结果输出目录")
+    parser.add_argument("--columns", required=True, help="要删除的列索引，用逗号分隔，如：3,5")
+    parser.add_argument("--workers", type=int, default=2, help="工作进程数（默认 2）")
+    parser.add_argument("--settle", type=float, default=2.0, help="文件保持不变多少秒后开始处理（默认 2）")
+    parser.add_argument("--interval", type=float, default=1.0, help="轮询间隔秒数（默认 1）")
+    parser.add_argument("--once", action="store_true", help="处理完当前文件后退出")
+    args = parser.parse_args()
+
+    try:
+        column_indices = parse_column_indices(args.columns)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        watcher = FolderWatcher(
+            input_dir=args.input,
+            output_dir=args.output,
+            column_indices=column_indices,
+            workers=args.workers,
+            settle_seconds=args.settle,
+            poll_interval=args.interval,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        logger.info("收到中断信号，停止监控")
+        watcher.stop()
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    # 打包为可执行文件时，多进程需要此调用
+    multiprocessing.freeze_support()
+    sys.exit(main())